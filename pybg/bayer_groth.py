@@ -3,30 +3,145 @@ Verifier for a Bayer-Groth shuffle argument
 """
 
 import math
+from collections import OrderedDict
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 from dataclasses import dataclass
 
 from bg_types import G1Point, G1PointVector
-import gprod, sameexp, multiexp
-from util import msm
+import gprod, sameexp, multiexp, validation
+import inner_product as ipa
+from util import msm, msm_multi, multiply, check_equations, FixedBasePoint, ScaledBasis, fixed_base_window_size
 from transcript import Transcript
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
 # Number of blinders we need in the shuffle proof
 N_BLINDERS = 4
 
+def get_n_blinders(k: int) -> int:
+    """
+    Return the number of blinders needed to shuffle `k` columns (see `verify_columns()`): one per column for the
+    blinded MSMs of the columns, and two for the grand-product argument. That's `N_BLINDERS` for two columns.
+    """
+    return k + 2
+
+def get_crs_size(ell: int, k: int = 2) -> int:
+    """
+    Return the number of points in the `vec_G` of a CRS for shuffles of `k` columns of `ell` elements: `ell` and at least
+    `get_n_blinders(k)` blinders, rounded up to a power of two. The points left over after `ell` are all blinders.
+
+    The subarguments fold `vec_G` in halves, so its length must be a power of two. Padding it with the point at infinity
+    would leave the padded positions unbound, so the padding goes to blinders against real generators instead.
+    """
+    return 1 << (ell + get_n_blinders(k) - 1).bit_length()
+
+# Versions of the shuffle proof (see `ShuffleProof.version`). Both versions have the same subproofs, but in
+# `PROOF_VERSION_JOINT` the recursion of the inner product argument inside the grand-product argument runs along with the
+# recursion of the multi-exponentiation argument: they share their round challenges, and the prover folds `vec_G` once
+# per round instead of twice.
+PROOF_VERSION_SEPARATE = 1
+PROOF_VERSION_JOINT = 2
+PROOF_VERSIONS = (PROOF_VERSION_SEPARATE, PROOF_VERSION_JOINT)
+
+# Number of verifier keys kept around by `get_verifier_key()`
+VERIFIER_KEY_CACHE_SIZE = 8
+
 @dataclass
 class ShuffleCRS:
     """
-    The CRS of the shuffle proof. Includes basis elements used in the various subarguments.
+    The CRS of the shuffle proof. Includes basis elements used in the various subarguments. For shuffles of `ell`
+    elements, `vec_G` holds `get_crs_size(ell)` points.
     """
     vec_G: G1PointVector
     U: G1Point
     G_t: G1Point
     G_u: G1Point
 
+    @property
+    def vec_G_blind(self) -> G1PointVector:
+        """The blinding base of each column: `G_t` for `vec_T` and `G_u` for `vec_U`"""
+        return [self.G_t, self.G_u]
+
+@dataclass
+class ShuffleColumnsCRS:
+    """
+    The CRS of a shuffle of `k` columns (see `verify_columns()`): like a `ShuffleCRS`, but with a blinding base for
+    every column. `vec_G` holds `get_crs_size(ell, k)` points.
+    """
+    vec_G: G1PointVector
+    U: G1Point
+    vec_G_blind: G1PointVector
+
+def prepare_crs(crs: ShuffleCRS, window: int = None) -> ShuffleCRS:
+    """
+    Return a copy of `crs` whose generators carry fixed-base tables (see `util.FixedBasePoint`).
+
+    The tables take a while to build but make every MSM and scalar multiplication against the CRS much faster, so this
+    is worth it when proving or verifying many shuffles against the same CRS. The prepared CRS can be used anywhere a
+    regular CRS is used.
+
+    `window` trades memory for speed. By default, `vec_G` gets a large window suited for MSMs and the single generators
+    get a small window suited for scalar multiplications.
+    """
+    vec_G_window = window or fixed_base_window_size(len(crs.vec_G))
+    point_window = window or fixed_base_window_size(1)
+    if isinstance(crs, ShuffleColumnsCRS):
+        return ShuffleColumnsCRS([FixedBasePoint(G, vec_G_window) for G in crs.vec_G],
+                                 FixedBasePoint(crs.U, point_window),
+                                 [FixedBasePoint(G, point_window) for G in crs.vec_G_blind])
+    return ShuffleCRS([FixedBasePoint(G, vec_G_window) for G in crs.vec_G],
+                      FixedBasePoint(crs.U, point_window),
+                      FixedBasePoint(crs.G_t, point_window),
+                      FixedBasePoint(crs.G_u, point_window))
+
+
+@dataclass
+class PreparedShuffleCRS:
+    """
+    Verifier key: the values that the verifier derives from the CRS alone when checking shuffles of `ell` elements.
+    """
+    crs: ShuffleCRS
+    ell: int
+    # The sum of all the points of `crs.vec_G`
+    sum_vec_G: G1Point
+    # The sum of the non-blinder points `crs.vec_G[:ell]`
+    sum_vec_G_ell: G1Point
+    # The blinding bases of the columns with fixed-base tables
+    vec_G_blind: list
+
+def prepare_verifier_key(crs: ShuffleCRS, ell: int) -> PreparedShuffleCRS:
+    """Compute the verifier key of `crs` for shuffles of `ell` elements"""
+    sum_vec_G_ell = curve.Z1
+    for G in crs.vec_G[:ell]:
+        sum_vec_G_ell = curve.add(sum_vec_G_ell, G)
+    sum_vec_G = sum_vec_G_ell
+    for G in crs.vec_G[ell:]:
+        sum_vec_G = curve.add(sum_vec_G, G)
+
+    point_window = fixed_base_window_size(1)
+    return PreparedShuffleCRS(crs, ell, sum_vec_G, sum_vec_G_ell,
+                              [FixedBasePoint(G, point_window) for G in crs.vec_G_blind])
+
+verifier_keys = OrderedDict() # maps `(id(crs), ell)` to a `PreparedShuffleCRS`, least recently used first
+
+def get_verifier_key(crs: ShuffleCRS, ell: int) -> PreparedShuffleCRS:
+    """
+    Return the verifier key of `crs` for shuffles of `ell` elements. The last `VERIFIER_KEY_CACHE_SIZE` keys are cached,
+    so a node that verifies many shuffles against the same CRS only prepares it once.
+
+    The cache is keyed by the identity of `crs`, which must not be modified once it has been used.
+    """
+    key = (id(crs), ell)
+    prepared = verifier_keys.get(key)
+    # The `id()` of a CRS that was garbage-collected can be reused, so also check that it's the same object
+    if prepared is None or prepared.crs is not crs:
+        prepared = verifier_keys[key] = prepare_verifier_key(crs, ell)
+    verifier_keys.move_to_end(key)
+    while len(verifier_keys) > VERIFIER_KEY_CACHE_SIZE:
+        verifier_keys.popitem(last=False)
+    return prepared
+
 
 @dataclass
 class ShuffleProof:
@@ -37,51 +152,370 @@ class ShuffleProof:
     gprod_proof: gprod.GrandProductProof
     sameexp_proof: sameexp.SameExponentProof
     multiexp_proof: multiexp.MultiExpProof
+    version: int = PROOF_VERSION_SEPARATE # one of `PROOF_VERSIONS`
 
 
 def verify(crs: ShuffleCRS,
-           vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector, proof: ShuffleProof) -> bool:
+           vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector, proof: ShuffleProof,
+           debug: bool = False, transcript: Transcript = None) -> bool:
     """
     Verifies that the elements of `vec_R` and `vec_S` were permuted and randomized, and
     the output is in `vec_T` and `vec_U` respectively.
+
+    The equations of all the subarguments are merged and checked with a single MSM. If `debug` is set, each subargument
+    is checked on its own instead, so that the failing assertion says which one failed.
+
+    `transcript` is a fresh `Transcript()` by default. Pass a `Transcript(legacy=True)` to verify proofs that were
+    created with the legacy transcript encoding.
+    """
+    equations = get_verification_equations(crs, vec_R, vec_S, vec_T, vec_U, proof, transcript)
+
+    check_subargument_equations(equations, debug)
+    return True
+
+def check_subargument_equations(equations: dict, debug: bool):
+    # Helper: Checks the equations of all the subarguments of a shuffle with a single MSM, or each subargument on its own
+    # if `debug` is set.
+    if debug:
+        for name, subargument_equations in equations.items():
+            assert check_equations(subargument_equations), "{} argument failed".format(name)
+    else:
+        assert check_equations([eq for subargument_equations in equations.values() for eq in subargument_equations])
+
+def verify_batch(crs: ShuffleCRS, instances: list) -> bool:
+    """
+    Verify many shuffle proofs against the same CRS. `instances` is a list of `(vec_R, vec_S, vec_T, vec_U, proof)`
+    tuples, as they would be passed to `verify()`.
+
+    The equations of all the proofs are merged with random weights and checked with a single MSM, which is much cheaper
+    than verifying each proof on its own. If that check fails, we bisect to find the invalid proofs, and the failing
+    assertion lists their indices.
+    """
+    # Validate the points of all the proofs in a single batch. If some of them are invalid, the points of each proof get
+    # validated again on their own below, which finds the culprits (the valid points are cached by then). Decoded point
+    # vectors only get decompressed here, so a bad encoding shows up as a `ValueError`.
+    try:
+        validation.validate_points([pt for instance in instances for pt in get_instance_points(*instance[:5])])
+    except (AssertionError, ValueError):
+        pass
+
+    equations, invalid = {}, []
+    for i, instance in enumerate(instances):
+        try:
+            subargument_equations = get_verification_equations(crs, *instance)
+        except (AssertionError, ValueError):
+            # Malformed proof, or points that do not decode
+            invalid.append(i)
+            continue
+        equations[i] = [eq for eqs in subargument_equations.values() for eq in eqs]
+
+    invalid += find_invalid_proofs(equations, list(equations))
+    assert not invalid, "invalid shuffle proofs: {}".format(sorted(invalid))
+
+    return True
+
+def find_invalid_proofs(equations: dict, indices: list) -> list:
+    """Bisect over `indices` to find the proofs whose `equations` do not hold"""
+    if not indices or check_equations([eq for i in indices for eq in equations[i]]):
+        return []
+    if len(indices) == 1:
+        return indices
+    return find_invalid_proofs(equations, indices[:len(indices)//2]) + find_invalid_proofs(equations, indices[len(indices)//2:])
+
+def get_instance_points(vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
+                        proof: ShuffleProof) -> list:
+    # Helper: Returns all the points of a shuffle that come from the outside, and must be validated.
+    return list(vec_R) + list(vec_S) + list(vec_T) + list(vec_U) + validation.get_proof_points(proof)
+
+def get_verification_equations(crs: ShuffleCRS,
+                               vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
+                               proof: ShuffleProof, transcript: Transcript = None) -> dict:
+    """
+    Run the verifier side of the shuffle argument without checking anything, and return the equations of each
+    subargument (keyed by the name of the subargument) as (points, scalars) pairs whose MSMs should be the point at
+    infinity.
+
+    All the points of the shuffle and of the proof must be on the curve and in G1 (see `validation.validate_points()`).
     """
     # Number of non-blinder elements used in this proof
     ell = len(vec_R)
     # Total number of elements used in proof (including blinders)
-    n = ell + N_BLINDERS
+    n = get_crs_size(ell)
+    assert len(crs.vec_G) == n
+    n_blinders = n - ell
+    key = get_verifier_key(crs, ell)
+
+    validation.validate_points(get_instance_points(vec_R, vec_S, vec_T, vec_U, proof))
 
     # Get our Fiat-Shamir transcript
-    transcript = Transcript()
+    transcript = transcript or Transcript()
+
+    # Steps 1 to 3
+    vec_a, ipa_state = verify_permutation(transcript, crs, key, vec_T + vec_U, n_blinders, proof.M, proof.A,
+                                          proof.gprod_proof, proof.version)
+
+    # Step 4
+    transcript.absorb_points([proof.A])
+    vec_gamma_delta = transcript.get_challenge_scalars(2 * n_blinders) # need...more...blinders
+    vec_gamma, vec_delta = vec_gamma_delta[0::2], vec_gamma_delta[1::2]
+
+    R, S = msm_multi([vec_R, vec_S], vec_a)
+    sameexp_equations = sameexp.get_verification_equations(transcript, crs.G_t, crs.G_u, R, S, proof.T, proof.U,
+                                                           proof.sameexp_proof)
+
+    # Step 5
+    G_t, G_u = key.vec_G_blind
+    vec_T_with_blinders = vec_T + [multiply(G_t, gamma) for gamma in vec_gamma]
+    vec_U_with_blinders = vec_U + [multiply(G_u, delta) for delta in vec_delta]
+    multiexp_equations = multiexp.get_verification_equations(transcript, crs.vec_G, vec_T_with_blinders, vec_U_with_blinders,
+                                                             proof.A, proof.T, proof.U, proof.multiexp_proof,
+                                                             get_joint_ipa_state(ipa_state, proof.version))
+    gprod_equations = ipa.get_final_equations(ipa_state)
+
+    return {"gprod": gprod_equations, "sameexp": sameexp_equations, "multiexp": multiexp_equations}
+
+def verify_permutation(transcript: Transcript, crs: ShuffleCRS, key: PreparedShuffleCRS, outputs: G1PointVector,
+                       n_blinders: int, M: G1Point, A: G1Point, gprod_proof: gprod.GrandProductProof, version: int,
+                       n_shuffles: int = 1):
+    # Helper: Runs the steps of the verifier that check that `A` commits to a permutation of the challenges `vec_a`
+    # (the same for any number of columns). `outputs` are the points of all the output columns. Returns `vec_a` and the
+    # state of the inner product argument of the grand-product argument, whose equations come from
+    # `inner_product.get_final_equations()` once its rounds are replayed: here with `PROOF_VERSION_SEPARATE`, and along
+    # with the multi-exponentiation argument with `PROOF_VERSION_JOINT` (see `get_joint_ipa_state()`).
+    #
+    # With `n_shuffles` > 1, the elements are those of an aggregated proof (see `verify_aggregate()`), and the
+    # permutation must also keep every element in its own shuffle.
+    assert version in PROOF_VERSIONS, "unsupported proof version {}".format(version)
+    ell = key.ell
+    assert ell % n_shuffles == 0
 
     # Step 1
-    transcript.absorb_points(vec_T + vec_U + [proof.M])
-    vec_a = [transcript.get_challenge_scalar() for _ in range(ell)]
+    transcript.absorb_points(outputs + [M])
+    vec_a = transcript.get_challenge_scalars(ell)
 
     # Step 2
-    transcript.absorb_points([proof.A])
-    alpha, beta = transcript.get_challenge_scalar(), transcript.get_challenge_scalar()
+    transcript.absorb_points([A])
+    if n_shuffles == 1:
+        alpha, beta = transcript.get_challenge_scalars(2)
+        delta = 0
+    else:
+        alpha, beta, delta = transcript.get_challenge_scalars(3)
 
     # Step 3
-    polynomial_coeffs = [(a + i * alpha + beta) % MODULUS for i,a in enumerate(vec_a)]
+    # Every element is tagged with the index of its shuffle, weighted by `delta`: the grand product only matches if the
+    # permutation keeps the tags in place. With a single shuffle all the tags are zero.
+    shuffle_size = ell // n_shuffles
+    polynomial_coeffs = [(a + i * alpha + (i // shuffle_size) * delta + beta) % MODULUS for i,a in enumerate(vec_a)]
     gprod_result = math.prod(polynomial_coeffs) % MODULUS
-    A_1 = msm([proof.A, proof.M] + crs.vec_G, [1, alpha] + [beta]*n)
-    assert gprod.verify(transcript, crs.vec_G, crs.U, A_1, gprod_result, N_BLINDERS, proof.gprod_proof)
+    # `A_1 = A + alpha * M + beta * sum(vec_G) + delta * <tags, vec_G>`
+    A_1 = msm([A, M, key.sum_vec_G], [1, alpha, beta])
+    if n_shuffles > 1:
+        A_1 = curve.add(A_1, multiply(get_tags_commitment(crs.vec_G, n_shuffles, shuffle_size), delta))
+    ipa_state = gprod.verify_setup(transcript, crs.vec_G, crs.U, A_1, gprod_result, n_blinders, gprod_proof,
+                                   key.sum_vec_G_ell)
+    if version == PROOF_VERSION_SEPARATE:
+        ipa.replay_rounds(transcript, ipa_state)
+    return vec_a, ipa_state
+
+def get_tags_commitment(crs_vec_G: G1PointVector, n_shuffles: int, shuffle_size: int) -> G1Point:
+    """
+    Return the commitment to the shuffle tags of an aggregated proof: `i * G` summed over the points `G` of the `i`-th
+    shuffle in `crs_vec_G`.
+    """
+    vec_sums = []
+    for i in range(n_shuffles):
+        sum_G = curve.Z1
+        for G in crs_vec_G[i * shuffle_size:(i + 1) * shuffle_size]:
+            sum_G = curve.add(sum_G, G)
+        vec_sums.append(sum_G)
+    return msm(vec_sums, list(range(n_shuffles)))
+
+def get_joint_ipa_state(ipa_state: ipa.IPAVerifierState, version: int) -> ipa.IPAVerifierState:
+    # Helper: Returns the inner product argument whose rounds run along with the multi-exponentiation argument, if any.
+    return ipa_state if version == PROOF_VERSION_JOINT else None
+
+
+@dataclass
+class ShuffleColumnsProof:
+    M: G1Point
+    A: G1Point
+    vec_T: G1PointVector # the blinded MSM of every output column
+    gprod_proof: gprod.GrandProductProof
+    sameexp_proof: sameexp.SameExponentColumnsProof
+    multiexp_proof: multiexp.MultiExpColumnsProof
+    version: int = PROOF_VERSION_SEPARATE # one of `PROOF_VERSIONS`
+
+def verify_columns(crs: ShuffleColumnsCRS, inputs: list, outputs: list, proof: ShuffleColumnsProof,
+                   debug: bool = False, transcript: Transcript = None) -> bool:
+    """
+    Verifies that the `k` columns of `inputs` were permuted with the same permutation and randomized with the same
+    factor, and the output is in `outputs`. Each column is a vector of points: a shuffle of `(R_i, S_i)` pairs has the
+    two columns `[vec_R, vec_S]`.
+
+    All the columns share a single permutation commitment and grand-product argument, and a multi-exponentiation
+    argument whose size does not depend on `k`.
+
+    `crs` can also be a `ShuffleCRS` for two columns. See `verify()` for `debug` and `transcript`.
+    """
+    equations = get_columns_verification_equations(crs, inputs, outputs, proof, transcript)
+
+    check_subargument_equations(equations, debug)
+    return True
+
+def get_columns_verification_equations(crs: ShuffleColumnsCRS, inputs: list, outputs: list, proof: ShuffleColumnsProof,
+                                       transcript: Transcript = None) -> dict:
+    """
+    Like `get_verification_equations()`, for a shuffle of any number of columns (see `verify_columns()`).
+    """
+    k = len(inputs)
+    assert k > 0 and len(outputs) == k and len(crs.vec_G_blind) >= k
+    # Number of non-blinder elements used in this proof
+    ell = len(inputs[0])
+    assert all(len(column) == ell for column in inputs + outputs)
+    assert len(crs.vec_G) == get_crs_size(ell, k)
+    n_blinders = len(crs.vec_G) - ell
+    key = get_verifier_key(crs, ell)
+
+    validation.validate_points([pt for column in inputs + outputs for pt in column] + validation.get_proof_points(proof))
+
+    # Get our Fiat-Shamir transcript
+    transcript = transcript or Transcript()
+
+    # Steps 1 to 3
+    vec_a, ipa_state = verify_permutation(transcript, crs, key, [pt for column in outputs for pt in column],
+                                          n_blinders, proof.M, proof.A, proof.gprod_proof, proof.version)
 
     # Step 4
     transcript.absorb_points([proof.A])
-    vec_gamma, vec_delta = [], [] # need...more...blinders
-    for _ in range(N_BLINDERS):
-        vec_gamma.append(transcript.get_challenge_scalar())
-        vec_delta.append(transcript.get_challenge_scalar())
+    vec_gammas = transcript.get_challenge_scalars(k * n_blinders)
 
-    R = msm(vec_R, vec_a)
-    S = msm(vec_S, vec_a)
-    assert sameexp.verify(transcript, crs.G_t, crs.G_u, R, S, proof.T, proof.U, proof.sameexp_proof)
+    vec_R = msm_multi(inputs, vec_a)
+    sameexp_equations = sameexp.get_columns_verification_equations(transcript, crs.vec_G_blind[:k], vec_R, proof.vec_T,
+                                                                   proof.sameexp_proof)
 
     # Step 5
-    vec_T_with_blinders = vec_T + [b.multiply(crs.G_t, gamma) for gamma in vec_gamma]
-    vec_U_with_blinders = vec_U + [b.multiply(crs.G_u, delta) for delta in vec_delta]
-    assert multiexp.verify(transcript, crs.vec_G, vec_T_with_blinders, vec_U_with_blinders, proof.A, proof.T, proof.U, proof.multiexp_proof)
+    outputs_with_blinders = [list(column) + [multiply(G, gamma) for gamma in vec_gammas[j::k]]
+                             for j, (column, G) in enumerate(zip(outputs, key.vec_G_blind))]
+    multiexp_equations = multiexp.get_columns_verification_equations(transcript, crs.vec_G, outputs_with_blinders,
+                                                                     proof.A, proof.vec_T, proof.multiexp_proof,
+                                                                     get_joint_ipa_state(ipa_state, proof.version))
+    gprod_equations = ipa.get_final_equations(ipa_state)
+
+    return {"gprod": gprod_equations, "sameexp": sameexp_equations, "multiexp": multiexp_equations}
+
 
+@dataclass
+class AggregateShuffleProof:
+    M: G1Point
+    A: G1Point
+    vec_T: G1PointVector # the blinded MSM `T` of every shuffle
+    vec_U: G1PointVector # the blinded MSM `U` of every shuffle
+    gprod_proof: gprod.GrandProductProof
+    sameexp_proof: sameexp.SameExponentBatchProof
+    multiexp_proof: multiexp.MultiExpProof
+    version: int = PROOF_VERSION_SEPARATE # one of `PROOF_VERSIONS`
+
+def get_aggregate_size(n_shuffles: int, ell: int) -> int:
+    """
+    Return the number of points in the `vec_G` of a CRS for aggregated proofs of `n_shuffles` shuffles of `ell`
+    elements: all the elements, and the blinders of the `T` and `U` of every shuffle and of the grand-product argument,
+    rounded up to a power of two like `get_crs_size()`.
+    """
+    return get_crs_size(n_shuffles * ell, 2 * n_shuffles)
+
+def verify_aggregate(crs: ShuffleCRS, shuffles: list, proof: AggregateShuffleProof,
+                     debug: bool = False, transcript: Transcript = None) -> bool:
+    """
+    Verifies that in every shuffle of `shuffles`, a list of `(vec_R, vec_S, vec_T, vec_U)` tuples as they would be passed
+    to `verify()`, the elements of `vec_R` and `vec_S` were permuted and randomized, and the output is in `vec_T` and
+    `vec_U` respectively. Each shuffle has its own permutation and randomizer, but they all have the same size.
+
+    The shuffles are proven as one shuffle of all their elements whose permutation keeps every element in its own
+    shuffle: they share a single permutation commitment, grand-product argument and multi-exponentiation argument. Only
+    `T`, `U` and the same-exponent argument come once per shuffle. `crs.vec_G` must hold `get_aggregate_size()` points.
+
+    See `verify()` for `debug` and `transcript`.
+    """
+    equations = get_aggregate_verification_equations(crs, shuffles, proof, transcript)
+
+    check_subargument_equations(equations, debug)
     return True
 
+def get_aggregate_verification_equations(crs: ShuffleCRS, shuffles: list, proof: AggregateShuffleProof,
+                                         transcript: Transcript = None) -> dict:
+    """
+    Like `get_verification_equations()`, for an aggregated proof (see `verify_aggregate()`).
+    """
+    m = len(shuffles)
+    assert m > 0 and len(proof.vec_T) == len(proof.vec_U) == m
+    # Number of non-blinder elements of each shuffle
+    ell = len(shuffles[0][0])
+    assert all(len(vec) == ell for shuffle in shuffles for vec in shuffle)
+    assert len(crs.vec_G) == get_aggregate_size(m, ell)
+    n_blinders = len(crs.vec_G) - m * ell
+    key = get_verifier_key(crs, m * ell)
+
+    validation.validate_points([pt for shuffle in shuffles for vec in shuffle for pt in vec] +
+                               validation.get_proof_points(proof))
+
+    # Get our Fiat-Shamir transcript
+    transcript = transcript or Transcript()
+
+    # Steps 1 to 3
+    outputs = [pt for _, _, vec_T, vec_U in shuffles for pt in list(vec_T) + list(vec_U)]
+    vec_a, ipa_state = verify_permutation(transcript, crs, key, outputs, n_blinders, proof.M, proof.A,
+                                          proof.gprod_proof, proof.version, m)
+
+    # Step 4
+    # Every shuffle gets its own challenges for the blinders
+    transcript.absorb_points([proof.A])
+    vec_gamma_delta = transcript.get_challenge_scalars(2 * m * n_blinders)
+
+    vec_R, vec_S = [], []
+    for i, (shuffle_R, shuffle_S, _, _) in enumerate(shuffles):
+        R, S = msm_multi([shuffle_R, shuffle_S], vec_a[i*ell:(i+1)*ell])
+        vec_R.append(R)
+        vec_S.append(S)
+    sameexp_equations = sameexp.get_batch_verification_equations(transcript, crs.G_t, crs.G_u, vec_R, vec_S,
+                                                                 proof.vec_T, proof.vec_U, proof.sameexp_proof)
+
+    # Step 5
+    column_T, column_U, T, U = merge_shuffles(transcript, crs, shuffles, proof.vec_T, proof.vec_U, vec_gamma_delta)
+    multiexp_equations = multiexp.get_verification_equations(transcript, crs.vec_G, column_T, column_U,
+                                                             proof.A, T, U, proof.multiexp_proof,
+                                                             get_joint_ipa_state(ipa_state, proof.version))
+    gprod_equations = ipa.get_final_equations(ipa_state)
+
+    return {"gprod": gprod_equations, "sameexp": sameexp_equations, "multiexp": multiexp_equations}
+
+def merge_shuffles(transcript: Transcript, crs: ShuffleCRS, shuffles: list, vec_T: G1PointVector,
+                   vec_U: G1PointVector, vec_gamma_delta: list):
+    """
+    Merge the outputs of the shuffles of an aggregated proof into the two columns of its multi-exponentiation argument,
+    given the blinded MSMs `vec_T` and `vec_U` of the shuffles and the challenges of their blinders. Returns the two
+    columns and their MSMs `T` and `U`.
+
+    The `i`-th shuffle is weighted by `rho^i`, for a challenge `rho`. The columns are `ScaledBasis` vectors, so the
+    weights only ever go into scalars.
+    """
+    m = len(shuffles)
+    n_blinders = len(vec_gamma_delta) // (2 * m)
+    ell = len(shuffles[0][0])
+
+    transcript.absorb_points(vec_T + vec_U)
+    rho = transcript.get_challenge_scalar()
+    vec_rho = multiexp.get_column_weights(rho, m)
+    T, U = msm_multi([vec_T, vec_U], vec_rho)
+
+    # The blinders of every shuffle go to the same positions, weighted like their shuffle
+    vecs_gamma_delta = [vec_gamma_delta[2*n_blinders*i:2*n_blinders*(i+1)] for i in range(m)]
+    gamma_factors = [sum(weight * chunk[2*j] for weight, chunk in zip(vec_rho, vecs_gamma_delta)) % MODULUS
+                     for j in range(n_blinders)]
+    delta_factors = [sum(weight * chunk[2*j+1] for weight, chunk in zip(vec_rho, vecs_gamma_delta)) % MODULUS
+                     for j in range(n_blinders)]
+    weights = [weight for weight in vec_rho for _ in range(ell)]
+    column_T = ScaledBasis([pt for _, _, shuffle_T, _ in shuffles for pt in shuffle_T] + [crs.G_t] * n_blinders,
+                           weights + gamma_factors)
+    column_U = ScaledBasis([pt for _, _, _, shuffle_U in shuffles for pt in shuffle_U] + [crs.G_u] * n_blinders,
+                           weights + delta_factors)
+    return column_T, column_U, T, U
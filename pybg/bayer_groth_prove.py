@@ -3,86 +3,338 @@ Prover of the Bayer-Groth shuffle argument
 """
 
 import math, random
+from dataclasses import dataclass
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 
-from bayer_groth import ShuffleCRS, ShuffleProof
-from bg_types import FieldElement, G1PointVector
-import gprod_prove, sameexp_prove, multiexp_prove
-from util import msm, get_inner_product, apply_permutation
+from bayer_groth import ShuffleCRS, ShuffleProof, ShuffleColumnsCRS, ShuffleColumnsProof, PreparedShuffleCRS, \
+    AggregateShuffleProof, get_verifier_key, get_crs_size, get_aggregate_size, get_tags_commitment, merge_shuffles, \
+    PROOF_VERSION_SEPARATE, PROOF_VERSION_JOINT, PROOF_VERSIONS
+import gprod
+from bg_types import FieldElement, FieldElementVector, G1Point, G1PointVector
+import gprod_prove, sameexp_prove, multiexp_prove, inner_product_prove as ipa_prove
+from util import msm, msm_multi, multiply, multiply_all, get_inner_product, apply_permutation
 from transcript import Transcript
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
-# Number of blinders we need in the shuffle proof
-N_BLINDERS = 4
+@dataclass
+class ShuffleProverState:
+    """
+    Everything a shuffle proof needs that only depends on the CRS and the permutation: the commitment `M` to the
+    permutation, and the blinders of every subargument along with their commitments. See `precompute()`.
+    """
+    crs: ShuffleCRS
+    permutation: list
+    k: int # number of columns
+    key: PreparedShuffleCRS
+    vec_s_blinders: FieldElementVector
+    M: G1Point
+    vec_a_blinders: FieldElementVector
+    A_bl: G1Point # commitment of `vec_a_blinders` to the blinder part of the CRS
+    gprod_blinders: gprod_prove.GrandProductBlinders
+    sameexp_blinders: sameexp_prove.SameExponentBlinders # a list of them for aggregated proofs
+    multiexp_blinders: multiexp_prove.MultiExpBlinders
+    used: bool = False
+    n_shuffles: int = 1 # number of shuffles of an aggregated proof (see `precompute_aggregate()`)
+
+def shuffle_and_randomize(vec_R: G1PointVector, vec_S: G1PointVector,
+                          permutation: list, r: FieldElement) -> (G1PointVector, G1PointVector):
+    """
+    Shuffle `vec_R` and `vec_S` with `permutation` and randomize them with `r`. Returns the `vec_T` and `vec_U` that
+    `prove()` expects.
+    """
+    vec_T, vec_U = shuffle_and_randomize_columns([vec_R, vec_S], permutation, r)
+    return vec_T, vec_U
+
+def shuffle_and_randomize_columns(inputs: list, permutation: list, r: FieldElement) -> list:
+    """
+    Shuffle every column of `inputs` with `permutation` and randomize them with `r`. Returns the output columns that
+    `prove_columns()` expects.
+
+    All the columns are multiplied by `r` in a single batch (see `multiply_all()`).
+    """
+    ell = len(permutation)
+    assert all(len(column) == ell for column in inputs)
+
+    randomized = multiply_all([pt for column in inputs for pt in column], r)
+    return [apply_permutation(randomized[j*ell:(j+1)*ell], permutation) for j in range(len(inputs))]
+
+def precompute(crs: ShuffleCRS, permutation: list, k: int = 2, n_shuffles: int = 1) -> ShuffleProverState:
+    """
+    Do the part of a shuffle proof of `k` columns that does not depend on the shuffled points, which can happen long
+    before they are known. `finish()` (or `finish_columns()`) then turns the returned state into a proof.
+
+    A state holds the blinders of a single proof: it can only be finished once.
+
+    For an aggregated proof (see `precompute_aggregate()`), `permutation` permutes the elements of all the
+    `n_shuffles` shuffles.
+    """
+    # Number of non-blinder elements used in this proof
+    ell = len(permutation)
+    # The points of `crs.vec_G` after the elements are all blinders (see `bayer_groth.get_crs_size()`)
+    assert len(crs.vec_G) == get_crs_size(ell, k * n_shuffles)
+    n_blinders = len(crs.vec_G) - ell
+    assert len(crs.vec_G_blind) >= k
+    key = get_verifier_key(crs, ell)
+
+    # Step 1
+    vec_s_blinders = [random.randint(0, MODULUS) for _ in range(n_blinders)]
+    M = msm(crs.vec_G, permutation + vec_s_blinders)
+
+    # Step 2
+    vec_a_blinders = [random.randint(0, MODULUS) for _ in range(n_blinders)]
+    A_bl = msm(crs.vec_G[ell:], vec_a_blinders)
+
+    # Steps 3 to 5
+    gprod_blinders = gprod_prove.precompute(crs.vec_G, n_blinders)
+    if n_shuffles == 1:
+        sameexp_blinders = sameexp_prove.precompute(key.vec_G_blind[:k])
+    else:
+        sameexp_blinders = [sameexp_prove.precompute(key.vec_G_blind[:k]) for _ in range(n_shuffles)]
+    multiexp_blinders = multiexp_prove.precompute(crs.vec_G)
+
+    return ShuffleProverState(crs, permutation, k, key, vec_s_blinders, M, vec_a_blinders, A_bl,
+                              gprod_blinders, sameexp_blinders, multiexp_blinders, n_shuffles=n_shuffles)
 
 def prove(crs: ShuffleCRS,
           vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
-          permutation: list, r: FieldElement) -> ShuffleProof:
+          permutation: list, r: FieldElement, transcript: Transcript = None,
+          version: int = PROOF_VERSION_SEPARATE) -> ShuffleProof:
     """
     Proves that there exist `permutation` and `r` such that:
 
     The elements of `vec_R` and `vec_S` were permuted using `permutation` and randomized using `r`, and the results are
     in `vec_T` and `vec_U` respectively.
+
+    `transcript` is a fresh `Transcript()` by default (see `bayer_groth.verify()`). `version` is the version of the
+    proof (see `bayer_groth.PROOF_VERSIONS`).
+
+    This is `precompute()` followed by `finish()`.
     """
-    # Number of non-blinder elements used in this proof
-    ell = len(vec_R)
-    # Total number of elements used in proof (including blinders)
-    n = N_BLINDERS + ell
+    return finish(precompute(crs, permutation), vec_R, vec_S, vec_T, vec_U, r, transcript, version)
+
+def finish(state: ShuffleProverState,
+           vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
+           r: FieldElement, transcript: Transcript = None, version: int = PROOF_VERSION_SEPARATE) -> ShuffleProof:
+    """
+    Finish the shuffle proof started by `precompute()`, once the shuffled points are known. This only does the work
+    that depends on them and on the challenges. See `prove()` for the arguments.
+    """
+    assert state.k == 2
+    crs, key = state.crs, state.key
+    transcript = transcript or Transcript() # Our Fiat-Shamir transcript
+
+    # Steps 1 to 3
+    vec_a, A, vec_a_permuted_with_blinders, B, bl, ipa_state = prove_permutation(state, transcript, vec_T + vec_U, version)
+
+    # Step 4
+    transcript.absorb_points([A])
+    vec_gamma_delta = transcript.get_challenge_scalars(2 * len(state.vec_a_blinders)) # need...more...blinders
+    vec_gamma, vec_delta = vec_gamma_delta[0::2], vec_gamma_delta[1::2]
+
+    G_t, G_u = key.vec_G_blind
+    R, S = msm_multi([vec_R, vec_S], vec_a)
+    r_t = get_inner_product(vec_gamma, state.vec_a_blinders)
+    r_u = get_inner_product(vec_delta, state.vec_a_blinders)
+    T = msm([R, G_t], [r, r_t])
+    U = msm([S, G_u], [r, r_u])
+
+    sameexp_proof = sameexp_prove.prove(transcript, crs.G_t, crs.G_u, R, S, T, U, r, r_t, r_u, state.sameexp_blinders)
+
+    # Step 5
+    vec_T_with_blinders = vec_T + [multiply(G_t, gamma) for gamma in vec_gamma]
+    vec_U_with_blinders = vec_U + [multiply(G_u, delta) for delta in vec_delta]
+    multiexp_proof = multiexp_prove.prove(transcript, crs.vec_G, vec_T_with_blinders, vec_U_with_blinders, A, T, U,
+                                          vec_a_permuted_with_blinders, state.multiexp_blinders,
+                                          get_joint_ipa_state(ipa_state, version))
+    gprod_proof = gprod.GrandProductProof(B, bl, ipa_prove.get_proof(ipa_state))
 
-    transcript = Transcript() # Our Fiat-Shamir transcript
+    return ShuffleProof(state.M, A, T, U, gprod_proof, sameexp_proof, multiexp_proof, version)
+
+def prove_columns(crs: ShuffleColumnsCRS, inputs: list, outputs: list, permutation: list, r: FieldElement,
+                  transcript: Transcript = None, version: int = PROOF_VERSION_SEPARATE) -> ShuffleColumnsProof:
+    """
+    Proves that there exist `permutation` and `r` such that every column of `inputs` was permuted using `permutation`
+    and randomized using `r`, and the results are in the matching column of `outputs` (see
+    `bayer_groth.verify_columns()`). See `prove()` for `transcript` and `version`.
+
+    This is `precompute()` followed by `finish_columns()`.
+    """
+    return finish_columns(precompute(crs, permutation, len(inputs)), inputs, outputs, r, transcript, version)
+
+def finish_columns(state: ShuffleProverState, inputs: list, outputs: list, r: FieldElement,
+                   transcript: Transcript = None, version: int = PROOF_VERSION_SEPARATE) -> ShuffleColumnsProof:
+    """
+    Finish the shuffle proof of `state.k` columns started by `precompute()`, once the shuffled points are known.
+    See `prove_columns()` for the arguments.
+    """
+    k = state.k
+    assert len(inputs) == len(outputs) == k
+    crs, key = state.crs, state.key
+    n_blinders = len(state.vec_a_blinders)
+    transcript = transcript or Transcript() # Our Fiat-Shamir transcript
+
+    # Steps 1 to 3
+    vec_a, A, vec_a_permuted_with_blinders, B, bl, ipa_state = \
+        prove_permutation(state, transcript, [pt for column in outputs for pt in column], version)
+
+    # Step 4
+    # Every column gets its own challenges for the blinders
+    transcript.absorb_points([A])
+    vec_gammas = transcript.get_challenge_scalars(k * n_blinders)
+    vecs_gamma = [vec_gammas[j::k] for j in range(k)]
+
+    vec_R = msm_multi(inputs, vec_a)
+    vec_r_blind = [get_inner_product(vec_gamma, state.vec_a_blinders) for vec_gamma in vecs_gamma]
+    vec_T = [msm([R, G], [r, r_blind]) for R, G, r_blind in zip(vec_R, key.vec_G_blind, vec_r_blind)]
+
+    sameexp_proof = sameexp_prove.prove_columns(transcript, crs.vec_G_blind[:k], vec_R, vec_T, r, vec_r_blind,
+                                                state.sameexp_blinders)
+
+    # Step 5
+    outputs_with_blinders = [list(column) + [multiply(G, gamma) for gamma in vec_gamma]
+                             for column, G, vec_gamma in zip(outputs, key.vec_G_blind, vecs_gamma)]
+    multiexp_proof = multiexp_prove.prove_columns(transcript, crs.vec_G, outputs_with_blinders, A, vec_T,
+                                                  vec_a_permuted_with_blinders, state.multiexp_blinders,
+                                                  get_joint_ipa_state(ipa_state, version))
+    gprod_proof = gprod.GrandProductProof(B, bl, ipa_prove.get_proof(ipa_state))
+
+    return ShuffleColumnsProof(state.M, A, vec_T, gprod_proof, sameexp_proof, multiexp_proof, version)
+
+def precompute_aggregate(crs: ShuffleCRS, permutations: list) -> ShuffleProverState:
+    """
+    Like `precompute()`, for an aggregated proof of shuffles of the same size (see `bayer_groth.verify_aggregate()`).
+    `permutations` holds the permutation of every shuffle.
+    """
+    m, ell = len(permutations), len(permutations[0])
+    assert all(len(permutation) == ell for permutation in permutations)
+    assert len(crs.vec_G) == get_aggregate_size(m, ell)
+
+    # A single permutation of all the elements, that keeps every element in its own shuffle
+    permutation = [i * ell + p for i, shuffle_permutation in enumerate(permutations) for p in shuffle_permutation]
+    return precompute(crs, permutation, 2, m)
+
+def prove_aggregate(crs: ShuffleCRS, shuffles: list, permutations: list, vec_r: FieldElementVector,
+                    transcript: Transcript = None, version: int = PROOF_VERSION_SEPARATE) -> AggregateShuffleProof:
+    """
+    Proves that for every `i`, the `i`-th shuffle of `shuffles`, a `(vec_R, vec_S, vec_T, vec_U)` tuple, was permuted
+    using `permutations[i]` and randomized using `vec_r[i]` (see `bayer_groth.verify_aggregate()`). See `prove()` for
+    `transcript` and `version`.
+
+    This is `precompute_aggregate()` followed by `finish_aggregate()`.
+    """
+    return finish_aggregate(precompute_aggregate(crs, permutations), shuffles, vec_r, transcript, version)
+
+def finish_aggregate(state: ShuffleProverState, shuffles: list, vec_r: FieldElementVector,
+                     transcript: Transcript = None, version: int = PROOF_VERSION_SEPARATE) -> AggregateShuffleProof:
+    """
+    Finish the aggregated proof started by `precompute_aggregate()`, once the shuffled points are known. See
+    `prove_aggregate()` for the arguments.
+    """
+    m = state.n_shuffles
+    assert state.k == 2 and len(shuffles) == len(vec_r) == m
+    crs, key = state.crs, state.key
+    ell = len(state.permutation) // m
+    n_blinders = len(state.vec_a_blinders)
+    transcript = transcript or Transcript() # Our Fiat-Shamir transcript
+
+    # Steps 1 to 3
+    outputs = [pt for _, _, vec_T, vec_U in shuffles for pt in list(vec_T) + list(vec_U)]
+    vec_a, A, vec_a_permuted_with_blinders, B, bl, ipa_state = prove_permutation(state, transcript, outputs, version)
+
+    # Step 4
+    # Every shuffle gets its own challenges for the blinders
+    transcript.absorb_points([A])
+    vec_gamma_delta = transcript.get_challenge_scalars(2 * m * n_blinders)
+
+    G_t, G_u = key.vec_G_blind
+    vec_R, vec_S, vec_T, vec_U, vec_r_t, vec_r_u = [], [], [], [], [], []
+    for i, ((shuffle_R, shuffle_S, _, _), r) in enumerate(zip(shuffles, vec_r)):
+        chunk = vec_gamma_delta[2*n_blinders*i:2*n_blinders*(i+1)]
+        R, S = msm_multi([shuffle_R, shuffle_S], vec_a[i*ell:(i+1)*ell])
+        r_t = get_inner_product(chunk[0::2], state.vec_a_blinders)
+        r_u = get_inner_product(chunk[1::2], state.vec_a_blinders)
+        vec_R.append(R)
+        vec_S.append(S)
+        vec_T.append(msm([R, G_t], [r, r_t]))
+        vec_U.append(msm([S, G_u], [r, r_u]))
+        vec_r_t.append(r_t)
+        vec_r_u.append(r_u)
+
+    sameexp_proof = sameexp_prove.prove_batch(transcript, crs.G_t, crs.G_u, vec_R, vec_S, vec_T, vec_U,
+                                              vec_r, vec_r_t, vec_r_u, state.sameexp_blinders)
+
+    # Step 5
+    column_T, column_U, T, U = merge_shuffles(transcript, crs, shuffles, vec_T, vec_U, vec_gamma_delta)
+    multiexp_proof = multiexp_prove.prove(transcript, crs.vec_G, column_T, column_U, A, T, U,
+                                          vec_a_permuted_with_blinders, state.multiexp_blinders,
+                                          get_joint_ipa_state(ipa_state, version))
+    gprod_proof = gprod.GrandProductProof(B, bl, ipa_prove.get_proof(ipa_state))
+
+    return AggregateShuffleProof(state.M, A, vec_T, vec_U, gprod_proof, sameexp_proof, multiexp_proof, version)
+
+def prove_permutation(state: ShuffleProverState, transcript: Transcript, outputs: G1PointVector, version: int):
+    # Helper: Runs the steps of the prover that show that `A` commits to a permutation of the challenges `vec_a` (the
+    # same for any number of columns). `outputs` are the points of all the output columns. Returns `vec_a`, `A`, the
+    # permuted `vec_a` with its blinders, and `B`, `bl` and the inner product state of the grand-product proof. The
+    # rounds of the inner product argument run here with `PROOF_VERSION_SEPARATE`, and along with the
+    # multi-exponentiation argument with `PROOF_VERSION_JOINT` (see `get_joint_ipa_state()`).
+    assert version in PROOF_VERSIONS, "unsupported proof version {}".format(version)
+    assert not state.used, "prover states can only be used for a single proof"
+    state.used = True
+    crs, permutation, key = state.crs, state.permutation, state.key
+
+    # Number of non-blinder elements used in this proof
+    ell = len(permutation)
+    assert len(outputs) == state.k * ell
 
     # Step 1
-    vec_s_blinders = [random.randint(0, MODULUS) for _ in range(N_BLINDERS)]
-    vec_perm_with_s_blinders = permutation + vec_s_blinders
-    M = msm(crs.vec_G, vec_perm_with_s_blinders)
+    vec_perm_with_s_blinders = permutation + state.vec_s_blinders
+    M = state.M
 
-    transcript.absorb_points(vec_T + vec_U + [M])
-    vec_a = [transcript.get_challenge_scalar() for _ in range(ell)]
+    transcript.absorb_points(outputs + [M])
+    vec_a = transcript.get_challenge_scalars(ell)
 
     # Step 2
     # Add a bunch of blinders to `a` vector
-    vec_a_blinders = [random.randint(0, MODULUS) for _ in range(N_BLINDERS)]
-    vec_a_permuted_with_blinders = apply_permutation(vec_a, permutation) + vec_a_blinders
+    vec_a_permuted = apply_permutation(vec_a, permutation)
+    vec_a_permuted_with_blinders = vec_a_permuted + state.vec_a_blinders
 
-    A = msm(crs.vec_G, vec_a_permuted_with_blinders)
+    A = msm(crs.vec_G[:ell] + [state.A_bl], vec_a_permuted + [1])
 
     transcript.absorb_points([A])
-    alpha, beta = transcript.get_challenge_scalar(), transcript.get_challenge_scalar()
+    if state.n_shuffles == 1:
+        alpha, beta = transcript.get_challenge_scalars(2)
+        delta = 0
+    else:
+        alpha, beta, delta = transcript.get_challenge_scalars(3)
 
     # Step 3
     # We use `vec_perm_with_s_blinders` here so that the blinders follow the permuted numbers
     permuted_polynomial_factors = [(a + m * alpha + beta) % MODULUS for a,m in zip(vec_a_permuted_with_blinders, vec_perm_with_s_blinders)]
+    # The elements of an aggregated proof are tagged with the index of their shuffle (see
+    # `bayer_groth.verify_permutation()`). The blinders have no tag.
+    shuffle_size = ell // state.n_shuffles
+    for i in range(ell):
+        permuted_polynomial_factors[i] = (permuted_polynomial_factors[i] + (i // shuffle_size) * delta) % MODULUS
     # We compute the grand product over the non-blinder part of the polynomial factors
     gprod_result = math.prod(permuted_polynomial_factors[:ell]) % MODULUS
-    A_1 = msm([A, M] + crs.vec_G, [1, alpha] + [beta]*n)
-    gprod_proof = gprod_prove.prove(transcript, crs.vec_G, crs.U, A_1, gprod_result, permuted_polynomial_factors, N_BLINDERS)
+    A_1 = msm([A, M, key.sum_vec_G], [1, alpha, beta])
+    if state.n_shuffles > 1:
+        A_1 = curve.add(A_1, multiply(get_tags_commitment(crs.vec_G, state.n_shuffles, shuffle_size), delta))
+    B, bl, ipa_state = gprod_prove.prove_setup(transcript, crs.vec_G, crs.U, A_1, gprod_result, permuted_polynomial_factors,
+                                               len(state.vec_a_blinders), state.gprod_blinders, key.sum_vec_G_ell)
+    if version == PROOF_VERSION_SEPARATE:
+        ipa_prove.prove_rounds(transcript, ipa_state)
 
     # Sanity check: make sure that permuted polynomial has same roots as the regular polynomial
     # vec_a_with_blinders = vec_a + vec_a_blinders
     # polynomial_factors = [a + m*alpha + beta for a,m in zip(vec_a_with_blinders, list(range(ELL)) + vec_s_blinders)]
     # assert gprod_result == (math.prod(permuted_polynomial_factors[:ELL]) % MODULUS)
 
-    # Step 4
-    transcript.absorb_points([A])
-    vec_gamma, vec_delta = [], [] # need...more...blinders
-    for _ in range(N_BLINDERS):
-        vec_gamma.append(transcript.get_challenge_scalar())
-        vec_delta.append(transcript.get_challenge_scalar())
-
-    R = msm(vec_R, vec_a)
-    S = msm(vec_S, vec_a)
-    r_t = get_inner_product(vec_gamma, vec_a_blinders)
-    r_u = get_inner_product(vec_delta, vec_a_blinders)
-    T = msm([R, crs.G_t], [r, r_t])
-    U = msm([S, crs.G_u], [r, r_u])
-
-    sameexp_proof = sameexp_prove.prove(transcript, crs.G_t, crs.G_u, R, S, T, U, r, r_t, r_u)
-
-    # Step 5
-    vec_T_with_blinders = vec_T + [b.multiply(crs.G_t, gamma) for gamma in vec_gamma]
-    vec_U_with_blinders = vec_U + [b.multiply(crs.G_u, delta) for delta in vec_delta]
-    multiexp_proof = multiexp_prove.prove(transcript, crs.vec_G, vec_T_with_blinders, vec_U_with_blinders, A, T, U, vec_a_permuted_with_blinders)
+    return vec_a, A, vec_a_permuted_with_blinders, B, bl, ipa_state
 
-    return ShuffleProof(M, A, T, U, gprod_proof, sameexp_proof, multiexp_proof)
+def get_joint_ipa_state(ipa_state: ipa_prove.IPAProverState, version: int) -> ipa_prove.IPAProverState:
+    # Helper: Returns the inner product proof whose rounds run along with the multi-exponentiation argument, if any.
+    return ipa_state if version == PROOF_VERSION_JOINT else None
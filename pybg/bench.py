@@ -0,0 +1,221 @@
+"""
+Benchmarks for pybg.
+
+Run `python pybg/bench.py` to run all the benchmarks, or `python pybg/bench.py <name>` to run a single one.
+"""
+
+import os, sys, time, tempfile, subprocess
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import curve
+
+import bayer_groth, bayer_groth_prove, crs_store, encoding, util, validation
+
+MODULUS = curve.curve_order
+
+def gen_generator_points(count):
+    """Create `count` generator points (see `crs_store.generate_points()`)"""
+    return crs_store.generate_points(count, b"pybg bench", b"G")
+
+def get_random_permutation(n):
+    """Return a random permutation with `n` elements"""
+    return random.sample(range(n), n)
+
+def make_shuffle(n):
+    """Return a CRS and the inputs of a shuffle proof with `n` elements (including blinders)"""
+    ell = n - bayer_groth.N_BLINDERS
+    generators = gen_generator_points(n + 3 + 2*ell)
+    crs = bayer_groth.ShuffleCRS(generators[:n], generators[n], generators[n+1], generators[n+2])
+    vec_R = generators[n+3:n+3+ell]
+    vec_S = generators[n+3+ell:]
+
+    permutation = get_random_permutation(ell)
+    r = random.randint(0, MODULUS)
+    vec_T, vec_U = bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+    return crs, vec_R, vec_S, vec_T, vec_U, permutation, r
+
+def bench_parallel(n=128, worker_counts=(1, 2, 4)):
+    """Time the shuffle prover with different numbers of worker processes, and check that the proofs are identical"""
+    shuffle = make_shuffle(n)
+
+    # Seed the randomness of the prover so that all runs create the same proof
+    random.seed(n)
+    start = time.time()
+    expected_proof = encoding.encode(bayer_groth_prove.prove(*shuffle))
+    print("parallel: n={} without executor: {:.3f}s".format(n, time.time() - start))
+
+    for n_workers in worker_counts:
+        with ProcessPoolExecutor(n_workers) as executor:
+            util.set_executor(executor, n_workers)
+            random.seed(n)
+            start = time.time()
+            proof = encoding.encode(bayer_groth_prove.prove(*shuffle))
+            elapsed = time.time() - start
+            util.set_executor(None)
+        assert proof == expected_proof
+        print("parallel: n={} with {} workers: {:.3f}s".format(n, n_workers, elapsed))
+
+def bench_backends(n=128):
+    """Time an MSM of size `n` with each curve backend"""
+    coordinates = [curve.normalize(pt) for pt in gen_generator_points(n)]
+    scalars = [random.randint(0, MODULUS) for _ in range(n)]
+
+    previous_backend = curve.backend
+    for backend in curve.BACKENDS:
+        curve.set_backend(backend)
+        points = [curve.from_affine(x, y) for x, y in coordinates]
+        start = time.time()
+        util.msm(points, scalars)
+        print("backends: n={} msm with the {} backend: {:.3f}s".format(n, backend, time.time() - start))
+    curve.set_backend(previous_backend)
+
+def bench_verify(n=128, n_proofs=3):
+    """Time verifying several shuffles against the same CRS: only the first one prepares the verifier key"""
+    crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(n)
+    proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+
+    for i in range(n_proofs):
+        start = time.time()
+        bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof)
+        print("verify: n={} proof {}: {:.3f}s".format(n, i, time.time() - start))
+
+def bench_online(n=128):
+    """Time the offline and online parts of the shuffle prover: only `finish()` has to wait for the shuffled points"""
+    crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(n)
+
+    start = time.time()
+    state = bayer_groth_prove.precompute(crs, permutation)
+    print("online: n={} precompute: {:.3f}s".format(n, time.time() - start))
+
+    start = time.time()
+    proof = bayer_groth_prove.finish(state, vec_R, vec_S, vec_T, vec_U, r)
+    print("online: n={} finish: {:.3f}s".format(n, time.time() - start))
+    assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof)
+
+def bench_columns(ell=58, k=4):
+    """Time a single shuffle proof of `k` columns against `k/2` proofs of two columns over the same permutation"""
+    n = bayer_groth.get_crs_size(ell, k)
+    generators = gen_generator_points(n + 1 + k + k*ell)
+    crs = bayer_groth.ShuffleColumnsCRS(generators[:n], generators[n], generators[n+1:n+1+k])
+    inputs = [generators[n+1+k+j*ell:n+1+k+(j+1)*ell] for j in range(k)]
+    permutation = get_random_permutation(ell)
+    r = random.randint(0, MODULUS)
+    outputs = bayer_groth_prove.shuffle_and_randomize_columns(inputs, permutation, r)
+
+    start = time.time()
+    proof = bayer_groth_prove.prove_columns(crs, inputs, outputs, permutation, r)
+    print("columns: ell={} one proof of {} columns: {:.3f}s, {} bytes".format(
+        ell, k, time.time() - start, encoding.encoded_size(proof)))
+
+    pair_crs = bayer_groth.ShuffleCRS(generators[:bayer_groth.get_crs_size(ell)], *generators[n:n+3])
+    start = time.time()
+    size = 0
+    for j in range(0, k, 2):
+        pair_proof = bayer_groth_prove.prove(pair_crs, inputs[j], inputs[j+1], outputs[j], outputs[j+1], permutation, r)
+        size += encoding.encoded_size(pair_proof)
+    print("columns: ell={} {} proofs of two columns: {:.3f}s, {} bytes".format(ell, k // 2, time.time() - start, size))
+
+def bench_joint(n=128):
+    """Time proving and verifying a shuffle with each proof version"""
+    crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(n)
+
+    # The first verification would validate the shuffled points for the next ones
+    validation.set_enabled(False)
+    for version in bayer_groth.PROOF_VERSIONS:
+        start = time.time()
+        proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r, version=version)
+        prove_time = time.time() - start
+        start = time.time()
+        assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof)
+        print("joint: n={} version {}: prove {:.3f}s, verify {:.3f}s, {} bytes".format(
+            n, version, prove_time, time.time() - start, encoding.encoded_size(proof)))
+    validation.set_enabled(True)
+
+def bench_aggregate(ell=28, m=4):
+    """Compare `m` separate shuffle proofs of `ell` elements with a single aggregated proof"""
+    n = bayer_groth.get_aggregate_size(m, ell)
+    generators = gen_generator_points(n + 3 + 2*m*ell)
+    aggregate_crs = bayer_groth.ShuffleCRS(generators[:n], generators[n], generators[n+1], generators[n+2])
+    crs = bayer_groth.ShuffleCRS(generators[:bayer_groth.get_crs_size(ell)], *generators[n:n+3])
+    permutations = [get_random_permutation(ell) for _ in range(m)]
+    vec_r = [random.randint(0, MODULUS) for _ in range(m)]
+    instances = []
+    for i, (permutation, r) in enumerate(zip(permutations, vec_r)):
+        vec_R = generators[n+3+2*i*ell:n+3+(2*i+1)*ell]
+        vec_S = generators[n+3+(2*i+1)*ell:n+3+(2*i+2)*ell]
+        instances.append((vec_R, vec_S) + bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r))
+
+    validation.set_enabled(False)
+    start = time.time()
+    proofs = [bayer_groth_prove.prove(crs, *instance, permutation, r)
+              for instance, permutation, r in zip(instances, permutations, vec_r)]
+    prove_time = time.time() - start
+    start = time.time()
+    for instance, proof in zip(instances, proofs):
+        assert bayer_groth.verify(crs, *instance, proof)
+    print("aggregate: {} separate proofs of {} elements: prove {:.3f}s, verify {:.3f}s, {} bytes".format(
+        m, ell, prove_time, time.time() - start, sum(encoding.encoded_size(proof) for proof in proofs)))
+
+    start = time.time()
+    proof = bayer_groth_prove.prove_aggregate(aggregate_crs, instances, permutations, vec_r)
+    prove_time = time.time() - start
+    start = time.time()
+    assert bayer_groth.verify_aggregate(aggregate_crs, instances, proof)
+    print("aggregate: one aggregated proof: prove {:.3f}s, verify {:.3f}s, {} bytes".format(
+        prove_time, time.time() - start, encoding.encoded_size(proof)))
+    validation.set_enabled(True)
+
+def bench_crs(n=1024, window=8):
+    """Time generating a CRS of `n` points, storing it (with and without fixed-base tables) and loading it back"""
+    start = time.time()
+    crs = crs_store.generate_crs(n, b"bench")
+    print("crs: generated {} points: {:.3f}s".format(n + 3, time.time() - start))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for store_window in [None, window]:
+            path = os.path.join(tmp_dir, "crs")
+            start = time.time()
+            crs_store.save_crs(path, crs, b"bench", store_window)
+            save_time = time.time() - start
+            start = time.time()
+            loaded_crs = crs_store.load_crs(path, b"bench")
+            load_time = time.time() - start
+            start = time.time()
+            util.msm(loaded_crs.vec_G, [random.randint(0, MODULUS) for _ in range(n)])
+            print("crs: window {}: save {:.3f}s, load {:.4f}s, first MSM {:.3f}s, {} bytes".format(
+                store_window, save_time, load_time, time.time() - start, os.path.getsize(path)))
+
+def bench_import(modules=("bayer_groth", "bayer_groth_prove", "crs_store", "py_ecc.optimized_bls12_381"), runs=5):
+    """
+    Time a fresh interpreter importing each of `modules`, minus the startup time of the interpreter itself, and check
+    whether py_ecc got imported along the way
+    """
+    def run(code):
+        start = time.time()
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True, capture_output=True, text=True).stdout
+        return time.time() - start, output
+
+    startup_time = min(run("pass")[0] for _ in range(runs))
+    for module in modules:
+        code = "import sys, {}; print(any(name.startswith('py_ecc') for name in sys.modules))".format(module)
+        results = [run(code) for _ in range(runs)]
+        print("import: {}: {:.1f}ms, py_ecc imported: {}".format(
+            module, 1000 * (min(duration for duration, _ in results) - startup_time), results[0][1].strip()))
+
+BENCHMARKS = {
+    "parallel": bench_parallel,
+    "backends": bench_backends,
+    "verify": bench_verify,
+    "online": bench_online,
+    "columns": bench_columns,
+    "joint": bench_joint,
+    "aggregate": bench_aggregate,
+    "crs": bench_crs,
+    "import": bench_import,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
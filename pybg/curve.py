@@ -0,0 +1,50 @@
+"""
+The elliptic curve backend: all the group operations of pybg go through this module.
+
+Two backends implement the G1 group of BLS12-381:
+- "int": our own arithmetic over plain Python integers (see `g1.py`). This is the default since it's much faster.
+- "py_ecc": py_ecc's `optimized_bls12_381`, which is what the Ethereum specs use. It serves as the reference backend.
+
+Both backends represent points in homogeneous projective coordinates, so `coordinates()` and `from_affine()` let the
+rest of the code (e.g. the point encodings) deal with integers regardless of the backend.
+
+The backend can be picked with the `PYBG_CURVE_BACKEND` environment variable or with `set_backend()`. Points created by
+one backend cannot be used with the other one, so the backend should be set before creating any points.
+
+py_ecc is only imported once its backend gets picked: it brings a whole pairing library, which takes several times
+longer to import than pybg itself.
+"""
+
+import os
+
+BACKENDS = ["int", "py_ecc"]
+
+def set_backend(name: str):
+    """Make all the group operations use the backend called `name`"""
+    global backend, field_modulus, curve_order, b, G1, Z1, glv_lambda, glv_beta
+    global add, double, neg, multiply, endomorphism, eq, is_inf, is_on_curve, normalize, coordinates, from_affine
+
+    # The GLV constants are the same for both backends
+    import g1
+    glv_lambda, glv_beta = g1.LAMBDA, g1.BETA
+
+    if name == "int":
+        add, double, neg, multiply, endomorphism = g1.add, g1.double, g1.neg, g1.multiply, g1.endomorphism
+        eq, is_inf, is_on_curve = g1.eq, g1.is_inf, g1.is_on_curve
+        normalize, coordinates, from_affine = g1.normalize, g1.coordinates, g1.from_affine
+        field_modulus, curve_order, b, G1, Z1 = g1.field_modulus, g1.curve_order, g1.b, g1.G1, g1.Z1
+    elif name == "py_ecc":
+        from py_ecc import optimized_bls12_381 as bls
+
+        add, double, neg, multiply, eq, is_inf = bls.add, bls.double, bls.neg, bls.multiply, bls.eq, bls.is_inf
+        endomorphism = lambda pt: (pt[0] * g1.BETA, pt[1], pt[2])
+        is_on_curve = lambda pt: bls.is_on_curve(pt, bls.b)
+        normalize = lambda pt: tuple(c.n for c in bls.normalize(pt))
+        coordinates = lambda pt: (pt[0].n, pt[1].n, pt[2].n)
+        from_affine = lambda x, y: (bls.FQ(x), bls.FQ(y), bls.FQ(1))
+        field_modulus, curve_order, b, G1, Z1 = bls.field_modulus, bls.curve_order, bls.b.n, bls.G1, bls.Z1
+    else:
+        raise ValueError("unknown curve backend {} (expected one of {})".format(name, BACKENDS))
+    backend = name
+
+set_backend(os.environ.get("PYBG_CURVE_BACKEND", "int"))
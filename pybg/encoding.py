@@ -0,0 +1,185 @@
+"""
+Binary encoding of proofs, CRSes and point vectors.
+
+Points are encoded using the 48-byte compressed encoding (see `util.compress_points()`), scalars as 32 little-endian
+bytes, small integers (the version of a proof) as a single byte, and point and scalar vectors as a 4-byte little-endian
+length followed by their elements. Every encoded object starts with a two-byte header: the format version and the type
+of the object.
+
+Decoding works directly over the given buffer: point vectors are decoded into `LazyPoints` which only decompress a
+point the first time it gets accessed.
+"""
+
+import dataclasses
+from collections.abc import Sequence
+
+import curve
+
+from bg_types import G1Point, G1PointVector, FieldElement, FieldElementVector
+import bayer_groth, gprod, inner_product, multiexp, sameexp
+from util import compress_points, decompress_point
+
+MODULUS = curve.curve_order
+
+# Version 2 added the proof version at the end of shuffle proofs
+FORMAT_VERSION = 2
+
+POINT_SIZE = 48
+SCALAR_SIZE = 32
+INTEGER_SIZE = 1
+LENGTH_SIZE = 4
+HEADER_SIZE = 2
+
+# The type byte of each object that can be encoded
+TYPES = {
+    G1PointVector: 1,
+    bayer_groth.ShuffleCRS: 2,
+    bayer_groth.ShuffleProof: 3,
+    gprod.GrandProductProof: 4,
+    inner_product.IPAProof: 5,
+    multiexp.MultiExpProof: 6,
+    sameexp.SameExponentProof: 7,
+    bayer_groth.ShuffleColumnsCRS: 8,
+    bayer_groth.ShuffleColumnsProof: 9,
+    multiexp.MultiExpColumnsProof: 10,
+    sameexp.SameExponentColumnsProof: 11,
+    bayer_groth.AggregateShuffleProof: 12,
+    sameexp.SameExponentBatchProof: 13,
+}
+
+class LazyPoints(Sequence):
+    """
+    A read-only vector of points backed by a buffer of compressed points. Each point is decompressed the first time it
+    is accessed, and then cached.
+
+    Subclasses can store the points differently by overriding `item_size` and `decode_item()`.
+    """
+    # Size of the encoding of every point in `data`
+    item_size = POINT_SIZE
+
+    def __init__(self, data: memoryview):
+        assert len(data) % self.item_size == 0
+        self.data = data
+        self.points = [None] * (len(data) // self.item_size)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if self.points[i] is None:
+            offset = (i % len(self)) * self.item_size
+            self.points[i] = self.decode_item(self.data[offset:offset + self.item_size])
+        return self.points[i]
+
+    def decode_item(self, data: memoryview):
+        """Decode the point encoded in `data`"""
+        return decompress_point(data)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+def encode(obj) -> bytes:
+    """Encode a proof, a CRS or a point vector"""
+    if isinstance(obj, (list, LazyPoints)):
+        obj_type = G1PointVector
+    else:
+        obj_type = type(obj)
+    return bytes([FORMAT_VERSION, TYPES[obj_type]]) + b"".join(encode_value(obj, obj_type))
+
+def decode(obj_type, data: bytes):
+    """
+    Decode an object of type `obj_type` (a proof or CRS class, or `G1PointVector`) from `data`, which can be any
+    bytes-like object.
+    """
+    data = memoryview(data)
+    if len(data) < HEADER_SIZE:
+        raise ValueError("truncated header")
+    if data[0] != FORMAT_VERSION:
+        raise ValueError("unsupported format version {}".format(data[0]))
+    if data[1] != TYPES[obj_type]:
+        raise ValueError("expected a {} but got object type {}".format(obj_type.__name__, data[1]))
+
+    obj, offset = decode_value(obj_type, data, HEADER_SIZE)
+    if offset != len(data):
+        raise ValueError("trailing bytes after the encoded object")
+    return obj
+
+def encoded_size(obj) -> int:
+    """Return the size in bytes of the encoding of a proof, a CRS or a point vector"""
+    return HEADER_SIZE + value_size(obj)
+
+def encode_value(value, value_type) -> list:
+    # Helper: Returns the encoding of `value` as a list of byte strings.
+    if value_type is G1Point:
+        return compress_points([value])
+    if value_type is FieldElement:
+        return [(value % MODULUS).to_bytes(SCALAR_SIZE, 'little')]
+    if value_type is int:
+        return [value.to_bytes(INTEGER_SIZE, 'little')]
+    if value_type is G1PointVector:
+        if type(value) is LazyPoints:
+            # Still compressed: just copy the buffer
+            return [len(value).to_bytes(LENGTH_SIZE, 'little'), bytes(value.data)]
+        return [len(value).to_bytes(LENGTH_SIZE, 'little')] + compress_points(value)
+    if value_type is FieldElementVector:
+        return [len(value).to_bytes(LENGTH_SIZE, 'little')] + [chunk for x in value for chunk in encode_value(x, FieldElement)]
+
+    # Proofs and CRSes are dataclasses: encode their fields in order
+    chunks = []
+    for field in dataclasses.fields(value_type):
+        chunks += encode_value(getattr(value, field.name), field.type)
+    return chunks
+
+def decode_value(value_type, data: memoryview, offset: int):
+    # Helper: Decodes a value of type `value_type` at `offset` of `data`. Returns the value and the offset right after it.
+    if value_type is G1Point:
+        return decompress_point(read(data, offset, POINT_SIZE)), offset + POINT_SIZE
+    if value_type is FieldElement:
+        x = int.from_bytes(read(data, offset, SCALAR_SIZE), 'little')
+        if x >= MODULUS:
+            raise ValueError("scalar is not reduced")
+        return x, offset + SCALAR_SIZE
+    if value_type is int:
+        return int.from_bytes(read(data, offset, INTEGER_SIZE), 'little'), offset + INTEGER_SIZE
+    if value_type is G1PointVector:
+        length = int.from_bytes(read(data, offset, LENGTH_SIZE), 'little')
+        offset += LENGTH_SIZE
+        return LazyPoints(read(data, offset, length * POINT_SIZE)), offset + length * POINT_SIZE
+    if value_type is FieldElementVector:
+        length = int.from_bytes(read(data, offset, LENGTH_SIZE), 'little')
+        offset += LENGTH_SIZE
+        scalars = read(data, offset, length * SCALAR_SIZE)
+        return [decode_value(FieldElement, scalars, i * SCALAR_SIZE)[0] for i in range(length)], offset + length * SCALAR_SIZE
+
+    values = []
+    for field in dataclasses.fields(value_type):
+        value, offset = decode_value(field.type, data, offset)
+        values.append(value)
+    return value_type(*values), offset
+
+def value_size(value, value_type=None) -> int:
+    # Helper: Returns the size in bytes of the encoding of `value`.
+    if value_type is None:
+        value_type = G1PointVector if isinstance(value, (list, LazyPoints)) else type(value)
+    if value_type is G1Point:
+        return POINT_SIZE
+    if value_type is FieldElement:
+        return SCALAR_SIZE
+    if value_type is int:
+        return INTEGER_SIZE
+    if value_type is G1PointVector:
+        return LENGTH_SIZE + len(value) * POINT_SIZE
+    if value_type is FieldElementVector:
+        return LENGTH_SIZE + len(value) * SCALAR_SIZE
+    return sum(value_size(getattr(value, field.name), field.type) for field in dataclasses.fields(value_type))
+
+def read(data: memoryview, offset: int, size: int) -> memoryview:
+    # Helper: Returns `size` bytes of `data` starting at `offset`, without copying them.
+    if offset + size > len(data):
+        raise ValueError("truncated data")
+    return data[offset:offset + size]
@@ -0,0 +1,118 @@
+"""
+Arithmetic over the G1 group of BLS12-381 using plain Python integers.
+
+Points are tuples `(X, Y, Z)` of integers in homogeneous projective coordinates, standing for the affine point
+`(X/Z, Y/Z)`, which is the same representation as py_ecc's optimized backend but without an `FQ` object per coordinate.
+The point at infinity is `(0, 1, 0)`.
+
+Additions and doublings use the complete formulas for `a = 0` curves by Renes, Costello and Batina ("Complete addition
+formulas for prime order elliptic curves", algorithms 7 and 9). They work for any pair of inputs, including the point at
+infinity and equal points, because the curve has no points of order two.
+"""
+
+field_modulus = 0x1a0111ea397fe69a4b1ba7b6434bacd764774b84f38512bf6730d2a0f6b0f6241eabfffeb153ffffb9feffffffffaaab
+curve_order = 0x73eda753299d7d483339d80809a1d80553bda402fffe5bfeffffffff00000001
+
+# The curve is y^2 = x^3 + b
+b = 4
+B3 = 3 * b
+
+G1 = (0x17f1d3a73197d7942695638c4fa9ac0fc3688c4f9774b905a14e3a3f171bac586c55e83ff97a1aeffb3af00adb22c6bb,
+      0x08b3f481e3aaa0f1a09e30ed741d8ae4fcf5e095d5d00af600db18cb2c04b3edd03cc744a2888ae40caa232946c5e7e1,
+      1)
+Z1 = (0, 1, 0)
+
+# GLV endomorphism: (x, y) -> (BETA * x, y), where BETA is a cube root of unity in the base field. On the prime-order
+# subgroup it acts as multiplication by LAMBDA = z^2 - 1 (z being the BLS parameter -0xd201000000010000), a cube root
+# of unity modulo the curve order: LAMBDA^2 + LAMBDA + 1 is exactly the curve order.
+BETA = 0x1a0111ea397fe699ec02408663d4de85aa0d857d89759ad4897d29650fb85f9b409427eb4f49fffd8bfd00000000aaac
+LAMBDA = 0xac45a4010001a40200000000ffffffff
+
+def add(pt1, pt2):
+    """Add two points"""
+    p = field_modulus
+    X1, Y1, Z1 = pt1
+    X2, Y2, Z2 = pt2
+    t0 = X1 * X2 % p
+    t1 = Y1 * Y2 % p
+    t2 = Z1 * Z2 % p
+    t3 = ((X1 + Y1) * (X2 + Y2) - t0 - t1) % p  # X1*Y2 + X2*Y1
+    t4 = ((Y1 + Z1) * (Y2 + Z2) - t1 - t2) % p  # Y1*Z2 + Y2*Z1
+    t5 = ((X1 + Z1) * (X2 + Z2) - t0 - t2) * B3 % p  # b3 * (X1*Z2 + X2*Z1)
+    t0 = 3 * t0
+    t2 = B3 * t2
+    t6 = t1 + t2
+    t1 = t1 - t2
+    return ((t3 * t1 - t4 * t5) % p,
+            (t1 * t6 + t5 * t0) % p,
+            (t6 * t4 + t0 * t3) % p)
+
+def double(pt):
+    """Double a point"""
+    p = field_modulus
+    X, Y, Z = pt
+    t0 = Y * Y % p
+    t2 = B3 * Z * Z % p
+    t1 = Y * Z % p
+    z = 8 * t0
+    x3 = t2 * z
+    y3 = t0 + t2
+    t0 = (t0 - 3 * t2) % p
+    return ((2 * t0 * X * Y) % p,
+            (t0 * y3 + x3) % p,
+            (t1 * z) % p)
+
+def neg(pt):
+    """Negate a point"""
+    X, Y, Z = pt
+    return (X, -Y % field_modulus, Z)
+
+def multiply(pt, n: int):
+    """
+    Multiply a point by an integer with double-and-add. `n` is not reduced modulo the curve order, so that this also
+    works for points outside of the prime-order subgroup (e.g. to clear the cofactor).
+    """
+    if n < 0:
+        pt, n = neg(pt), -n
+    o = Z1
+    for bit in bin(n)[2:]:
+        o = double(o)
+        if bit == '1':
+            o = add(o, pt)
+    return o
+
+def endomorphism(pt):
+    """Apply the GLV endomorphism, which maps a point `P` of the prime-order subgroup to `LAMBDA * P`"""
+    X, Y, Z = pt
+    return (BETA * X % field_modulus, Y, Z)
+
+def eq(pt1, pt2) -> bool:
+    """Check whether two points are equal"""
+    p = field_modulus
+    X1, Y1, Z1 = pt1
+    X2, Y2, Z2 = pt2
+    return (X1 * Z2 - X2 * Z1) % p == 0 and (Y1 * Z2 - Y2 * Z1) % p == 0
+
+def is_inf(pt) -> bool:
+    """Check whether a point is the point at infinity"""
+    return pt[2] % field_modulus == 0
+
+def is_on_curve(pt) -> bool:
+    """Check whether a point is on the curve: Y^2 * Z = X^3 + b * Z^3"""
+    p = field_modulus
+    X, Y, Z = pt
+    return (Y * Y * Z - X * X * X - b * Z * Z * Z) % p == 0
+
+def normalize(pt):
+    """Return the affine coordinates of a point, or (0, 0) for the point at infinity"""
+    p = field_modulus
+    z_inv = pow(pt[2], p - 2, p)
+    return (pt[0] * z_inv % p, pt[1] * z_inv % p)
+
+def coordinates(pt):
+    """Return the projective coordinates of a point as integers"""
+    return pt
+
+def from_affine(x: int, y: int):
+    """Create a point from its affine coordinates"""
+    return (x, y, 1)
@@ -2,15 +2,15 @@
 Grand-product argument verifier
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 from dataclasses import dataclass
 
 import inner_product as ipa
 from bg_types import G1Point, FieldElement, G1PointVector
 from transcript import Transcript
-from util import msm, inv
+from util import msm, multiply, inv, check_equations, ScaledBasis
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
 @dataclass
 class GrandProductProof():
@@ -23,6 +23,29 @@ def verify(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
     """
     Verify that `gprod_result` is the product of the non-blinder vector elements commited in `A`.
     """
+    assert check_equations(get_verification_equations(transcript, crs_vec_G, crs_U, A, gprod_result, n_blinders, proof))
+
+    return True
+
+def get_verification_equations(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
+                               A: G1Point, gprod_result: FieldElement, n_blinders: int, proof: GrandProductProof,
+                               sum_vec_G: G1Point = None) -> list:
+    """
+    Return the equations of the underlying inner product argument without checking them.
+
+    `sum_vec_G` is the sum of the non-blinder points of `crs_vec_G`, for callers that have it precomputed.
+    """
+    ipa_state = verify_setup(transcript, crs_vec_G, crs_U, A, gprod_result, n_blinders, proof, sum_vec_G)
+    ipa.replay_rounds(transcript, ipa_state)
+    return ipa.get_final_equations(ipa_state)
+
+def verify_setup(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
+                 A: G1Point, gprod_result: FieldElement, n_blinders: int, proof: GrandProductProof,
+                 sum_vec_G: G1Point = None) -> ipa.IPAVerifierState:
+    """
+    Replay the argument up to the recursion of its inner product argument, and return the state of the latter (see
+    `inner_product.verify_setup()`).
+    """
     n = len(crs_vec_G)
     ell = n - n_blinders
 
@@ -34,25 +57,21 @@ def verify(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
 
     # Step 2
     # Start building C
-    C = msm(crs_vec_G[:ell], [1]*ell)
-    C = b.multiply(C, MODULUS - inv_x)
-    C = b.add(C, A)
-
-    # Now build the new basis
-    crs_H = []
-    pow_inv_x = inv_x
-    for G in crs_vec_G[1:ell]:
-        H = b.multiply(G, pow_inv_x)
-        crs_H.append(H)
-        pow_inv_x = pow_inv_x * inv_x % MODULUS
-    crs_H.append(b.multiply(crs_vec_G[0], pow_inv_x))
-
-    # Also add blinders to crs_H
-    pow_inv_x = pow_inv_x * inv_x % MODULUS
-    for G in crs_vec_G[ell:]:
-        crs_H.append(b.multiply(G, pow_inv_x))
+    C = sum_vec_G if sum_vec_G is not None else msm(crs_vec_G[:ell], [1]*ell)
+    C = multiply(C, MODULUS - inv_x)
+    C = curve.add(C, A)
+
+    # Now build the new basis: `crs_vec_G[1:ell]` followed by `crs_vec_G[0]`, scaled by `inv_x, inv_x^2, ..., inv_x^ell`.
+    # It is kept as a `ScaledBasis` so that the scaling goes into the scalars of the IPA.
+    vec_factors = [inv_x]
+    for _ in range(ell - 1):
+        vec_factors.append(vec_factors[-1] * inv_x % MODULUS)
+
+    # Also add blinders to crs_H, all scaled by `inv_x^(ell+1)`
+    vec_factors += [vec_factors[-1] * inv_x % MODULUS] * (n - ell)
+    crs_H = ScaledBasis(crs_vec_G[1:ell] + crs_vec_G[:1] + crs_vec_G[ell:], vec_factors)
 
     # Step 3
     inner_prod = (proof.bl * (x ** (ell+1)) + gprod_result * (x ** ell) - 1) % MODULUS
-    return ipa.verify(transcript, crs_vec_G, crs_H, crs_U, proof.B, C, inner_prod, proof.ipa_proof)
+    return ipa.verify_setup(transcript, crs_vec_G, crs_H, crs_U, proof.B, C, inner_prod, proof.ipa_proof)
 
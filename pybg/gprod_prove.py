@@ -3,36 +3,72 @@ Grand-product argument prover
 """
 
 import random
+from dataclasses import dataclass
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 
 from bg_types import G1Point, FieldElement, G1PointVector, FieldElementVector
 import inner_product_prove as ipa_prove
 import gprod
 from transcript import Transcript
-from util import msm, get_inner_product, inv
+from util import msm, multiply, get_inner_product, inv, ScaledBasis
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+@dataclass
+class GrandProductBlinders:
+    """The blinders of a grand-product proof (including the ones of its IPA), and their commitment `B_bl` to the CRS"""
+    vec_b_blinders: FieldElementVector
+    B_bl: G1Point
+    ipa_blinders: ipa_prove.IPABlinders
+
+def precompute(crs_vec_G: G1PointVector, n_blinders: int) -> GrandProductBlinders:
+    """Draw the blinders of a proof ahead of time. They must only be used for a single proof."""
+    n = len(crs_vec_G)
+    ell = n - n_blinders
+
+    vec_b_blinders = [random.randint(0, MODULUS) for _ in range(n_blinders)]
+    B_bl = msm(crs_vec_G[ell:], vec_b_blinders)
+    # The IPA runs over the scaled basis `crs_H` (see `prove()`), whose base points are already known
+    ipa_blinders = ipa_prove.precompute(crs_vec_G, crs_vec_G[1:ell] + crs_vec_G[:1] + crs_vec_G[ell:])
+    return GrandProductBlinders(vec_b_blinders, B_bl, ipa_blinders)
 
 def prove(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
           A: G1Point, gprod_result: FieldElement,
-          vec_a: FieldElementVector, n_blinders: int) -> gprod.GrandProductProof:
+          vec_a: FieldElementVector, n_blinders: int,
+          blinders: GrandProductBlinders = None, sum_vec_G: G1Point = None) -> gprod.GrandProductProof:
     """
     Prove that there exists `vec_a` such that:
     - `A` is a commitment to `vec_a`
     - `gprod_result` is the product of the non-blinder elements of `vec_a`
+
+    `blinders` can come from `precompute()`. `sum_vec_G` is the sum of the non-blinder points of `crs_vec_G`, if the
+    caller has it precomputed.
+    """
+    B, bl, ipa_state = prove_setup(transcript, crs_vec_G, crs_U, A, gprod_result, vec_a, n_blinders, blinders, sum_vec_G)
+    ipa_prove.prove_rounds(transcript, ipa_state)
+    return gprod.GrandProductProof(B, bl, ipa_prove.get_proof(ipa_state))
+
+def prove_setup(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
+                A: G1Point, gprod_result: FieldElement,
+                vec_a: FieldElementVector, n_blinders: int,
+                blinders: GrandProductBlinders = None, sum_vec_G: G1Point = None):
+    """
+    Run `prove()` up to the recursion of its inner product argument. Returns `B`, `bl` and the state of the inner
+    product proof (see `inner_product_prove.prove_setup()`).
     """
     n = len(crs_vec_G)
     ell = n - n_blinders
+    blinders = blinders or precompute(crs_vec_G, n_blinders)
 
     # Step 1
     vec_b = []
     vec_b.append(1)
     for i, a in enumerate(vec_a[1:ell]):
         vec_b.append((a * vec_b[-1]) % MODULUS)
-    vec_b.extend([random.randint(0, MODULUS) for _ in range(n_blinders)])
+    vec_b.extend(blinders.vec_b_blinders)
 
-    B = msm(crs_vec_G, vec_b)
+    B = msm(crs_vec_G[:ell] + [blinders.B_bl], vec_b[:ell] + [1])
     bl = get_inner_product(vec_a[ell:], vec_b[ell:])
 
     transcript.absorb_points([A, B])
@@ -42,9 +78,9 @@ def prove(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
 
     # Step 2
     # Start building C
-    C = msm(crs_vec_G[:ell], [1]*ell)
-    C = b.multiply(C, MODULUS - inv_x)
-    C = b.add(C, A)
+    C = sum_vec_G if sum_vec_G is not None else msm(crs_vec_G[:ell], [1]*ell)
+    C = multiply(C, MODULUS - inv_x)
+    C = curve.add(C, A)
 
     vec_c = []
     pow_x = x
@@ -64,25 +100,21 @@ def prove(transcript: Transcript, crs_vec_G: G1PointVector, crs_U: G1Point,
     for a in vec_a[ell:]:
         vec_c.append((a * pow_x) % MODULUS)
 
-    # Build the new basis
-    crs_H = []
-    pow_inv_x = inv_x
-    for G in crs_vec_G[1:ell]:
-        H = b.multiply(G, pow_inv_x)
-        crs_H.append(H)
-        pow_inv_x = (pow_inv_x * inv_x) % MODULUS
-    crs_H.append(b.multiply(crs_vec_G[0], pow_inv_x))
+    # Build the new basis: `crs_vec_G[1:ell]` followed by `crs_vec_G[0]`, scaled by `inv_x, inv_x^2, ..., inv_x^ell`.
+    # It is kept as a `ScaledBasis` so that the scaling goes into the scalars of the IPA.
+    vec_factors = [inv_x]
+    for _ in range(ell - 1):
+        vec_factors.append(vec_factors[-1] * inv_x % MODULUS)
 
-    # Also add blinders to crs_H
-    pow_inv_x = (pow_inv_x * inv_x) % MODULUS
-    for G in crs_vec_G[ell:]:
-        crs_H.append(b.multiply(G, pow_inv_x))
+    # Also add blinders to crs_H, all scaled by `inv_x^(ell+1)`
+    vec_factors += [vec_factors[-1] * inv_x % MODULUS] * (n - ell)
+    crs_H = ScaledBasis(crs_vec_G[1:ell] + crs_vec_G[:1] + crs_vec_G[ell:], vec_factors)
 
     # Step 3
     inner_prod = (bl * (x ** (ell+1)) + gprod_result * (x ** ell) - 1) % MODULUS
-    ipa_proof = ipa_prove.prove(transcript, crs_vec_G, crs_H, crs_U, B, C, inner_prod, vec_b, vec_c)
-
     # Sanity check
     assert get_inner_product(vec_b, vec_c) == inner_prod
 
-    return gprod.GrandProductProof(B, bl, ipa_proof)
+    ipa_state = ipa_prove.prove_setup(transcript, crs_vec_G, crs_H, crs_U, B, C, inner_prod, vec_b, vec_c,
+                                      blinders.ipa_blinders)
+    return B, bl, ipa_state
@@ -2,14 +2,14 @@
 Inner product argument verifier
 """
 
-from py_ecc import optimized_bls12_381 as b
-from dataclasses import dataclass
+import curve
+from dataclasses import dataclass, field
 
-from bg_types import G1Point, FieldElement, G1PointVector
+from bg_types import G1Point, FieldElement, G1PointVector, FieldElementVector
 from transcript import Transcript
-from util import msm, inv, left_half, right_half
+from util import batch_inv, get_folding_coefficients, check_equations, unscale
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
 @dataclass
 class IPAProof():
@@ -28,43 +28,96 @@ def verify(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointV
            B: G1Point, C: G1Point, z: FieldElement, proof: IPAProof) -> bool:
     """
     Verify that `z` is the inner product of the vectors commited in `B` and `C`.
+
+    `crs_vec_H` can also be a `ScaledBasis`, which is how the grand-product argument passes its derived basis.
+    """
+    assert check_equations(get_verification_equations(transcript, crs_vec_G, crs_vec_H, crs_U, B, C, z, proof))
+
+    return True
+
+def get_verification_equations(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointVector,
+                               crs_U: G1Point, B: G1Point, C: G1Point, z: FieldElement, proof: IPAProof) -> list:
+    """
+    Like `verify()` but instead of checking the two final equations (for `B` and `C`), return them as (points, scalars)
+    pairs whose MSMs should be the point at infinity.
     """
+    # Steps 1 and 2
+    state = verify_setup(transcript, crs_vec_G, crs_vec_H, crs_U, B, C, z, proof)
+
+    # Step 3
+    replay_rounds(transcript, state)
+
+    # Step 4
+    return get_final_equations(state)
+
+@dataclass
+class IPAVerifierState:
+    """
+    An inner product proof whose steps before the recursion were replayed by the verifier (see `verify_setup()`), along
+    with the challenges of the rounds replayed so far.
+    """
+    crs_vec_G: G1PointVector
+    crs_vec_H: G1PointVector
+    crs_U: G1Point
+    B: G1Point
+    C: G1Point
+    z: FieldElement
+    x: FieldElement
+    x_U: FieldElement
+    proof: IPAProof
+    vec_x: FieldElementVector = field(default_factory=list)
+
+def verify_setup(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointVector,
+                 crs_U: G1Point, B: G1Point, C: G1Point, z: FieldElement, proof: IPAProof) -> IPAVerifierState:
+    """Replay the steps of the argument that come before the recursion"""
+    n = len(crs_vec_G)
+    assert len(crs_vec_H) == n
+    assert 2 ** len(proof.vec_B_L) == n
+    assert len(proof.vec_B_R) == len(proof.vec_C_L) == len(proof.vec_C_R) == len(proof.vec_B_L)
+
     # Step 1
     transcript.absorb_points([B, C, proof.R, proof.S])
     transcript.absorb_scalars([z, proof.bl_1, proof.bl_2])
     x = transcript.get_challenge_scalar()
 
     z = (z + x*proof.bl_1 + (x**2)*proof.bl_2) % MODULUS
-    B = b.add(B, b.multiply(proof.R, x))
-    C = b.add(C, b.multiply(proof.S, x))
 
     # Step 2
     transcript.absorb_scalars([x])
-    x = transcript.get_challenge_scalar()
+    x_U = transcript.get_challenge_scalar()
 
-    U = b.multiply(crs_U, x)
-    B = b.add(B, b.multiply(U, z))
+    return IPAVerifierState(crs_vec_G, crs_vec_H, crs_U, B, C, z, x, x_U, proof)
 
-    # Step 3
-    for i in range(len(proof.vec_B_L)):
-        G_L, G_R = left_half(crs_vec_G), right_half(crs_vec_G)
-        H_L, H_R = left_half(crs_vec_H), right_half(crs_vec_H)
+def replay_rounds(transcript: Transcript, state: IPAVerifierState):
+    """Replay the rounds of the recursion from `state`, and store their challenges in `state.vec_x`"""
+    # Instead of folding the points every round, we just replay the transcript to get the challenges of every round
+    for i in range(len(state.proof.vec_B_L)):
+        transcript.absorb_points(get_round_points(state.proof, i))
+        state.vec_x.append(transcript.get_challenge_scalar())
 
-        transcript.absorb_points([proof.vec_B_L[i], proof.vec_C_L[i], proof.vec_B_R[i], proof.vec_C_R[i]])
-        x = transcript.get_challenge_scalar()
-        x_inv = inv(x)
+def get_round_points(proof: IPAProof, i: int) -> G1PointVector:
+    """Return the cross terms of round `i`, in the order in which they get absorbed in the transcript"""
+    return [proof.vec_B_L[i], proof.vec_C_L[i], proof.vec_B_R[i], proof.vec_C_R[i]]
 
-        B = msm([proof.vec_B_L[i], B, proof.vec_B_R[i]], [x, 1, x_inv])
-        C = msm([proof.vec_C_L[i], C, proof.vec_C_R[i]], [x, 1, x_inv])
+def get_final_equations(state: IPAVerifierState) -> list:
+    """Return the two final equations of the argument, once the challenges of all its rounds are in `state.vec_x`"""
+    proof, n = state.proof, len(state.crs_vec_G)
+    vec_x = state.vec_x
+    assert len(vec_x) == len(proof.vec_B_L)
+    vec_x_inv = batch_inv(vec_x)
 
-        crs_vec_G = [b.add(GL, b.multiply(GR, x_inv)) for (GL, GR) in zip(G_L, G_R)]
-        crs_vec_H = [b.add(HL, b.multiply(HR, x)) for (HL, HR) in zip(H_L, H_R)]
+    # The folded `crs_vec_G` and `crs_vec_H` are `<vec_s_G, crs_vec_G>` and `<vec_s_H, crs_vec_H>`, so we check each of
+    # the final equations as a single MSM
+    vec_s_G = get_folding_coefficients(vec_x_inv, n)
+    # A scaled `crs_vec_H` is checked over its base points, with its factors folded into the coefficients
+    crs_vec_H, vec_s_H = unscale(state.crs_vec_H, get_folding_coefficients(vec_x, n))
 
-    # Step 4
-    assert len(crs_vec_G) == len(crs_vec_H) == 1
-    exp_B = msm([crs_vec_G[0], U], [proof.tip_b, proof.tip_b * proof.tip_c])
-    exp_C = b.multiply(crs_vec_H[0], proof.tip_c)
+    # Check that `B + x*R + z*U + sum(x_i*B_L_i + x_i^-1*B_R_i) == tip_b * G + tip_b * tip_c * U`
+    check_B = ([state.B, proof.R, state.crs_U] + proof.vec_B_L + proof.vec_B_R + state.crs_vec_G,
+               [1, state.x, (state.z - proof.tip_b * proof.tip_c) * state.x_U] + vec_x + vec_x_inv +
+               [(MODULUS - proof.tip_b) * s % MODULUS for s in vec_s_G])
+    # Check that `C + x*S + sum(x_i*C_L_i + x_i^-1*C_R_i) == tip_c * H`
+    check_C = ([state.C, proof.S] + proof.vec_C_L + proof.vec_C_R + crs_vec_H,
+               [1, state.x] + vec_x + vec_x_inv + [(MODULUS - proof.tip_c) * s % MODULUS for s in vec_s_H])
 
-    assert b.eq(B, exp_B) and b.eq(C, exp_C)
-
-    return True
+    return [check_B, check_C]
@@ -2,37 +2,108 @@
 Inner product argument prover
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 
 import random
+from dataclasses import dataclass, field
 
 import inner_product as ipa
 from bg_types import G1Point, FieldElement, G1PointVector, FieldElementVector
 from transcript import Transcript
-from util import msm, is_power_of_two, inv, get_inner_product, left_half, right_half
+from util import msm_batch, multiply, fold, is_power_of_two, inv, batch_inv, get_inner_product, left_half, right_half, \
+    ScaledBasis
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+@dataclass
+class IPABlinders:
+    """The blinders of an inner product proof, and their commitments `R` and `S`"""
+    vec_r: FieldElementVector
+    vec_s: FieldElementVector
+    R: G1Point
+    S: G1Point
+
+def precompute(crs_vec_G: G1PointVector, crs_vec_H: G1PointVector) -> IPABlinders:
+    """
+    Draw the blinders of a proof ahead of time. They must only be used for a single proof. If the proof will use a
+    `ScaledBasis` for `crs_vec_H`, pass its base points: its factors do not need to be known yet.
+    """
+    n = len(crs_vec_G)
+    vec_r = [random.randint(0, MODULUS) for i in range(n)]
+    vec_s = [random.randint(0, MODULUS) for i in range(n)]
+    R, S = msm_batch([(crs_vec_G, vec_r), (crs_vec_H, vec_s)])
+    return IPABlinders(vec_r, vec_s, R, S)
+
+@dataclass
+class IPAProverState:
+    """
+    An inner product proof between two rounds of its recursion: the vectors and bases that are left to fold, and the
+    cross terms of the rounds so far. See `prove_setup()`.
+    """
+    R: G1Point
+    S: G1Point
+    bl_1: FieldElement
+    bl_2: FieldElement
+    crs_vec_G: G1PointVector
+    crs_vec_H: G1PointVector
+    U: G1Point
+    vec_b: FieldElementVector
+    vec_c: FieldElementVector
+    vec_B_L: G1PointVector = field(default_factory=list)
+    vec_B_R: G1PointVector = field(default_factory=list)
+    vec_C_L: G1PointVector = field(default_factory=list)
+    vec_C_R: G1PointVector = field(default_factory=list)
 
 def prove(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointVector, crs_U: G1Point,
           B: G1Point, C: G1Point, z: FieldElement,
-          vec_b: FieldElementVector, vec_c: FieldElementVector) -> ipa.IPAProof:
+          vec_b: FieldElementVector, vec_c: FieldElementVector, blinders: IPABlinders = None) -> ipa.IPAProof:
     """
     Prove that there exist `vec_b` and `vec_c` such that:
     - z is the inner product of `vec_b` and `vec_c`
     - B is the commitment of `vec_b`
     - C is the commitment of `vec_c`
+
+    `crs_vec_H` can also be a `ScaledBasis`: it is then folded without ever computing its points.
+
+    `blinders` can come from `precompute()`.
+    """
+    # Steps 1 and 2
+    state = prove_setup(transcript, crs_vec_G, crs_vec_H, crs_U, B, C, z, vec_b, vec_c, blinders)
+
+    # Step 3
+    prove_rounds(transcript, state)
+
+    # Step 4
+    return get_proof(state)
+
+def prove_rounds(transcript: Transcript, state: IPAProverState):
+    """Run the log(n) rounds of the recursion from `state`"""
+    while len(state.vec_b) > 1:
+        transcript.absorb_points(prove_round(state))
+        x = transcript.get_challenge_scalar()
+        fold_round(state, x)
+
+def prove_setup(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointVector, crs_U: G1Point,
+                B: G1Point, C: G1Point, z: FieldElement,
+                vec_b: FieldElementVector, vec_c: FieldElementVector, blinders: IPABlinders = None) -> IPAProverState:
+    """
+    Run the steps of `prove()` that come before the recursion, and return the state that its rounds start from.
     """
     n = len(vec_b)
     assert len(vec_b) == len(vec_c) == len(crs_vec_G) == len(crs_vec_H)
-    assert is_power_of_two(len(vec_b))
-
-    vec_B_L, vec_B_R, vec_C_L, vec_C_R = [], [], [], []
+    assert is_power_of_two(n)
 
     # Step 1
-    vec_r = [random.randint(0, MODULUS) for i in range(n)]
-    vec_s = [random.randint(0, MODULUS) for i in range(n)]
-    R = msm(crs_vec_G, vec_r)
-    S = msm(crs_vec_H, vec_s)
+    if isinstance(crs_vec_H, ScaledBasis):
+        blinders = blinders or precompute(crs_vec_G, crs_vec_H.points)
+        # The blinders were drawn against the base points of `crs_vec_H`: dividing them by its factors gives uniformly
+        # random blinders with the same commitment `S` against `crs_vec_H` itself
+        vec_s = [s * f_inv % MODULUS for s, f_inv in zip(blinders.vec_s, batch_inv(crs_vec_H.factors))]
+    else:
+        blinders = blinders or precompute(crs_vec_G, crs_vec_H)
+        vec_s = blinders.vec_s
+    vec_r, R, S = blinders.vec_r, blinders.R, blinders.S
+    assert len(vec_r) == len(vec_s) == n
 
     # Create blinders
     bl_1 = get_inner_product(vec_b, vec_s) + get_inner_product(vec_c, vec_r)
@@ -49,37 +120,57 @@ def prove(transcript: Transcript, crs_vec_G: G1PointVector, crs_vec_H: G1PointVe
     # Step 2
     transcript.absorb_scalars([x])
     x = transcript.get_challenge_scalar()
-    U = b.multiply(crs_U, x)
-
-    # Step 3: log(n) rounds of recursion
-    while len(vec_b) > 1:
-        # Generate the left-side and right-side points
-        b_L, b_R = left_half(vec_b), right_half(vec_b)
-        c_L, c_R = left_half(vec_c), right_half(vec_c)
-        G_L, G_R = left_half(crs_vec_G), right_half(crs_vec_G)
-        H_L, H_R = left_half(crs_vec_H), right_half(crs_vec_H)
-
-        C_L_b = b.add(msm(G_L, b_R), b.multiply(U, get_inner_product(b_R, c_L)))
-        C_R_b = b.add(msm(G_R, b_L), b.multiply(U, get_inner_product(b_L, c_R)))
-        C_L_c = msm(H_R, c_L)
-        C_R_c = msm(H_L, c_R)
-
-        # Append to proof
-        vec_B_L.append(C_L_b)
-        vec_C_L.append(C_L_c)
-        vec_B_R.append(C_R_b)
-        vec_C_R.append(C_R_c)
-
-        transcript.absorb_points([C_L_b, C_L_c, C_R_b, C_R_c])
-        x = transcript.get_challenge_scalar()
-        x_inv = inv(x)
+    U = multiply(crs_U, x)
 
-        vec_b = [(bL + bR * x) % MODULUS for (bL, bR) in zip(b_L, b_R)]
-        vec_c = [(cL + cR * x_inv) % MODULUS for (cL, cR) in zip(c_L, c_R)]
-        crs_vec_G = [b.add(GL, b.multiply(GR, x_inv)) for (GL, GR) in zip(G_L, G_R)]
-        crs_vec_H = [b.add(HL, b.multiply(HR, x)) for (HL, HR) in zip(H_L, H_R)]
+    return IPAProverState(R, S, bl_1, bl_2, crs_vec_G, crs_vec_H, U, vec_b, vec_c)
 
-    # Step 4
-    assert len(vec_b) == len(vec_c) == 1
-    return ipa.IPAProof(R, S, bl_1, bl_2, vec_B_L, vec_B_R, vec_C_L, vec_C_R, vec_b[0], vec_c[0])
+def prove_round(state: IPAProverState) -> G1PointVector:
+    """
+    Compute the cross terms of the next round of the recursion and add them to the proof. Returns them in the order in
+    which they get absorbed in the transcript.
+    """
+    vec_b, vec_c = state.vec_b, state.vec_c
+    # Generate the left-side and right-side points
+    b_L, b_R = left_half(vec_b), right_half(vec_b)
+    c_L, c_R = left_half(vec_c), right_half(vec_c)
+    G_L, G_R = left_half(state.crs_vec_G), right_half(state.crs_vec_G)
+    H_L, H_R = left_half(state.crs_vec_H), right_half(state.crs_vec_H)
+
+    # These MSMs are independent of each other, so we compute them as a batch
+    C_L_b, C_R_b, C_L_c, C_R_c = msm_batch([
+        (G_L + [state.U], b_R + [get_inner_product(b_R, c_L)]),
+        (G_R + [state.U], b_L + [get_inner_product(b_L, c_R)]),
+        (H_R, c_L),
+        (H_L, c_R),
+    ])
+
+    # Append to proof
+    state.vec_B_L.append(C_L_b)
+    state.vec_C_L.append(C_L_c)
+    state.vec_B_R.append(C_R_b)
+    state.vec_C_R.append(C_R_c)
+    return [C_L_b, C_L_c, C_R_b, C_R_c]
+
+def fold_round(state: IPAProverState, x: FieldElement, folded_crs_vec_G: G1PointVector = None):
+    """
+    Fold the vectors and bases of `state` with the challenge `x` of the current round.
 
+    A caller that already folded `crs_vec_G` with `x^-1` (see `multiexp_prove.prove_rounds()`) can pass the result as
+    `folded_crs_vec_G`.
+    """
+    x_inv = inv(x)
+    b_L, b_R = left_half(state.vec_b), right_half(state.vec_b)
+    c_L, c_R = left_half(state.vec_c), right_half(state.vec_c)
+
+    state.vec_b = [(bL + bR * x) % MODULUS for (bL, bR) in zip(b_L, b_R)]
+    state.vec_c = [(cL + cR * x_inv) % MODULUS for (cL, cR) in zip(c_L, c_R)]
+    if folded_crs_vec_G is None:
+        folded_crs_vec_G = fold(left_half(state.crs_vec_G), right_half(state.crs_vec_G), x_inv)
+    state.crs_vec_G = folded_crs_vec_G
+    state.crs_vec_H = fold(left_half(state.crs_vec_H), right_half(state.crs_vec_H), x)
+
+def get_proof(state: IPAProverState) -> ipa.IPAProof:
+    """Return the proof of a finished recursion"""
+    assert len(state.vec_b) == len(state.vec_c) == 1
+    return ipa.IPAProof(state.R, state.S, state.bl_1, state.bl_2, state.vec_B_L, state.vec_B_R, state.vec_C_L,
+                        state.vec_C_R, state.vec_b[0], state.vec_c[0])
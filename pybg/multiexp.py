@@ -2,14 +2,15 @@
 Multi-exponentiation argument verifier
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 from dataclasses import dataclass
 
 from bg_types import G1Point, FieldElement, G1PointVector
+import inner_product as ipa
 from transcript import Transcript
-from util import msm, inv, left_half, right_half
+from util import msm, batch_inv, get_folding_coefficients, check_equations, unscale
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
 @dataclass
 class MultiExpProof():
@@ -25,46 +26,140 @@ class MultiExpProof():
     tip_a: FieldElement
 
 def verify(transcript: Transcript, crs_G: G1PointVector,
-           vec_T: G1PointVector, vec_U: G1PointVector, A: G1Point, T: G1Point, U: G1Point, proof: MultiExpProof) -> bool:
+           vec_T: G1PointVector, vec_U: G1PointVector, A: G1Point, T: G1Point, U: G1Point, proof: MultiExpProof,
+           ipa_state: ipa.IPAVerifierState = None) -> bool:
     """
     Verify that:
     - `A` is a commitment to vector `vec_a`
     - `T` is the result of an MSM between `vec_T` and `vec_a`
     - `U` is the result of an MSM between `vec_U` and `vec_a`
+
+    `vec_T` and `vec_U` can also be `ScaledBasis` vectors.
+
+    If `ipa_state` is given, the proof was created with the rounds of that inner product proof running along with ours
+    (see `multiexp_prove.prove()`). Its round challenges then get stored in `ipa_state`, and its equations can be
+    computed with `inner_product.get_final_equations()`.
     """
+    assert check_equations(get_verification_equations(transcript, crs_G, vec_T, vec_U, A, T, U, proof, ipa_state))
+
+    return True
+
+def get_verification_equations(transcript: Transcript, crs_G: G1PointVector,
+                               vec_T: G1PointVector, vec_U: G1PointVector, A: G1Point, T: G1Point, U: G1Point,
+                               proof: MultiExpProof, ipa_state: ipa.IPAVerifierState = None) -> list:
+    """
+    Return the three final equations of the argument (for `A`, `T` and `U`) as (points, scalars) pairs whose MSMs
+    should be the point at infinity. See `verify()` for `ipa_state`.
+    """
+    n = len(crs_G)
+    assert len(vec_T) == len(vec_U) == n
+    assert 2 ** len(proof.vec_C_L) == n
+    assert len(proof.vec_T_L) == len(proof.vec_T_R) == len(proof.vec_U_L) == len(proof.vec_U_R) == len(proof.vec_C_R) == len(proof.vec_C_L)
+
     # Step 1
     transcript.absorb_points([A, T, U, proof.R, proof.T_bl, proof.U_bl])
     x = transcript.get_challenge_scalar()
 
-    A = b.add(A, b.multiply(proof.R, x))
-    T = b.add(T, b.multiply(proof.T_bl, x))
-    U = b.add(U, b.multiply(proof.U_bl, x))
-
     # Step 2: log(n) rounds of recursion
-    for i in range(len(proof.vec_C_L)):
-        T_L, T_R = left_half(vec_T), right_half(vec_T)
-        U_L, U_R = left_half(vec_U), right_half(vec_U)
-        G_L, G_R = left_half(crs_G), right_half(crs_G)
+    vec_x = get_round_challenges(transcript, [proof.vec_T_L, proof.vec_U_L], [proof.vec_T_R, proof.vec_U_R],
+                                 proof.vec_C_L, proof.vec_C_R, ipa_state)
+    vec_x_inv = batch_inv(vec_x)
 
-        transcript.absorb_points([proof.vec_T_L[i], proof.vec_U_L[i], proof.vec_T_R[i],
-                                  proof.vec_U_R[i], proof.vec_C_L[i], proof.vec_C_R[i]])
-        x = transcript.get_challenge_scalar()
-        x_inv = inv(x)
+    # Step 3
+    # The folded `crs_G`, `vec_T` and `vec_U` are `<vec_s, crs_G>`, `<vec_s, vec_T>` and `<vec_s, vec_U>`, so we check
+    # each of the final equations as a single MSM
+    vec_s = get_folding_coefficients(vec_x, n)
+    vec_s_tip = [(MODULUS - proof.tip_a) * s % MODULUS for s in vec_s]
 
-        A = msm([proof.vec_C_L[i], A, proof.vec_C_R[i]], [x, 1, x_inv])
-        T = msm([proof.vec_T_L[i], T, proof.vec_T_R[i]], [x, 1, x_inv])
-        U = msm([proof.vec_U_L[i], U, proof.vec_U_R[i]], [x, 1, x_inv])
+    # Scaled columns are checked over their base points, with their factors folded into the coefficients
+    vec_T, vec_s_T = unscale(vec_T, vec_s_tip)
+    vec_U, vec_s_U = unscale(vec_U, vec_s_tip)
 
-        crs_G = [b.add(GL, b.multiply(GR, x)) for (GL, GR) in zip(G_L, G_R)]
-        vec_T = [b.add(TL, b.multiply(TR, x)) for (TL, TR) in zip(T_L, T_R)]
-        vec_U = [b.add(UL, b.multiply(UR, x)) for (UL, UR) in zip(U_L, U_R)]
+    check_A = ([A, proof.R] + proof.vec_C_L + proof.vec_C_R + crs_G, [1, x] + vec_x + vec_x_inv + vec_s_tip)
+    check_T = ([T, proof.T_bl] + proof.vec_T_L + proof.vec_T_R + vec_T, [1, x] + vec_x + vec_x_inv + vec_s_T)
+    check_U = ([U, proof.U_bl] + proof.vec_U_L + proof.vec_U_R + vec_U, [1, x] + vec_x + vec_x_inv + vec_s_U)
+    return [check_A, check_T, check_U]
 
-    # Step 3
-    assert len(crs_G) == len(vec_T) == len(vec_U) == 1
-    exp_A = b.multiply(crs_G[0], proof.tip_a)
-    exp_T = b.multiply(vec_T[0], proof.tip_a)
-    exp_U = b.multiply(vec_U[0], proof.tip_a)
-    assert b.eq(A, exp_A) and b.eq(T, exp_T) and b.eq(U, exp_U)
+def get_round_challenges(transcript: Transcript, vecs_L: list, vecs_R: list,
+                         vec_C_L: G1PointVector, vec_C_R: G1PointVector, ipa_state: ipa.IPAVerifierState = None) -> list:
+    # Helper: Replays the transcript of the recursion rounds (with the cross terms of every column in `vecs_L` and
+    # `vecs_R`), and returns the challenge of every round. Instead of folding the points every round, the verifier
+    # checks the final equations with the folding coefficients of these challenges.
+    # If `ipa_state` is given, its cross terms come first in every round, and it gets the inverses of our challenges.
+    if ipa_state is not None:
+        assert len(ipa_state.proof.vec_B_L) == len(vec_C_L)
+    vec_x = []
+    for i in range(len(vec_C_L)):
+        ipa_points = ipa.get_round_points(ipa_state.proof, i) if ipa_state is not None else []
+        transcript.absorb_points(ipa_points + [vec_L[i] for vec_L in vecs_L] + [vec_R[i] for vec_R in vecs_R] +
+                                 [vec_C_L[i], vec_C_R[i]])
+        vec_x.append(transcript.get_challenge_scalar())
+    if ipa_state is not None:
+        ipa_state.vec_x = batch_inv(vec_x)
+    return vec_x
+
+def get_column_weights(rho: FieldElement, k: int) -> list:
+    """Return the weights `1, rho, ..., rho^(k-1)` used to merge `k` columns into one"""
+    vec_rho = [1]
+    for _ in range(k - 1):
+        vec_rho.append(vec_rho[-1] * rho % MODULUS)
+    return vec_rho
+
+
+@dataclass
+class MultiExpColumnsProof():
+    R: G1Point
+    T_bl: G1Point
+    vec_T_L: G1PointVector
+    vec_T_R: G1PointVector
+    vec_C_L: G1PointVector
+    vec_C_R: G1PointVector
+    tip_a: FieldElement
+
+def verify_columns(transcript: Transcript, crs_G: G1PointVector, columns: list, A: G1Point, vec_T: G1PointVector,
+                   proof: MultiExpColumnsProof, ipa_state: ipa.IPAVerifierState = None) -> bool:
+    """
+    Verify that `A` is a commitment to a vector `vec_a`, and that every `vec_T[j]` is the result of an MSM between the
+    points of `columns[j]` and `vec_a`. See `verify()` for `ipa_state`.
+    """
+    assert check_equations(get_columns_verification_equations(transcript, crs_G, columns, A, vec_T, proof, ipa_state))
 
     return True
 
+def get_columns_verification_equations(transcript: Transcript, crs_G: G1PointVector, columns: list, A: G1Point,
+                                       vec_T: G1PointVector, proof: MultiExpColumnsProof,
+                                       ipa_state: ipa.IPAVerifierState = None) -> list:
+    """
+    Return the two final equations of the argument (for `A` and for the merged columns) as (points, scalars) pairs
+    whose MSMs should be the point at infinity.
+    """
+    n = len(crs_G)
+    assert len(columns) == len(vec_T)
+    assert all(len(column) == n for column in columns)
+    assert 2 ** len(proof.vec_C_L) == n
+    assert len(proof.vec_T_L) == len(proof.vec_T_R) == len(proof.vec_C_R) == len(proof.vec_C_L)
+
+    # Step 0: merge the columns
+    transcript.absorb_points([A] + vec_T)
+    rho = transcript.get_challenge_scalar()
+    vec_rho = get_column_weights(rho, len(columns))
+    T = msm(vec_T, vec_rho)
+
+    # Step 1
+    transcript.absorb_points([A, T, proof.R, proof.T_bl])
+    x = transcript.get_challenge_scalar()
+
+    # Step 2: log(n) rounds of recursion
+    vec_x = get_round_challenges(transcript, [proof.vec_T_L], [proof.vec_T_R], proof.vec_C_L, proof.vec_C_R, ipa_state)
+    vec_x_inv = batch_inv(vec_x)
+
+    # Step 3
+    # The merged column is never computed: its folded point is `<vec_s, column>` summed over the columns, weighted by
+    # their `rho^j`
+    vec_s = get_folding_coefficients(vec_x, n)
+    vec_s_tip = [(MODULUS - proof.tip_a) * s % MODULUS for s in vec_s]
+
+    check_A = ([A, proof.R] + proof.vec_C_L + proof.vec_C_R + crs_G, [1, x] + vec_x + vec_x_inv + vec_s_tip)
+    check_T = (vec_T + [proof.T_bl] + proof.vec_T_L + proof.vec_T_R + [pt for column in columns for pt in column],
+               vec_rho + [x] + vec_x + vec_x_inv + [weight * s % MODULUS for weight in vec_rho for s in vec_s_tip])
+    return [check_A, check_T]
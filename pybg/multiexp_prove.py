@@ -2,39 +2,102 @@
 Multi-exponentiation argument prover
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 
 import random
+from dataclasses import dataclass
 
 import multiexp
+import inner_product_prove as ipa_prove
 from bg_types import G1Point, G1PointVector, FieldElementVector
 from transcript import Transcript
-from util import msm, is_power_of_two, inv, left_half, right_half
+from util import msm, msm_multi, fold, fold_all, is_power_of_two, inv, left_half, right_half
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+@dataclass
+class MultiExpBlinders:
+    """The blinders of a multi-exponentiation proof, and their commitment `R` to the CRS"""
+    vec_r: FieldElementVector
+    R: G1Point
+
+def precompute(crs_G: G1PointVector) -> MultiExpBlinders:
+    """Draw the blinders of a proof ahead of time. They must only be used for a single proof."""
+    vec_r = [random.randint(0, MODULUS) for i in range(len(crs_G))]
+    return MultiExpBlinders(vec_r, msm(crs_G, vec_r))
 
 def prove(transcript: Transcript, crs_G: G1PointVector,
           vec_T: G1PointVector, vec_U: G1PointVector, A: G1Point, T: G1Point, U: G1Point,
-          vec_a: FieldElementVector) -> multiexp.MultiExpProof:
+          vec_a: FieldElementVector, blinders: MultiExpBlinders = None,
+          ipa_state: ipa_prove.IPAProverState = None) -> multiexp.MultiExpProof:
     """
     Prove that there exists `vec_a` such that:
     - `A` is a commitment to `vec_a`
     - `T` is the result of an MSM between `vec_T` and `vec_a`
     - `U` is the result of an MSM between `vec_U` and `vec_a`
+
+    `blinders` can come from `precompute()`.
+
+    If `ipa_state` is given, the rounds of that inner product proof run along with ours (see `prove_rounds()`).
+    """
+    R, (T_bl, U_bl), (vec_T_L, vec_U_L), (vec_T_R, vec_U_R), vec_C_L, vec_C_R, tip_a = \
+        prove_rounds(transcript, crs_G, [vec_T, vec_U], A, [T, U], vec_a, blinders, ipa_state)
+    return multiexp.MultiExpProof(R, T_bl, U_bl, vec_T_L, vec_T_R, vec_U_L, vec_U_R, vec_C_L, vec_C_R, tip_a)
+
+def prove_columns(transcript: Transcript, crs_G: G1PointVector, columns: list, A: G1Point, vec_T: G1PointVector,
+                  vec_a: FieldElementVector, blinders: MultiExpBlinders = None,
+                  ipa_state: ipa_prove.IPAProverState = None) -> multiexp.MultiExpColumnsProof:
     """
+    Prove that there exists `vec_a` such that `A` is a commitment to `vec_a`, and every `vec_T[j]` is the result of an
+    MSM between the points of `columns[j]` and `vec_a`.
+
+    The columns are merged with the powers of a challenge `rho`, and the argument runs over the merged column: the proof
+    has the same size for any number of columns.
+
+    See `prove()` for `ipa_state`.
+    """
+    assert len(columns) == len(vec_T)
+
+    transcript.absorb_points([A] + vec_T)
+    rho = transcript.get_challenge_scalar()
+    vec_rho = multiexp.get_column_weights(rho, len(columns))
+
+    # Merge the columns with `fold()`, which computes `L + rho^j * R` in batches
+    merged_column = columns[0]
+    for column, weight in zip(columns[1:], vec_rho[1:]):
+        merged_column = fold(merged_column, column, weight)
+    T = msm(vec_T, vec_rho)
+
+    R, (T_bl,), (vec_T_L,), (vec_T_R,), vec_C_L, vec_C_R, tip_a = \
+        prove_rounds(transcript, crs_G, [merged_column], A, [T], vec_a, blinders, ipa_state)
+    return multiexp.MultiExpColumnsProof(R, T_bl, vec_T_L, vec_T_R, vec_C_L, vec_C_R, tip_a)
+
+def prove_rounds(transcript: Transcript, crs_G: G1PointVector, columns: list, A: G1Point, vec_T: G1PointVector,
+                 vec_a: FieldElementVector, blinders: MultiExpBlinders = None,
+                 ipa_state: ipa_prove.IPAProverState = None):
+    # Helper: Runs the argument over any number of columns, where `vec_T[j]` is the MSM between `columns[j]` and
+    # `vec_a`. Returns the blinder commitment `R`, the blinded MSM of each column, the left and right cross terms of each
+    # column, the left and right commitments of each round, and the folded `vec_a`.
+    #
+    # If `ipa_state` is given, it is an inner product proof over the same `crs_G` whose recursion has not started yet.
+    # Its rounds then run along with ours: the cross terms of both go into the transcript before each challenge `x`, and
+    # the inner product proof gets `x^-1` as its challenge, which makes it fold `crs_G` with `x` like we do. That way
+    # `crs_G` is only folded once per round.
     n = len(crs_G)
-    assert len(crs_G) == len(vec_T) == len(vec_U) == len(vec_a)
-    assert is_power_of_two(len(vec_a))
+    assert len(vec_a) == n and all(len(column) == n for column in columns)
+    assert is_power_of_two(n)
+    assert ipa_state is None or len(ipa_state.crs_vec_G) == n
 
-    vec_T_L, vec_T_R, vec_U_L, vec_U_R, vec_C_L, vec_C_R = [], [], [], [], [], []
+    vecs_L, vecs_R = [[] for _ in columns], [[] for _ in columns]
+    vec_C_L, vec_C_R = [], []
 
     # Step 1
-    vec_r = [random.randint(0, MODULUS) for i in range(n)]
-    R = msm(crs_G, vec_r)
-    T_bl = msm(vec_T, vec_r)
-    U_bl = msm(vec_U, vec_r)
+    blinders = blinders or precompute(crs_G)
+    vec_r, R = blinders.vec_r, blinders.R
+    assert len(vec_r) == n
+    vec_bl = msm_multi(columns, vec_r)
 
-    transcript.absorb_points([A, T, U, R, T_bl, U_bl])
+    transcript.absorb_points([A] + vec_T + [R] + vec_bl)
     x = transcript.get_challenge_scalar()
 
     # Rewrite the vectors b and c
@@ -43,36 +106,32 @@ def prove(transcript: Transcript, crs_G: G1PointVector,
     # Step 2: log(n) rounds of recursion
     while len(vec_a) > 1:
         a_L, a_R = left_half(vec_a), right_half(vec_a)
-        T_L, T_R = left_half(vec_T), right_half(vec_T)
-        U_L, U_R = left_half(vec_U), right_half(vec_U)
         G_L, G_R = left_half(crs_G), right_half(crs_G)
 
-        Z_L_T = msm(T_R, a_L)
-        Z_L_U = msm(U_R, a_L)
-        Z_R_T = msm(T_L, a_R)
-        Z_R_U = msm(U_L, a_R)
-
-        C_L = msm(G_R, a_L)
-        C_R = msm(G_L, a_R)
+        # The cross terms of all the columns and of the CRS share their scalars: `a_L` on the right halves and `a_R` on
+        # the left halves
+        *vec_Z_L, C_L = msm_multi([right_half(column) for column in columns] + [G_R], a_L)
+        *vec_Z_R, C_R = msm_multi([left_half(column) for column in columns] + [G_L], a_R)
 
         # Append to proof
-        vec_T_L.append(Z_L_T)
-        vec_T_R.append(Z_R_T)
-        vec_U_L.append(Z_L_U)
-        vec_U_R.append(Z_R_U)
+        for proof_L, proof_R, Z_L, Z_R in zip(vecs_L, vecs_R, vec_Z_L, vec_Z_R):
+            proof_L.append(Z_L)
+            proof_R.append(Z_R)
         vec_C_L.append(C_L)
         vec_C_R.append(C_R)
 
-        transcript.absorb_points([Z_L_T, Z_L_U, Z_R_T, Z_R_U, C_L, C_R])
+        ipa_points = ipa_prove.prove_round(ipa_state) if ipa_state is not None else []
+        transcript.absorb_points(ipa_points + vec_Z_L + vec_Z_R + [C_L, C_R])
         x = transcript.get_challenge_scalar()
         x_inv = inv(x)
 
         # Generate half-size polynomial and points for the next round
         vec_a = [(aL + aR * x_inv) % MODULUS for (aL, aR) in zip(a_L, a_R)]
-        vec_T = [b.add(TL, b.multiply(TR, x)) for (TL, TR) in zip(T_L, T_R)]
-        vec_U = [b.add(UL, b.multiply(UR, x)) for (UL, UR) in zip(U_L, U_R)]
-        crs_G = [b.add(GL, b.multiply(GR, x)) for (GL, GR) in zip(G_L, G_R)]
+        *columns, crs_G = fold_all([left_half(column) for column in columns] + [G_L],
+                                   [right_half(column) for column in columns] + [G_R], x)
+        if ipa_state is not None:
+            ipa_prove.fold_round(ipa_state, x_inv, crs_G)
 
     # Step 3
     assert len(vec_a) == 1
-    return multiexp.MultiExpProof(R, T_bl, U_bl, vec_T_L, vec_T_R, vec_U_L, vec_U_R, vec_C_L, vec_C_R, vec_a[0])
+    return R, vec_bl, vecs_L, vecs_R, vec_C_L, vec_C_R, vec_a[0]
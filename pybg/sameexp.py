@@ -2,14 +2,14 @@
 Same-exponentiation argument verifier
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 from dataclasses import dataclass
 
-from bg_types import G1Point, FieldElement
+from bg_types import G1Point, FieldElement, G1PointVector, FieldElementVector
 from transcript import Transcript
-from util import msm
+from util import check_equations
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
 @dataclass
 class SameExponentProof():
@@ -26,14 +26,107 @@ def verify(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
     - `T = r * R + r_t * G_t`
     - `U = r * S + r_u * G_u`
     """
+    assert check_equations(get_verification_equations(transcript, crs_G_t, crs_G_u, R, S, T, U, proof))
+
+    return True
+
+def get_verification_equations(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
+                               R: G1Point, S: G1Point, T: G1Point, U: G1Point, proof: SameExponentProof) -> list:
+    """
+    Return the two equations of the argument as (points, scalars) pairs whose MSMs should be the point at infinity.
+    """
     # Step 1
     transcript.absorb_points([R, S, T, U])
-    transcript.absorb_scalars([proof.B_t, proof.B_u])
+    if transcript.legacy:
+        # The legacy transcript absorbed the commitments through `absorb_scalars()`, as their string representation
+        transcript.absorb_scalars([proof.B_t, proof.B_u])
+    else:
+        transcript.absorb_points([proof.B_t, proof.B_u])
     x = transcript.get_challenge_scalar()
 
     # Step 2
-    expected_1 = msm([proof.B_t, T, R, crs_G_t], [1, x, MODULUS - proof.z_r, MODULUS - proof.z_t])
-    expected_2 = msm([proof.B_u, U, S, crs_G_u], [1, x, MODULUS - proof.z_r, MODULUS - proof.z_u])
-    assert b.eq(expected_1, b.Z1) and b.eq(expected_2, b.Z1)
+    expected_1 = ([proof.B_t, T, R, crs_G_t], [1, x, MODULUS - proof.z_r, MODULUS - proof.z_t])
+    expected_2 = ([proof.B_u, U, S, crs_G_u], [1, x, MODULUS - proof.z_r, MODULUS - proof.z_u])
+    return [expected_1, expected_2]
+
+
+@dataclass
+class SameExponentColumnsProof():
+    vec_B: G1PointVector
+    z_r: FieldElement
+    vec_z: FieldElementVector
+
+def verify_columns(transcript: Transcript, vec_G_blind: G1PointVector,
+                   vec_R: G1PointVector, vec_T: G1PointVector, proof: SameExponentColumnsProof) -> bool:
+    """
+    Verify proof that there exist `r` and `r_1, ..., r_k` such that `T_j = r * R_j + r_j * G_j` for every column `j`,
+    where `G_j` is the blinding base `vec_G_blind[j]`. This is the same argument for any number of columns.
+    """
+    assert check_equations(get_columns_verification_equations(transcript, vec_G_blind, vec_R, vec_T, proof))
 
     return True
+
+def get_columns_verification_equations(transcript: Transcript, vec_G_blind: G1PointVector,
+                                       vec_R: G1PointVector, vec_T: G1PointVector,
+                                       proof: SameExponentColumnsProof) -> list:
+    """
+    Return the equation of every column as (points, scalars) pairs whose MSMs should be the point at infinity.
+    """
+    k = len(vec_R)
+    assert len(vec_T) == len(proof.vec_B) == len(proof.vec_z) == k
+    assert len(vec_G_blind) >= k
+
+    # Step 1
+    transcript.absorb_points(vec_R + vec_T + proof.vec_B)
+    x = transcript.get_challenge_scalar()
+
+    # Step 2
+    return [([B, T, R, G], [1, x, MODULUS - proof.z_r, MODULUS - z])
+            for B, T, R, G, z in zip(proof.vec_B, vec_T, vec_R, vec_G_blind, proof.vec_z)]
+
+
+@dataclass
+class SameExponentBatchProof():
+    vec_B_t: G1PointVector
+    vec_B_u: G1PointVector
+    vec_z_r: FieldElementVector
+    vec_z_t: FieldElementVector
+    vec_z_u: FieldElementVector
+
+def verify_batch(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
+                 vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
+                 proof: SameExponentBatchProof) -> bool:
+    """
+    Verify proof that for every `i` there exist `r_i`, `r_t_i` and `r_u_i` s.t.:
+    - `T_i = r_i * R_i + r_t_i * G_t`
+    - `U_i = r_i * S_i + r_u_i * G_u`
+
+    This is `verify()` for many independent statements, with a single challenge.
+    """
+    assert check_equations(get_batch_verification_equations(transcript, crs_G_t, crs_G_u, vec_R, vec_S, vec_T, vec_U,
+                                                            proof))
+
+    return True
+
+def get_batch_verification_equations(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
+                                     vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector,
+                                     vec_U: G1PointVector, proof: SameExponentBatchProof) -> list:
+    """
+    Return the two equations of every statement as (points, scalars) pairs whose MSMs should be the point at infinity.
+    """
+    m = len(vec_R)
+    assert len(vec_S) == len(vec_T) == len(vec_U) == m
+    assert len(proof.vec_B_t) == len(proof.vec_B_u) == m
+    assert len(proof.vec_z_r) == len(proof.vec_z_t) == len(proof.vec_z_u) == m
+
+    # Step 1
+    transcript.absorb_points(vec_R + vec_S + vec_T + vec_U + proof.vec_B_t + proof.vec_B_u)
+    x = transcript.get_challenge_scalar()
+
+    # Step 2
+    equations = []
+    for R, S, T, U, B_t, B_u, z_r, z_t, z_u in zip(vec_R, vec_S, vec_T, vec_U, proof.vec_B_t, proof.vec_B_u,
+                                                 proof.vec_z_r, proof.vec_z_t, proof.vec_z_u):
+        equations.append(([B_t, T, R, crs_G_t], [1, x, MODULUS - z_r, MODULUS - z_t]))
+        equations.append(([B_u, U, S, crs_G_u], [1, x, MODULUS - z_r, MODULUS - z_u]))
+    return equations
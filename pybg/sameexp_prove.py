@@ -3,34 +3,57 @@ Same-exponentiation argument prover
 """
 
 import random
+from dataclasses import dataclass
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 
 import sameexp
-from bg_types import G1Point, FieldElement
+from bg_types import G1Point, FieldElement, G1PointVector, FieldElementVector
 from transcript import Transcript
-from util import msm
+from util import msm, multiply
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+@dataclass
+class SameExponentBlinders:
+    """The blinders of a same-exponent proof, and their parts of the commitments that only depend on the CRS"""
+    bl_r: FieldElement
+    vec_bl: FieldElementVector # one blinder per column: `bl_t` and `bl_u` for two columns
+    vec_G_bl: G1PointVector # the blinders times the blinding base of their column
+
+def precompute(vec_G_blind: G1PointVector) -> SameExponentBlinders:
+    """
+    Draw the blinders of a proof ahead of time, for columns with the blinding bases `vec_G_blind` (`[G_t, G_u]`). They
+    must only be used for a single proof.
+    """
+    bl_r = random.randint(0, MODULUS)
+    vec_bl = [random.randint(0, MODULUS) for _ in vec_G_blind]
+    return SameExponentBlinders(bl_r, vec_bl, [multiply(G, bl) for G, bl in zip(vec_G_blind, vec_bl)])
 
 def prove(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
           R: G1Point, S: G1Point, T: G1Point, U: G1Point,
-          r: FieldElement, r_t: FieldElement, r_u: FieldElement) -> sameexp.SameExponentProof:
+          r: FieldElement, r_t: FieldElement, r_u: FieldElement,
+          blinders: SameExponentBlinders = None) -> sameexp.SameExponentProof:
     """
     Prove that there exist `r`, `r_t` and `r_u` such that:
     - `T = r * R + r_t * G_t`
     - `U = r * S + r_u * G_u`
+
+    `blinders` can come from `precompute()`.
     """
     # Step 1
-    bl_r = random.randint(0, MODULUS)
-    bl_t = random.randint(0, MODULUS)
-    bl_u = random.randint(0, MODULUS)
+    blinders = blinders or precompute([crs_G_t, crs_G_u])
+    bl_r, (bl_t, bl_u), (G_t_bl, G_u_bl) = blinders.bl_r, blinders.vec_bl, blinders.vec_G_bl
 
-    B_t = msm([R, crs_G_t], [bl_r, bl_t])
-    B_u = msm([S, crs_G_u], [bl_r, bl_u])
+    B_t = msm([R, G_t_bl], [bl_r, 1])
+    B_u = msm([S, G_u_bl], [bl_r, 1])
 
     transcript.absorb_points([R, S, T, U])
-    transcript.absorb_scalars([B_t, B_u])
+    if transcript.legacy:
+        # See `sameexp.get_verification_equations()`
+        transcript.absorb_scalars([B_t, B_u])
+    else:
+        transcript.absorb_points([B_t, B_u])
     x = transcript.get_challenge_scalar()
 
     # Step 2
@@ -39,3 +62,60 @@ def prove(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
     z_u = (bl_u + r_u * x) % MODULUS
 
     return sameexp.SameExponentProof(B_t, B_u, z_r, z_t, z_u)
+
+def prove_columns(transcript: Transcript, vec_G_blind: G1PointVector, vec_R: G1PointVector, vec_T: G1PointVector,
+                  r: FieldElement, vec_r_blind: FieldElementVector,
+                  blinders: SameExponentBlinders = None) -> sameexp.SameExponentColumnsProof:
+    """
+    Prove that there exist `r` and `r_1, ..., r_k` (the `vec_r_blind`) such that `T_j = r * R_j + r_j * G_j` for every
+    column `j`, where `G_j` is the blinding base `vec_G_blind[j]`.
+
+    `blinders` can come from `precompute()`.
+    """
+    k = len(vec_R)
+    assert len(vec_T) == len(vec_r_blind) == k
+
+    # Step 1
+    blinders = blinders or precompute(vec_G_blind[:k])
+    bl_r, vec_bl = blinders.bl_r, blinders.vec_bl
+    assert len(vec_bl) == k
+    vec_B = [msm([R, G_bl], [bl_r, 1]) for R, G_bl in zip(vec_R, blinders.vec_G_bl)]
+
+    transcript.absorb_points(vec_R + vec_T + vec_B)
+    x = transcript.get_challenge_scalar()
+
+    # Step 2
+    z_r = (bl_r + r * x) % MODULUS
+    vec_z = [(bl + r_j * x) % MODULUS for bl, r_j in zip(vec_bl, vec_r_blind)]
+
+    return sameexp.SameExponentColumnsProof(vec_B, z_r, vec_z)
+
+def prove_batch(transcript: Transcript, crs_G_t: G1Point, crs_G_u: G1Point,
+                vec_R: G1PointVector, vec_S: G1PointVector, vec_T: G1PointVector, vec_U: G1PointVector,
+                vec_r: FieldElementVector, vec_r_t: FieldElementVector, vec_r_u: FieldElementVector,
+                blinders: list = None) -> sameexp.SameExponentBatchProof:
+    """
+    Prove that for every `i` there exist `r_i`, `r_t_i` and `r_u_i` such that:
+    - `T_i = r_i * R_i + r_t_i * G_t`
+    - `U_i = r_i * S_i + r_u_i * G_u`
+
+    `blinders` holds the blinders of every statement (see `precompute()`).
+    """
+    m = len(vec_R)
+    assert len(vec_S) == len(vec_T) == len(vec_U) == len(vec_r) == len(vec_r_t) == len(vec_r_u) == m
+
+    # Step 1
+    blinders = blinders or [precompute([crs_G_t, crs_G_u]) for _ in range(m)]
+    assert len(blinders) == m
+    vec_B_t = [msm([R, b.vec_G_bl[0]], [b.bl_r, 1]) for R, b in zip(vec_R, blinders)]
+    vec_B_u = [msm([S, b.vec_G_bl[1]], [b.bl_r, 1]) for S, b in zip(vec_S, blinders)]
+
+    transcript.absorb_points(vec_R + vec_S + vec_T + vec_U + vec_B_t + vec_B_u)
+    x = transcript.get_challenge_scalar()
+
+    # Step 2
+    vec_z_r = [(b.bl_r + r * x) % MODULUS for b, r in zip(blinders, vec_r)]
+    vec_z_t = [(b.vec_bl[0] + r_t * x) % MODULUS for b, r_t in zip(blinders, vec_r_t)]
+    vec_z_u = [(b.vec_bl[1] + r_u * x) % MODULUS for b, r_u in zip(blinders, vec_r_u)]
+
+    return sameexp.SameExponentBatchProof(vec_B_t, vec_B_u, vec_z_r, vec_z_t, vec_z_u)
@@ -5,30 +5,65 @@ End-to-end tests for all the zero-knowledge arguments involved.
 import unittest, time
 import random
 import math
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+import os, sys, subprocess, tempfile
 
 from py_ecc import optimized_bls12_381 as b
+from py_ecc.optimized_bls12_381 import constants
+from py_ecc.bls.point_compression import compress_G1
+from py_ecc.bls.hash_to_curve import hash_to_G1
 
-import gprod, sameexp, multiexp, bayer_groth, inner_product as ipa
+import curve, g1, crs_store
+import gprod, sameexp, multiexp, bayer_groth, inner_product as ipa, encoding, validation
 import gprod_prove, sameexp_prove, multiexp_prove, bayer_groth_prove, inner_product_prove as ipa_prove
+import util
 from transcript import Transcript
-from util import get_inner_product, apply_permutation, msm
+from bg_types import G1PointVector
+from util import get_inner_product, apply_permutation, msm, naive_msm, multiply, FixedBasePoint, batch_normalize, compress_points, \
+    batch_inv, inv, glv_decompose, glv_multiply, wnaf, ScaledBasis
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+BLS12_381_COFACTOR = 76329603384216526031706109802092473003
 
 def gen_generator_points(count):
     """
     Create `count` generator points for BLS12-381
     """
-    BLS12_381_COFACTOR = 76329603384216526031706109802092473003
+    p = curve.field_modulus
     points = []
-    x = b.FQ(1)
+    x = 1
     while len(points) < count:
-        y = (x ** 3 + b.b) ** ((b.field_modulus + 1) // 4)
-        if b.is_on_curve((x, y, b.FQ(1)), b.b):
-            points.append(b.multiply((x, y, b.FQ(1)), BLS12_381_COFACTOR))
-        x += b.FQ(1)
+        pt = curve.from_affine(x, pow(x ** 3 + curve.b, (p + 1) // 4, p))
+        if curve.is_on_curve(pt):
+            points.append(curve.multiply(pt, BLS12_381_COFACTOR))
+        x += 1
     return points
 
+def gen_small_order_point(prime):
+    """Create a point of order `prime`, which must be a prime factor of the cofactor of G1"""
+    # Multiply points of the curve by their group order without the factors `prime`, until one has an order `prime^k`
+    order = MODULUS * BLS12_381_COFACTOR
+    while order % prime == 0:
+        order //= prime
+    p = curve.field_modulus
+    x = 1
+    while True:
+        pt = curve.from_affine(x, pow(x ** 3 + curve.b, (p + 1) // 4, p))
+        x += 1
+        if curve.is_on_curve(pt) and not curve.is_inf(curve.multiply(pt, order)):
+            break
+    pt = curve.multiply(pt, order)
+    while not curve.is_inf(curve.multiply(pt, prime)):
+        pt = curve.multiply(pt, prime)
+    return pt
+
+def to_py_ecc(pt):
+    """Convert a point of the current curve backend to a py_ecc point"""
+    return tuple(b.FQ(c) for c in curve.coordinates(pt))
+
 def get_random_permutation(n):
     """Return a random permutation with `n` elements"""
     p = list(range(n))
@@ -47,6 +82,176 @@ N_BLINDERS = 4
 # Number of actual useful non-blinder elements involved in the shuffle proof
 ELL = N - N_BLINDERS
 
+def make_shuffle(n, ell=None):
+    """
+    Return a CRS of `n` points and a random shuffle of `ell` elements (all the non-blinder elements by default), as a
+    `(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)` tuple.
+    """
+    ell = n - N_BLINDERS if ell is None else ell
+    generators = gen_generator_points(n + 3 + 2*ell)
+    crs = bayer_groth.ShuffleCRS(generators[:n], generators[n], generators[n+1], generators[n+2])
+    vec_R = generators[n+3:n+3+ell]
+    vec_S = generators[n+3+ell:]
+
+    permutation = get_random_permutation(ell)
+    r = random.randint(0, MODULUS)
+    vec_T, vec_U = bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+    return crs, vec_R, vec_S, vec_T, vec_U, permutation, r
+
+class TestMSM(unittest.TestCase):
+    def test_msm(self):
+        generators = gen_generator_points(N)
+
+        # Compare the Pippenger MSM against the naive one, over sizes that hit both code paths
+        for n in [0, 1, 2, 5, 17, N]:
+            scalars = [random.randint(0, MODULUS) for _ in range(n)]
+            assert curve.eq(msm(generators[:n], scalars), naive_msm(generators[:n], scalars))
+
+        # Zero and out-of-range scalars
+        scalars = [0, MODULUS, MODULUS + 1, 2 * MODULUS - 1] + [0] * 4
+        assert curve.eq(msm(generators[:8], scalars), naive_msm(generators[:8], scalars))
+        print("msm: checked against naive msm: {:.3f}s".format(get_time_delta()))
+
+    def test_fixed_base_msm(self):
+        generators = gen_generator_points(N)
+        scalars = [random.randint(0, MODULUS) for _ in range(N)]
+
+        # Fixed-base MSMs with different windows, also mixed with regular points
+        for window in [3, 8]:
+            fixed_generators = [FixedBasePoint(G, window) for G in generators[:N//2]]
+            assert curve.eq(msm(fixed_generators, scalars[:N//2]), naive_msm(generators[:N//2], scalars[:N//2]))
+            assert curve.eq(msm(fixed_generators + generators[N//2:], scalars), naive_msm(generators, scalars))
+            assert curve.eq(multiply(fixed_generators[0], scalars[0]), curve.multiply(generators[0], scalars[0]))
+        print("msm: checked fixed-base msm: {:.3f}s".format(get_time_delta()))
+
+    def test_glv(self):
+        G = gen_generator_points(1)[0]
+        lam = curve.glv_lambda
+        assert curve.eq(curve.endomorphism(G), curve.multiply(G, lam))
+
+        scalars = [0, 1, lam - 1, lam, lam + 1, MODULUS - 1, MODULUS] + [random.randint(0, MODULUS) for _ in range(8)]
+        for value in scalars:
+            k1, k2 = glv_decompose(value)
+            assert (k1 + k2 * lam - value) % MODULUS == 0
+            assert max(k1, k2).bit_length() <= util.GLV_BITS
+            for k in [k1, k2]:
+                digits = wnaf(k, util.WNAF_WINDOW)
+                assert sum(digit << i for i, digit in enumerate(digits)) == k
+                assert all(digit % 2 == 1 and abs(digit) < 2 ** (util.WNAF_WINDOW - 1) for digit in digits if digit)
+            assert curve.eq(glv_multiply(G, value), curve.multiply(G, value % MODULUS))
+        print("msm: checked glv multiplication: {:.3f}s".format(get_time_delta()))
+
+    def test_fold(self):
+        generators = gen_generator_points(2 * util.BATCH_FOLD_THRESHOLD)
+        G = generators[0]
+        # Hit the special cases of the affine formulas: the point at infinity, doubling and opposite points
+        left = [curve.Z1, G, curve.neg(G), G, curve.Z1] + generators[5:]
+        right = [G, curve.Z1, G, G, curve.Z1] + generators[5:]
+        for n in [1, util.BATCH_FOLD_THRESHOLD - 1, len(left)]:
+            for x in [0, 1, random.randint(0, MODULUS)]:
+                folded = util.fold(left[:n], right[:n], x)
+                expected = [curve.add(L, curve.multiply(R, x)) for L, R in zip(left[:n], right[:n])]
+                assert all(curve.eq(pt, expected_pt) for pt, expected_pt in zip(folded, expected))
+
+        affine = batch_normalize(left)
+        assert util.batch_double(affine) == util.batch_add(affine, affine) == batch_normalize([curve.double(pt) for pt in left])
+        print("msm: checked folding: {:.3f}s".format(get_time_delta()))
+
+    def test_scaled_basis(self):
+        n = 2 * util.BATCH_FOLD_THRESHOLD
+        generators = gen_generator_points(n)
+        factors = [random.randint(1, MODULUS - 1) for _ in range(n)]
+        basis = ScaledBasis(generators, factors)
+        points = [curve.multiply(G, f) for G, f in zip(generators, factors)]
+        assert curve.eq(basis[3], points[3])
+
+        scalars = [random.randint(0, MODULUS) for _ in range(n)]
+        assert curve.eq(msm(basis, scalars), msm(points, scalars))
+        assert curve.eq(util.msm_batch([(basis[:5], scalars[:5])])[0], msm(points[:5], scalars[:5]))
+
+        # Folding keeps the basis scaled, down to a single point
+        x = random.randint(0, MODULUS)
+        while len(basis) > 1:
+            basis = util.fold(util.left_half(basis), util.right_half(basis), x)
+            points = util.fold(util.left_half(points), util.right_half(points), x)
+            assert isinstance(basis, ScaledBasis)
+            assert all(curve.eq(basis[i], points[i]) for i in range(len(points)))
+        print("msm: checked scaled basis: {:.3f}s".format(get_time_delta()))
+
+    def test_shared_scalars(self):
+        generators = gen_generator_points(N)
+        scalars = [random.randint(0, MODULUS) for _ in range(N)]
+        bases_list = [generators, generators[::-1], [curve.neg(G) for G in generators],
+                      [FixedBasePoint(G, 4) for G in generators], ScaledBasis(generators, scalars)]
+        for n in [0, 2, 5, N]:
+            results = util.msm_multi([bases[:n] for bases in bases_list], scalars[:n])
+            assert all(curve.eq(result, msm(bases[:n], scalars[:n])) for result, bases in zip(results, bases_list))
+
+        # Folding several vectors at once, with a scaled one
+        x = random.randint(0, MODULUS)
+        lefts, rights = [generators[:N//2], generators[N//2:]], [generators[N//2:], generators[:N//2]]
+        for folded, left, right in zip(util.fold_all(lefts, rights, x), lefts, rights):
+            assert folded == util.fold(left, right, x)
+        folded = util.fold_all(lefts + [bases_list[-1][:N//2]], rights + [bases_list[-1][N//2:]], x)
+        assert all(curve.eq(pt, expected) for pt, expected in zip(folded[0], util.fold(lefts[0], rights[0], x)))
+        print("msm: checked msm and fold with shared scalars: {:.3f}s".format(get_time_delta()))
+
+class TestCurveBackends(unittest.TestCase):
+    def test_int_backend(self):
+        """Check the integer backend against py_ecc, which is the reference backend"""
+        def same(pt, reference):
+            return g1.normalize(pt) == tuple(c.n for c in b.normalize(reference)) and g1.is_inf(pt) == b.is_inf(reference)
+
+        scalars = [random.randint(0, MODULUS) for _ in range(4)]
+        points = [g1.multiply(g1.G1, x) for x in scalars] + [g1.Z1, g1.neg(g1.G1)]
+        references = [b.multiply(b.G1, x) for x in scalars] + [b.Z1, b.neg(b.G1)]
+        for pt, reference in zip(points, references):
+            assert same(pt, reference)
+            assert g1.is_on_curve(pt)
+            assert same(g1.double(pt), b.double(reference))
+            assert same(g1.multiply(pt, 7), b.multiply(reference, 7))
+            # The addition formulas are complete: this covers doubling and adding the point at infinity or the negation
+            for pt2, reference2 in zip(points + [pt, g1.neg(pt)], references + [reference, b.neg(reference)]):
+                assert same(g1.add(pt, pt2), b.add(reference, reference2))
+                assert g1.eq(pt, pt2) == b.eq(reference, reference2)
+
+    def test_backends_msm(self):
+        """The MSMs and point encodings of both backends agree"""
+        generators = gen_generator_points(17)
+        scalars = [random.randint(0, MODULUS) for _ in range(17)]
+        coordinates = [curve.normalize(pt) for pt in generators]
+
+        results, previous_backend = {}, curve.backend
+        try:
+            for backend in curve.BACKENDS:
+                curve.set_backend(backend)
+                points = [curve.from_affine(x, y) for x, y in coordinates]
+                result = msm(points, scalars)
+                results[backend] = (curve.normalize(result), compress_points(points + [result, curve.Z1]))
+        finally:
+            curve.set_backend(previous_backend)
+        assert results["int"] == results["py_ecc"]
+        print("curve: compared backends: {:.3f}s".format(get_time_delta()))
+
+    def test_lazy_py_ecc(self):
+        """The library does not import py_ecc unless its backend gets picked"""
+        code = ("import sys, bayer_groth, bayer_groth_prove, crs_store, encoding, validation; crs_store.generate_crs(1); "
+                "assert not any(name.startswith('py_ecc') for name in sys.modules)")
+        environment = dict(os.environ, PYBG_CURVE_BACKEND="int")
+        subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), env=environment,
+                       check=True)
+        print("curve: imported without py_ecc: {:.3f}s".format(get_time_delta()))
+
+class TestBatchInversion(unittest.TestCase):
+    def test_batch_inv(self):
+        values = [random.randint(1, MODULUS - 1) for _ in range(10)] + [0, MODULUS, 1]
+        assert batch_inv(values) == [inv(x) for x in values]
+        assert batch_inv([]) == []
+
+        # Also in the base field
+        values = [random.randint(0, b.field_modulus) for _ in range(10)]
+        assert batch_inv(values, b.field_modulus) == [(b.FQ(1) / b.FQ(x)).n for x in values]
+
 class TestInnerProductArgument(unittest.TestCase):
     def test_inner_product_argument(self):
         generators = gen_generator_points(2*N + 1)
@@ -71,6 +276,55 @@ class TestInnerProductArgument(unittest.TestCase):
         assert ipa.verify(Transcript(), crs_G, crs_H, crs_U, B, C, z, proof)
         print("ipa: proof verified: {:.3f}s".format(get_time_delta()))
 
+        # A proof for a different inner product must not verify
+        with self.assertRaises(AssertionError):
+            ipa.verify(Transcript(), crs_G, crs_H, crs_U, B, C, (z + 1) % MODULUS, proof)
+
+    def test_odd_length_forgery(self):
+        """Padding an odd-length CRS with the point at infinity must not let a prover pick `z`"""
+        n = 3
+        generators = gen_generator_points(2*n + 1)
+        crs_G, crs_H, crs_U = generators[:n], generators[n:2*n], generators[-1]
+        vec_b = [random.randint(0, MODULUS) for _ in range(n)]
+        vec_c = [random.randint(0, MODULUS) for _ in range(n)]
+        B, C = msm(crs_G, vec_b), msm(crs_H, vec_c)
+
+        # The padded products are unbound by `B` and `C`, so they can add anything to `z`
+        bad_z = (get_inner_product(vec_b, vec_c) + 12345) % MODULUS
+        proof = ipa_prove.prove(Transcript(), crs_G + [curve.Z1], crs_H + [curve.Z1], crs_U, B, C, bad_z,
+                                vec_b + [1], vec_c + [12345])
+        with self.assertRaises(AssertionError):
+            ipa.verify(Transcript(), crs_G, crs_H, crs_U, B, C, bad_z, proof)
+
+        # Odd lengths are not proven either
+        with self.assertRaises(AssertionError):
+            ipa_prove.prove(Transcript(), crs_G, crs_H, crs_U, B, C, bad_z, vec_b, vec_c)
+
+    def test_joint_odd_length_forgery(self):
+        """The forgery of `test_odd_length_forgery()`, with the rounds running along with a multi-exponentiation proof"""
+        n = 3
+        generators = gen_generator_points(4*n + 1)
+        crs_G, crs_H, vec_T, vec_U = [generators[i*n:(i+1)*n] for i in range(4)]
+        crs_U = generators[-1]
+        vec_a, vec_b, vec_c = [[random.randint(0, MODULUS) for _ in range(n)] for _ in range(3)]
+        A, B, C = msm(crs_G, vec_a), msm(crs_G, vec_b), msm(crs_H, vec_c)
+        T, U = msm(vec_T, vec_a), msm(vec_U, vec_a)
+
+        bad_z = (get_inner_product(vec_b, vec_c) + 12345) % MODULUS
+        transcript = Transcript()
+        ipa_state = ipa_prove.prove_setup(transcript, crs_G + [curve.Z1], crs_H + [curve.Z1], crs_U, B, C, bad_z,
+                                          vec_b + [1], vec_c + [12345])
+        multiexp_proof = multiexp_prove.prove(transcript, crs_G + [curve.Z1], vec_T + [curve.Z1], vec_U + [curve.Z1],
+                                              A, T, U, vec_a + [0], ipa_state=ipa_state)
+        ipa_proof = ipa_prove.get_proof(ipa_state)
+
+        with self.assertRaises(AssertionError):
+            transcript = Transcript()
+            ipa_state = ipa.verify_setup(transcript, crs_G, crs_H, crs_U, B, C, bad_z, ipa_proof)
+            equations = multiexp.get_verification_equations(transcript, crs_G, vec_T, vec_U, A, T, U, multiexp_proof,
+                                                            ipa_state)
+            assert util.check_equations(equations + ipa.get_final_equations(ipa_state))
+
 class TestMultiExpProof(unittest.TestCase):
     def test_multi_exp_argument(self):
         # Create generators needed for multiexp proof
@@ -98,6 +352,10 @@ class TestMultiExpProof(unittest.TestCase):
         assert multiexp.verify(Transcript(), crs_G, vec_T, vec_U, A, T, U, proof)
         print("multiexp: proof verified: {:.3f}s".format(get_time_delta()))
 
+        # A proof for a different `U` must not verify
+        with self.assertRaises(AssertionError):
+            multiexp.verify(Transcript(), crs_G, vec_T, vec_U, A, T, curve.add(U, crs_G[0]), proof)
+
 class TestGrandProduct(unittest.TestCase):
     def test_grand_product_argument(self):
         # Create generators
@@ -178,19 +436,407 @@ class TestShuffleProof(unittest.TestCase):
         assert(len(vec_R) == len(vec_S) == ELL)
 
         # Create the output vectors by randomizing and permuting the input vectors
-        vec_T = [b.multiply(R_i, r) for R_i in vec_R]
+        vec_T = [curve.multiply(R_i, r) for R_i in vec_R]
         vec_T = apply_permutation(vec_T, permutation)
-        vec_U = [b.multiply(S_i, r) for S_i in vec_S]
+        vec_U = [curve.multiply(S_i, r) for S_i in vec_S]
         vec_U = apply_permutation(vec_U, permutation)
         print("bg: finished shuffling and randomizing: {:.3f}s".format(get_time_delta()))
 
-        # Create a shuffle proof and verify it
-        shuffle_proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+        # The prover's batched shuffle gives the same outputs
+        batch_T, batch_U = bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+        assert all(curve.eq(pt, expected) for pt, expected in zip(batch_T + batch_U, vec_T + vec_U))
+        print("bg: finished batched shuffling and randomizing: {:.3f}s".format(get_time_delta()))
+
+        # Create a shuffle proof and verify it. The prover uses a CRS with fixed-base tables, which is worth building
+        # when proving many shuffles against the same CRS.
+        prepared_crs = bayer_groth.prepare_crs(crs)
+        print("bg: prepared CRS: {:.3f}s".format(get_time_delta()))
+        shuffle_proof = bayer_groth_prove.prove(prepared_crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
         print("bg: finished shuffle proof: {:.3f}s".format(get_time_delta()))
 
         assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, shuffle_proof)
         print("bg: finished verifying shuffle proof: {:.3f}s".format(get_time_delta()))
 
+        # Check each subargument on its own, and make sure that the failing one gets reported
+        assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, shuffle_proof, debug=True)
+        bad_multiexp_proof = dataclasses.replace(shuffle_proof.multiexp_proof, tip_a=shuffle_proof.multiexp_proof.tip_a + 1)
+        bad_shuffle_proof = dataclasses.replace(shuffle_proof, multiexp_proof=bad_multiexp_proof)
+        with self.assertRaisesRegex(AssertionError, "multiexp"):
+            bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, bad_shuffle_proof, debug=True)
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, bad_shuffle_proof)
+        print("bg: finished checking bad shuffle: {:.3f}s".format(get_time_delta()))
+
+    def test_precomputed_shuffle(self):
+        """Split a shuffle proof between `precompute()` and `finish()`, and make sure a state cannot be reused"""
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(8)
+
+        state = bayer_groth_prove.precompute(crs, permutation)
+        print("bg: precomputed shuffle proof: {:.3f}s".format(get_time_delta()))
+        shuffle_proof = bayer_groth_prove.finish(state, vec_R, vec_S, vec_T, vec_U, r)
+        print("bg: finished precomputed shuffle proof: {:.3f}s".format(get_time_delta()))
+        assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, shuffle_proof)
+
+        # Finishing a second proof would reuse the blinders of the first one
+        with self.assertRaises(AssertionError):
+            bayer_groth_prove.finish(state, vec_R, vec_S, vec_T, vec_U, r)
+
+    def test_non_power_of_two_sizes(self):
+        """Shuffles of any number of elements, with a CRS padded with blinders to a power of two"""
+        for ell in [1, 3, 9, 16]:
+            n = bayer_groth.get_crs_size(ell)
+            crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(n, ell)
+            shuffle_proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+            assert 2 ** len(shuffle_proof.multiexp_proof.vec_C_L) == n
+            assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, shuffle_proof, debug=True)
+            print("bg: verified shuffle of {} elements: {:.3f}s".format(ell, get_time_delta()))
+
+        # The CRS must be padded to a power of two
+        unpadded_crs = bayer_groth.ShuffleCRS(crs.vec_G[:ell + N_BLINDERS], crs.U, crs.G_t, crs.G_u)
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify(unpadded_crs, vec_R, vec_S, vec_T, vec_U, shuffle_proof)
+
+    def test_joint_shuffle_proof(self):
+        """Proofs whose grand-product and multi-exponentiation arguments share their recursion rounds"""
+        joint = bayer_groth.PROOF_VERSION_JOINT
+        for ell in [4, 9]:
+            crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(bayer_groth.get_crs_size(ell), ell)
+            proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r, version=joint)
+            assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof, debug=True)
+            decoded_proof = encoding.decode(bayer_groth.ShuffleProof, encoding.encode(proof))
+            assert decoded_proof.version == joint
+            assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, decoded_proof)
+            print("bg: verified joint shuffle proof of {} elements: {:.3f}s".format(ell, get_time_delta()))
+
+        # The version is part of the statement: the same proof does not verify as a proof of another version
+        for version in [bayer_groth.PROOF_VERSION_SEPARATE, 3]:
+            with self.assertRaises(AssertionError):
+                bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, dataclasses.replace(proof, version=version))
+        bad_ipa_proof = dataclasses.replace(proof.gprod_proof.ipa_proof, tip_b=proof.gprod_proof.ipa_proof.tip_b + 1)
+        bad_proof = dataclasses.replace(proof, gprod_proof=dataclasses.replace(proof.gprod_proof, ipa_proof=bad_ipa_proof))
+        with self.assertRaisesRegex(AssertionError, "gprod"):
+            bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, bad_proof, debug=True)
+
+        # Shuffles of columns
+        k, ell = 3, 6
+        n = bayer_groth.get_crs_size(ell, k)
+        generators = gen_generator_points(n + 1 + k + k*ell)
+        crs = bayer_groth.ShuffleColumnsCRS(generators[:n], generators[n], generators[n+1:n+1+k])
+        inputs = [generators[n+1+k+j*ell:n+1+k+(j+1)*ell] for j in range(k)]
+        permutation = get_random_permutation(ell)
+        outputs = bayer_groth_prove.shuffle_and_randomize_columns(inputs, permutation, r)
+        proof = bayer_groth_prove.prove_columns(crs, inputs, outputs, permutation, r, version=joint)
+        assert bayer_groth.verify_columns(crs, inputs, outputs, proof, debug=True)
+        print("bg: verified joint shuffle proof of {} columns: {:.3f}s".format(k, get_time_delta()))
+
+    def test_aggregate_shuffle_proof(self):
+        """Prove several shuffles of the same size with one proof, and reject permutations that mix the shuffles"""
+        m, ell = 3, 4
+        n = bayer_groth.get_aggregate_size(m, ell)
+        generators = gen_generator_points(n + 3 + 2*m*ell)
+        crs = bayer_groth.ShuffleCRS(generators[:n], generators[n], generators[n+1], generators[n+2])
+        inputs = [(generators[n+3+2*i*ell:n+3+(2*i+1)*ell], generators[n+3+(2*i+1)*ell:n+3+(2*i+2)*ell])
+                  for i in range(m)]
+
+        permutations = [get_random_permutation(ell) for _ in range(m)]
+        vec_r = [random.randint(0, MODULUS) for _ in range(m)]
+        shuffles = [(vec_R, vec_S) + bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+                    for (vec_R, vec_S), permutation, r in zip(inputs, permutations, vec_r)]
+        for version in bayer_groth.PROOF_VERSIONS:
+            proof = bayer_groth_prove.prove_aggregate(crs, shuffles, permutations, vec_r, version=version)
+            assert bayer_groth.verify_aggregate(crs, shuffles, proof, debug=True)
+            decoded_proof = encoding.decode(bayer_groth.AggregateShuffleProof, encoding.encode(proof))
+            assert bayer_groth.verify_aggregate(crs, shuffles, decoded_proof)
+            print("bg: verified aggregated proof of {} shuffles of {} elements: {:.3f}s".format(m, ell, get_time_delta()))
+
+        # The outputs of the shuffles are swapped
+        swapped = [shuffles[1], shuffles[0]] + shuffles[2:]
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify_aggregate(crs, swapped, proof)
+
+        # A permutation of all the elements that moves an element to another shuffle. The CRS is padded from
+        # `m * ell + get_n_blinders(2 * m)` points to a power of two.
+        assert n > m * ell + bayer_groth.get_n_blinders(2 * m)
+        permutation = [i * ell + p for i, shuffle_permutation in enumerate(permutations) for p in shuffle_permutation]
+        permutation[ell - 1], permutation[ell] = permutation[ell], permutation[ell - 1]
+        vec_T, vec_U = bayer_groth_prove.shuffle_and_randomize([pt for vec_R, _ in inputs for pt in vec_R],
+                                                               [pt for _, vec_S in inputs for pt in vec_S],
+                                                               permutation, vec_r[0])
+        mixed = [(vec_R, vec_S, vec_T[i*ell:(i+1)*ell], vec_U[i*ell:(i+1)*ell])
+                 for i, (vec_R, vec_S) in enumerate(inputs)]
+        for version in bayer_groth.PROOF_VERSIONS:
+            state = bayer_groth_prove.precompute(crs, permutation, 2, m)
+            proof = bayer_groth_prove.finish_aggregate(state, mixed, [vec_r[0]] * m, version=version)
+            with self.assertRaisesRegex(AssertionError, "gprod"):
+                bayer_groth.verify_aggregate(crs, mixed, proof, debug=True)
+
+        # One of the shuffles was randomized with another factor than the one it is proven with
+        bad_r = list(vec_r)
+        bad_r[2] = (bad_r[2] + 1) % MODULUS
+        proof = bayer_groth_prove.prove_aggregate(crs, shuffles, permutations, bad_r)
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify_aggregate(crs, shuffles, proof)
+
+    def test_shuffle_columns(self):
+        """Shuffle several columns with a single proof, and reject columns randomized with different factors"""
+        for k, ell in [(1, 5), (3, 9)]:
+            n = bayer_groth.get_crs_size(ell, k)
+            generators = gen_generator_points(n + 1 + k + k*ell)
+            crs = bayer_groth.ShuffleColumnsCRS(generators[:n], generators[n], generators[n+1:n+1+k])
+            inputs = [generators[n+1+k+j*ell:n+1+k+(j+1)*ell] for j in range(k)]
+
+            permutation = get_random_permutation(ell)
+            r = random.randint(0, MODULUS)
+            outputs = bayer_groth_prove.shuffle_and_randomize_columns(inputs, permutation, r)
+            proof = bayer_groth_prove.prove_columns(crs, inputs, outputs, permutation, r)
+            assert bayer_groth.verify_columns(crs, inputs, outputs, proof, debug=True)
+
+            decoded_proof = encoding.decode(bayer_groth.ShuffleColumnsProof, encoding.encode(proof))
+            decoded_crs = encoding.decode(bayer_groth.ShuffleColumnsCRS, encoding.encode(crs))
+            assert bayer_groth.verify_columns(decoded_crs, inputs, outputs, decoded_proof)
+            print("bg: verified shuffle of {} columns: {:.3f}s".format(k, get_time_delta()))
+
+        # The last column was randomized with another factor
+        bad_outputs = outputs[:-1] + bayer_groth_prove.shuffle_and_randomize_columns(inputs[-1:], permutation, r + 1)
+        bad_proof = bayer_groth_prove.prove_columns(crs, inputs, bad_outputs, permutation, r)
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify_columns(crs, inputs, bad_outputs, bad_proof)
+
+        # The CRS must be padded with blinders to a power of two
+        unpadded_crs = bayer_groth.ShuffleColumnsCRS(crs.vec_G[:ell + bayer_groth.get_n_blinders(k)], crs.U,
+                                                     crs.vec_G_blind)
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify_columns(unpadded_crs, inputs, outputs, proof)
+        with self.assertRaises(AssertionError):
+            bayer_groth_prove.prove_columns(unpadded_crs, inputs, outputs, permutation, r)
+
+        # Two columns also work with a regular CRS
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(8)
+        inputs, outputs = [vec_R, vec_S], [vec_T, vec_U]
+        proof = bayer_groth_prove.prove_columns(crs, inputs, outputs, permutation, r)
+        assert bayer_groth.verify_columns(crs, inputs, outputs, proof)
+        print("bg: checked shuffles of columns: {:.3f}s".format(get_time_delta()))
+
+class TestTranscript(unittest.TestCase):
+    def test_transcript(self):
+        # Transcripts that absorbed the same data give the same challenges
+        t1, t2 = Transcript(), Transcript()
+        for t in [t1, t2]:
+            t.absorb_points([curve.G1])
+            t.absorb_scalars([1, 2, 3])
+        assert t1.get_challenge_scalars(4) == t2.get_challenge_scalars(4)
+        assert t1.get_challenge_scalar() == t2.get_challenge_scalar()
+        assert t1.get_challenge_scalar() != t1.get_challenge_scalar()
+        assert len(set(t1.get_challenge_scalars(4))) == 4
+
+        # The legacy transcript re-hashes everything it absorbed
+        legacy = Transcript(legacy=True)
+        legacy.absorb_scalars([1, 2, 3])
+        challenge = int.from_bytes(sha256(b"123").digest(), 'little') % MODULUS
+        assert legacy.get_challenge_scalars(2) == \
+            [challenge, int.from_bytes(sha256(b"123" + str(challenge).encode()).digest(), 'little') % MODULUS]
+
+    def test_point_encoding(self):
+        # Check our batched compression against py_ecc's point compression
+        points = [curve.multiply(G, random.randint(0, MODULUS)) for G in gen_generator_points(8)] + [curve.Z1, curve.neg(curve.G1)]
+        assert compress_points(points) == [compress_G1(to_py_ecc(pt)).to_bytes(48, 'big') for pt in points]
+        assert batch_normalize(points) == [None if curve.is_inf(pt) else curve.normalize(pt) for pt in points]
+
+    def test_legacy_shuffle_proof(self):
+        """Proofs made with the legacy transcript only verify with the legacy transcript"""
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(8)
+        proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r, Transcript(legacy=True))
+
+        assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof, transcript=Transcript(legacy=True))
+        with self.assertRaises(AssertionError):
+            bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof)
+        print("transcript: checked legacy shuffle proof: {:.3f}s".format(get_time_delta()))
+
+class TestEncoding(unittest.TestCase):
+    def test_encoding(self):
+        """Encode a shuffle proof along with its CRS and vectors, and verify the decoded proof"""
+        n = 8
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(n)
+        proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+
+        encoded_proof = encoding.encode(proof)
+        assert len(encoded_proof) == encoding.encoded_size(proof)
+        print("encoding: shuffle proof of {} elements takes {} bytes".format(n, len(encoded_proof)))
+
+        decoded_crs = encoding.decode(bayer_groth.ShuffleCRS, encoding.encode(crs))
+        decoded_vectors = [encoding.decode(G1PointVector, encoding.encode(vec)) for vec in [vec_R, vec_S, vec_T, vec_U]]
+        decoded_proof = encoding.decode(bayer_groth.ShuffleProof, bytearray(encoded_proof))
+        assert bayer_groth.verify(decoded_crs, *decoded_vectors, decoded_proof)
+
+        # Re-encoding gives back the same bytes, and decoding rejects malformed data
+        assert encoding.encode(decoded_proof) == encoded_proof
+        with self.assertRaises(ValueError):
+            encoding.decode(bayer_groth.ShuffleProof, encoded_proof[:-1])
+        with self.assertRaises(ValueError):
+            encoding.decode(bayer_groth.ShuffleCRS, encoded_proof)
+        print("encoding: verified decoded proof: {:.3f}s".format(get_time_delta()))
+
+class TestCRS(unittest.TestCase):
+    def test_hash_to_curve(self):
+        """Our hash-to-curve matches py_ecc's implementation of the same RFC 9380 suite, down to its constants"""
+        assert (crs_store.ISO_A, crs_store.ISO_B, crs_store.ISO_Z, crs_store.SQRT_MINUS_Z_CUBED) == \
+            (constants.ISO_11_A.n, constants.ISO_11_B.n, constants.ISO_11_Z.n, constants.SQRT_MINUS_11_CUBED.n)
+        assert [list(coefficients) for coefficients in crs_store.ISO_MAP_COEFFICIENTS] == \
+            [[k.n for k in coefficients] for coefficients in constants.ISO_11_MAP_COEFFICIENTS]
+
+        dst = b"QUUX-V01-CS02-with-BLS12381G1_XMD:SHA-256_SSWU_RO_"
+        for message in [b"", b"abc", b"a" * 512]:
+            pt = crs_store.hash_to_curve(message, dst)
+            expected = b.normalize(hash_to_G1(message, dst, sha256))
+            assert curve.normalize(pt) == (expected[0].n, expected[1].n)
+            assert validation.is_in_subgroup(pt)
+        print("crs_store: hashed to curve: {:.3f}s".format(get_time_delta()))
+
+    def test_crs_store(self):
+        """Store a CRS, load it back with and without fixed-base tables, and prove a shuffle with it"""
+        n = 8
+        ell = n - N_BLINDERS
+        generated_crs = crs_store.generate_crs(n, b"test")
+        assert curve.eq(crs_store.generate_crs(1, b"test").vec_G[0], generated_crs.vec_G[0])
+        assert not curve.eq(crs_store.generate_crs(1, b"other").vec_G[0], generated_crs.vec_G[0])
+
+        generators = gen_generator_points(2*ell)
+        vec_R, vec_S = generators[:ell], generators[ell:]
+        permutation = get_random_permutation(ell)
+        r = random.randint(0, MODULUS)
+        vec_T, vec_U = bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for window in [None, 4]:
+                path = os.path.join(tmp_dir, "crs-{}".format(window))
+                crs_store.save_crs(path, generated_crs, b"test", window)
+                loaded_crs = crs_store.get_crs(path, n, b"test", window)
+                assert all(curve.eq(G, H) for G, H in zip(loaded_crs.vec_G, generated_crs.vec_G))
+                assert curve.eq(loaded_crs.G_u, generated_crs.G_u)
+                assert isinstance(loaded_crs.U, FixedBasePoint) == (window is not None)
+
+                proof = bayer_groth_prove.prove(loaded_crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+                assert bayer_groth.verify(generated_crs, vec_R, vec_S, vec_T, vec_U, proof)
+                print("crs_store: proved with stored CRS (window {}): {:.3f}s".format(window, get_time_delta()))
+
+            # `get_crs()` creates missing stores, and rejects the ones with other parameters
+            path = os.path.join(tmp_dir, "crs-new")
+            assert curve.eq(crs_store.get_crs(path, n, b"test").vec_G[n-1], generated_crs.vec_G[n-1])
+            with self.assertRaises(ValueError):
+                crs_store.get_crs(path, n, b"other")
+            with self.assertRaises(ValueError):
+                crs_store.get_crs(path, n + 1, b"test")
+            with open(path, "r+b") as f:
+                f.write(b"X")
+            with self.assertRaises(ValueError):
+                crs_store.load_crs(path)
+
+class TestParallelProver(unittest.TestCase):
+    def test_parallel_prover(self):
+        """The prover creates the same proof with and without an executor"""
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(16)
+
+        random.seed(1337)
+        expected_proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+        with ProcessPoolExecutor(2) as executor:
+            util.set_executor(executor, 2)
+            try:
+                random.seed(1337)
+                proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+            finally:
+                util.set_executor(None)
+        assert encoding.encode(proof) == encoding.encode(expected_proof)
+        print("parallel: checked parallel prover: {:.3f}s".format(get_time_delta()))
+
+class TestBatchVerification(unittest.TestCase):
+    def test_verify_batch(self):
+        """Verify a batch of small shuffle proofs, one of which is invalid"""
+        n_proofs = 3
+        crs, vec_R, vec_S, *_ = make_shuffle(16)
+
+        instances = []
+        for _ in range(n_proofs):
+            permutation = get_random_permutation(len(vec_R))
+            r = random.randint(0, MODULUS)
+            vec_T, vec_U = bayer_groth_prove.shuffle_and_randomize(vec_R, vec_S, permutation, r)
+            proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+            instances.append((vec_R, vec_S, vec_T, vec_U, proof))
+        print("batch: generated {} proofs: {:.3f}s".format(n_proofs, get_time_delta()))
+
+        assert bayer_groth.verify_batch(crs, instances)
+        print("batch: verified {} proofs: {:.3f}s".format(n_proofs, get_time_delta()))
+
+        # Swap the outputs of the last two proofs: bisection should find both
+        bad_instances = instances[:1] + [instances[1][:4] + instances[2][4:], instances[2][:4] + instances[1][4:]]
+        with self.assertRaisesRegex(AssertionError, r"\[1, 2\]"):
+            bayer_groth.verify_batch(crs, bad_instances)
+        print("batch: found invalid proofs: {:.3f}s".format(get_time_delta()))
+
+        # Decoded points only get decompressed when they are first read: a bad encoding only fails its own proof
+        encoded_vec_R = bytearray(encoding.encode(vec_R))
+        encoded_vec_R[encoding.HEADER_SIZE + encoding.LENGTH_SIZE] &= 0x7f # clear the compression flag of `vec_R[0]`
+        bad_vec_R = encoding.decode(G1PointVector, encoded_vec_R)
+        with self.assertRaisesRegex(AssertionError, r"\[1\]"):
+            bayer_groth.verify_batch(crs, [instances[0], (bad_vec_R,) + instances[0][1:]])
+
+    def test_verifier_key(self):
+        """Verifier keys are computed once per CRS and number of elements, and evicted least recently used first"""
+        n = 8
+        generators = gen_generator_points(n + 3)
+        crs = bayer_groth.ShuffleCRS(generators[:n], generators[n], generators[n+1], generators[n+2])
+
+        key = bayer_groth.get_verifier_key(crs, n - N_BLINDERS)
+        assert curve.eq(key.sum_vec_G, msm(crs.vec_G, [1] * n))
+        assert curve.eq(key.sum_vec_G_ell, msm(crs.vec_G[:n - N_BLINDERS], [1] * (n - N_BLINDERS)))
+        assert bayer_groth.get_verifier_key(crs, n - N_BLINDERS) is key
+        assert bayer_groth.get_verifier_key(crs, n - 1) is not key
+
+        # An equal but distinct CRS gets its own key
+        other_crs = dataclasses.replace(crs)
+        assert bayer_groth.get_verifier_key(other_crs, n - N_BLINDERS).crs is other_crs
+
+        for ell in range(bayer_groth.VERIFIER_KEY_CACHE_SIZE):
+            bayer_groth.get_verifier_key(other_crs, ell)
+        assert (id(crs), n - N_BLINDERS) not in bayer_groth.verifier_keys
+        assert bayer_groth.get_verifier_key(crs, n - N_BLINDERS) is not key
+
+class TestValidation(unittest.TestCase):
+    def test_validate_points(self):
+        """Points off the curve or outside of G1 are rejected, including the ones with a small-order component"""
+        G = gen_generator_points(1)[0]
+        validation.validate_points([G, curve.Z1])
+
+        for prime in [3, 11, 10177, 859267, 52437899]:
+            Q = gen_small_order_point(prime)
+            with self.assertRaisesRegex(AssertionError, "G1"):
+                validation.validate_points([G, Q])
+            with self.assertRaisesRegex(AssertionError, "G1"):
+                validation.validate_points([curve.add(G, Q)])
+
+        with self.assertRaisesRegex(AssertionError, "curve"):
+            validation.validate_points([curve.from_affine(1, 1)])
+
+        validation.set_enabled(False)
+        try:
+            validation.validate_points([curve.from_affine(1, 1)])
+        finally:
+            validation.set_enabled(True)
+        print("validation: checked invalid points: {:.3f}s".format(get_time_delta()))
+
+    def test_verify_invalid_point(self):
+        """The verifier rejects a shuffle whose outputs are not in G1"""
+        crs, vec_R, vec_S, vec_T, vec_U, permutation, r = make_shuffle(8)
+        proof = bayer_groth_prove.prove(crs, vec_R, vec_S, vec_T, vec_U, permutation, r)
+        assert bayer_groth.verify(crs, vec_R, vec_S, vec_T, vec_U, proof)
+
+        # Move an output by a point of order 3
+        bad_vec_T = [curve.add(vec_T[0], gen_small_order_point(3))] + vec_T[1:]
+        with self.assertRaisesRegex(AssertionError, "G1"):
+            bayer_groth.verify(crs, vec_R, vec_S, bad_vec_T, vec_U, proof)
+        with self.assertRaisesRegex(AssertionError, r"\[1\]"):
+            bayer_groth.verify_batch(crs, [(vec_R, vec_S, vec_T, vec_U, proof), (vec_R, vec_S, bad_vec_T, vec_U, proof)])
+        print("validation: rejected shuffle with invalid point: {:.3f}s".format(get_time_delta()))
+
 if __name__ == '__main__':
     unittest.main()
 
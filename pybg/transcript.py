@@ -2,38 +2,97 @@
 A basic Fiat-Shamir transcript object. It absorbs objects and spits out challenges.
 """
 
-from py_ecc import optimized_bls12_381 as b
+import curve
 from bg_types import G1PointVector, FieldElementVector, FieldElement, G1Point
-from hashlib import sha256
+from hashlib import sha256, shake_256
+from util import compress_points, batch_normalize
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
+
+# Domain separator that initializes the hash state of every transcript
+TRANSCRIPT_DOMAIN = b"pybg transcript v1"
+# Number of XOF bytes used to derive each challenge, so that its bias modulo the curve order is negligible
+CHALLENGE_BYTES = 64
 
 def serialize_point(pt: G1Point):
-    # Helper: Serializes an elliptic curve point.
-    pt = b.normalize(pt)
-    return pt[0].n.to_bytes(64, 'little') + pt[1].n.to_bytes(64, 'little')
+    # Helper: Serializes an elliptic curve point using the legacy encoding.
+    x, y = curve.normalize(pt)
+    return x.to_bytes(64, 'little') + y.to_bytes(64, 'little')
+
+def serialize_scalar(x: FieldElement):
+    # Helper: Serializes a scalar to 32 bytes.
+    return (x % MODULUS).to_bytes(32, 'little')
 
 def hash(x: bytes):
     return sha256(x).digest()
 
 class Transcript:
-    def __init__(self):
-        self.digest = b""
+    """
+    The transcript keeps a running SHAKE256 state: absorbing updates the state, and challenges are squeezed out of it
+    without re-hashing what was absorbed before. Points are absorbed in compressed form (48 bytes) and scalars as 32
+    bytes.
+
+    If `legacy` is set, the transcript instead uses the original encoding, where all the absorbed bytes are kept
+    around and re-hashed with SHA256 for every challenge. This is much slower, but it is needed to verify proofs
+    created with older versions of pybg.
+    """
+    def __init__(self, legacy: bool = False):
+        self.legacy = legacy
+        if legacy:
+            self.digest = b""
+        else:
+            self.state = shake_256(TRANSCRIPT_DOMAIN)
+
+    def absorb(self, data: bytes):
+        """Add raw bytes to the transcript"""
+        if self.legacy:
+            self.digest += data
+        else:
+            self.state.update(data)
 
     def absorb_points(self, ps: G1PointVector):
         """Add elliptic curve points to the transcript"""
-        for p in ps:
-            self.digest += serialize_point(p)
+        if self.legacy:
+            # Normalize the whole batch at once; this gives the same bytes as `serialize_point()`
+            for p, affine in zip(ps, batch_normalize(ps)):
+                if affine is None:
+                    self.absorb(serialize_point(p))
+                else:
+                    self.absorb(affine[0].to_bytes(64, 'little') + affine[1].to_bytes(64, 'little'))
+        else:
+            # Normalize the whole batch at once and absorb the compressed points
+            self.absorb(b"".join(compress_points(ps)))
 
     def absorb_scalars(self, xs: FieldElementVector):
         """Add a bunch of scalars to the transcript"""
         for x in xs:
-            self.digest += str(x).encode()
+            if self.legacy:
+                self.absorb(str(x).encode())
+            else:
+                self.absorb(serialize_scalar(x))
 
     def get_challenge_scalar(self) -> FieldElement:
         """Generate a scalar using the current state of the transcript"""
+        if not self.legacy:
+            return self.get_challenge_scalars(1)[0]
+
         challenge = int.from_bytes(hash(self.digest), 'little') % MODULUS
         # Add challenge to the digest. We do this so that we don't return the same challenge when this func is called
         # multiple times in a row
         self.digest += str(challenge).encode()
         return challenge
+
+    def get_challenge_scalars(self, n: int) -> FieldElementVector:
+        """Generate `n` scalars using the current state of the transcript"""
+        if self.legacy:
+            return [self.get_challenge_scalar() for _ in range(n)]
+
+        # Squeeze a seed out of the transcript, and ratchet the transcript with it so that we don't return the same
+        # challenges when this func is called multiple times in a row
+        seed = self.state.digest(CHALLENGE_BYTES)
+        self.state.update(seed)
+
+        # Expand the seed into all the challenges with a single XOF call
+        stream = shake_256(seed).digest(CHALLENGE_BYTES * n)
+        return [int.from_bytes(stream[i:i + CHALLENGE_BYTES], 'little') % MODULUS
+                for i in range(0, len(stream), CHALLENGE_BYTES)]
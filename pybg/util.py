@@ -1,36 +1,664 @@
-from py_ecc import optimized_bls12_381 as b
-import random
+import curve
+import secrets
 
-MODULUS = b.curve_order
+MODULUS = curve.curve_order
 
-def msm(pts: list, scalars: list):
-    """Naive linear combination of a list of points and values (aka multiscalar multiplication)"""
+# MSMs smaller than this are computed with one `glv_multiply()` per point
+MSM_NAIVE_THRESHOLD = 3
+
+# Maximum bit length of the two halves of a scalar split by `glv_decompose()`
+GLV_BITS = curve.glv_lambda.bit_length()
+# Window size of the wNAF recoding used by `glv_multiply()` and `batch_multiply()`
+WNAF_WINDOW = 5
+
+# Folds of fewer points than this are done point by point: the field inversion of every step of `batch_multiply()`
+# only pays off when it is shared by enough points
+BATCH_FOLD_THRESHOLD = 16
+
+# Executor (e.g. a `ProcessPoolExecutor`) over which `msm_batch()` and `fold()` spread their work, and its number of
+# workers. Set with `set_executor()`.
+executor = None
+executor_workers = 1
+
+def naive_msm(pts: list, scalars: list):
+    """Naive linear combination of a list of points and values"""
     assert len(pts) == len(scalars)
 
-    o = b.Z1
+    o = curve.Z1
     for pt, value in zip(pts, scalars):
-        o = b.add(o, b.multiply(pt, value))
+        o = curve.add(o, curve.multiply(pt, value))
+    return o
+
+def glv_decompose(value):
+    """
+    Split a scalar into two halves `(k1, k2)` of at most `GLV_BITS` bits such that `value = k1 + k2 * lambda` modulo
+    the curve order. Then `value * P = k1 * P + k2 * curve.endomorphism(P)` for any point `P` of the prime-order
+    subgroup, and the two half-size multiplications can share their doublings.
+    """
+    value %= MODULUS
+    return value % curve.glv_lambda, value // curve.glv_lambda
+
+def wnaf(value, window):
+    """
+    Return the width-`window` non-adjacent form of `value`, least significant digit first: every non-zero digit is odd
+    and smaller than `2^(window-1)` in absolute value, and is followed by at least `window - 1` zero digits.
+    """
+    digits = []
+    while value:
+        digit = 0
+        if value & 1:
+            digit = value & ((1 << window) - 1)
+            if digit >= 1 << (window - 1):
+                digit -= 1 << window
+            value -= digit
+        digits.append(digit)
+        value >>= 1
+    return digits
+
+def signed_digits(value, c, n_windows):
+    """
+    Return `n_windows` signed `c`-bit digits of `value` in `(-2^(c-1), 2^(c-1)]`, least significant first. A digit
+    that would be too big borrows from the next one.
+    """
+    mask, half = (1 << c) - 1, 1 << (c - 1)
+    digits = []
+    for _ in range(n_windows):
+        digit = value & mask
+        value >>= c
+        if digit > half:
+            digit -= 1 << c
+            value += 1
+        digits.append(digit)
+    assert value == 0
+    return digits
+
+def glv_multiply(pt, value):
+    """
+    Multiply a point of the prime-order subgroup by a scalar. The scalar is split in two halves with `glv_decompose()`
+    and both are recoded with `wnaf()`, so that about `GLV_BITS` doublings are shared between the two halves.
+    """
+    vec_digits = [wnaf(k, WNAF_WINDOW) for k in glv_decompose(value)]
+
+    # Precompute the odd multiples P, 3P, 5P, ... and their images under the endomorphism
+    table = [pt]
+    pt_double = curve.double(pt)
+    for _ in range(2 ** (WNAF_WINDOW - 2) - 1):
+        table.append(curve.add(table[-1], pt_double))
+    tables = [table, [curve.endomorphism(P) for P in table]]
+
+    o = curve.Z1
+    for i in reversed(range(max(len(digits) for digits in vec_digits))):
+        o = curve.double(o)
+        for table, digits in zip(tables, vec_digits):
+            digit = digits[i] if i < len(digits) else 0
+            if digit > 0:
+                o = curve.add(o, table[digit >> 1])
+            elif digit < 0:
+                o = curve.add(o, curve.neg(table[-digit >> 1]))
     return o
 
+def pippenger_window_size(n):
+    """
+    Return the bucket window size (in bits) that minimizes the number of group operations of a Pippenger MSM over `n`
+    GLV halves: every window costs `n` bucket additions plus about `2^c` additions to sum up its `2^(c-1)` buckets.
+    """
+    def cost(c):
+        return -(-(GLV_BITS + 1) // c) * (n + 2 ** c) + GLV_BITS
+    return min(range(1, 17), key=cost)
+
+def fixed_base_window_size(n):
+    """
+    Return the window size (in bits) that minimizes the number of group operations of a fixed-base MSM of size `n`:
+    every point costs one addition per window, plus about `2^(c+1)` additions to sum up the buckets.
+    """
+    n_bits = MODULUS.bit_length()
+    def cost(c):
+        return -(-n_bits // c) * n + 2 ** (c + 1)
+    return min(range(1, 17), key=cost)
+
+def get_fixed_base_table_size(window: int) -> int:
+    """Return the number of points in the fixed-base table of a point (see `FixedBasePoint`)"""
+    return -(-MODULUS.bit_length() // window)
+
+class FixedBasePoint(tuple):
+    """
+    A point bundled with a fixed-base table: its multiples `2^(window*j) * P` for every `window`-bit digit of a scalar.
+
+    It can be used anywhere a regular point is used. `msm()` and `multiply()` use the table to skip all the doublings.
+    Larger windows store fewer points and make large MSMs faster, while smaller windows suit single multiplications.
+
+    `powers` can be a table computed earlier for the same point and window (e.g. loaded by `crs_store.load_crs()`).
+    """
+    def __new__(cls, pt, window, powers=None):
+        self = super().__new__(cls, pt)
+        self.window = window
+        if powers is not None:
+            assert len(powers) == get_fixed_base_table_size(window)
+            self.powers = powers
+            return self
+        self.powers = [tuple(pt)]
+        for _ in range(get_fixed_base_table_size(window) - 1):
+            power = self.powers[-1]
+            for _ in range(window):
+                power = curve.double(power)
+            self.powers.append(power)
+        return self
+
+class ScaledBasis:
+    """
+    A vector of points `[f_i * G_i]` kept as its base points `G_i` and non-zero scalar factors `f_i`, without computing
+    any of its points. `msm()` and `fold()` push the factors into their scalars instead, so a `ScaledBasis` costs about
+    as much to use as its base points, and nothing to build.
+    """
+    def __init__(self, points: list, factors: list):
+        assert len(points) == len(factors)
+        self.points = list(points)
+        self.factors = list(factors)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ScaledBasis(self.points[i], self.factors[i])
+        return multiply(self.points[i], self.factors[i])
+
+def unscale(pts, scalars: list):
+    """
+    Return the points and scalars of the MSM of `scalars` over `pts`, moving the factors of `pts` into the scalars if
+    it is a `ScaledBasis`.
+    """
+    if isinstance(pts, ScaledBasis):
+        return pts.points, [f * value % MODULUS for f, value in zip(pts.factors, scalars)]
+    return pts, scalars
+
+def sum_buckets(buckets):
+    """Given a list of buckets (`None` for empty ones), return the sum of `i * buckets[i]` using a running sum"""
+    running, o = None, None
+    for bucket in reversed(buckets[1:]):
+        if bucket is not None:
+            running = bucket if running is None else curve.add(running, bucket)
+        if running is not None:
+            o = running if o is None else curve.add(o, running)
+    return curve.Z1 if o is None else o
+
+def fixed_base_msm(pairs: list):
+    """MSM over (point, scalar) pairs whose points are `FixedBasePoint`s with the same window"""
+    window = pairs[0][0].window
+    mask = (1 << window) - 1
+
+    # Put every precomputed power in the bucket of the matching scalar digit: no doublings needed
+    buckets = [None] * (mask + 1)
+    for pt, value in pairs:
+        assert pt.window == window
+        for power in pt.powers:
+            digit = value & mask
+            if digit:
+                buckets[digit] = power if buckets[digit] is None else curve.add(buckets[digit], power)
+            value >>= window
+    return sum_buckets(buckets)
+
+def msm(pts: list, scalars: list):
+    """
+    Multiscalar multiplication: compute the linear combination of a list of points and scalars.
+
+    Uses the Pippenger bucket method over the GLV halves of the scalars (see `glv_decompose()`) with signed digits and
+    a window size picked by `pippenger_window_size()`, and falls back to `glv_multiply()` for tiny inputs. Points that
+    are `FixedBasePoint`s are handled separately using their tables.
+
+    All the points must be in the prime-order subgroup. `pts` can also be a `ScaledBasis`.
+    """
+    assert len(pts) == len(scalars)
+    pts, scalars = unscale(pts, scalars)
+
+    # Zero scalars contribute nothing: drop them
+    pairs = [(pt, value % MODULUS) for pt, value in zip(pts, scalars) if value % MODULUS != 0]
+
+    # Split off the fixed-base points, grouped by window size
+    fixed_pairs = {}
+    for pt, value in pairs:
+        if isinstance(pt, FixedBasePoint):
+            fixed_pairs.setdefault(pt.window, []).append((pt, value))
+    if fixed_pairs:
+        o = msm([pt for pt, _ in pairs if not isinstance(pt, FixedBasePoint)],
+                [value for pt, value in pairs if not isinstance(pt, FixedBasePoint)])
+        for window_pairs in fixed_pairs.values():
+            o = curve.add(o, fixed_base_msm(window_pairs))
+        return o
+
+    if len(pairs) < MSM_NAIVE_THRESHOLD:
+        o = curve.Z1
+        for pt, value in pairs:
+            o = curve.add(o, glv_multiply(pt, value))
+        return o
+
+    # Split every scalar in two halves: this doubles the number of points but halves the number of windows
+    glv_pairs = []
+    for pt, value in pairs:
+        k1, k2 = glv_decompose(value)
+        glv_pairs += [(pt, k) for pt, k in [(pt, k1), (curve.endomorphism(pt), k2)] if k != 0]
+
+    c = pippenger_window_size(len(glv_pairs))
+    n_windows = -(-(GLV_BITS + 1) // c)
+    # Negative digits add the negated point to the bucket of the absolute value, so we only need `2^(c-1)` buckets
+    vec_digits = [signed_digits(value, c, n_windows) for _, value in glv_pairs]
+    vec_neg = [curve.neg(pt) for pt, _ in glv_pairs]
+
+    o = curve.Z1
+    # Walk the windows from the most significant one, doubling the accumulator `c` times in between
+    for w in reversed(range(n_windows)):
+        for _ in range(c):
+            o = curve.double(o)
+
+        # Put each point in the bucket of its `c`-bit digit in this window
+        buckets = [None] * ((1 << (c - 1)) + 1)
+        for (pt, _), neg_pt, digits in zip(glv_pairs, vec_neg, vec_digits):
+            digit = digits[w]
+            if digit < 0:
+                pt, digit = neg_pt, -digit
+            if digit:
+                buckets[digit] = pt if buckets[digit] is None else curve.add(buckets[digit], pt)
+        o = curve.add(o, sum_buckets(buckets))
+    return o
+
+def msm_multi(bases_list: list, scalars: list) -> list:
+    """
+    Compute the MSM of every vector of points in `bases_list` with the same `scalars`, e.g. `R` and `S` out of `vec_R`
+    and `vec_S`. This works like `msm()`, except that the scalars are split, recoded and sorted into buckets once for
+    all the vectors, which then get accumulated side by side.
+
+    Vectors with `FixedBasePoint`s and `ScaledBasis`es get their own `msm()`. If an executor is set, the MSMs are spread
+    over its workers with `msm_batch()` instead.
+    """
+    assert all(len(pts) == len(scalars) for pts in bases_list)
+    if executor is not None:
+        return msm_batch([(pts, scalars) for pts in bases_list])
+
+    shared = [b for b, pts in enumerate(bases_list)
+              if not isinstance(pts, ScaledBasis) and not any(isinstance(pt, FixedBasePoint) for pt in pts)]
+    indices = [i for i, value in enumerate(scalars) if value % MODULUS != 0]
+    if len(shared) < 2 or len(indices) < MSM_NAIVE_THRESHOLD:
+        return [msm(pts, scalars) for pts in bases_list]
+    out = [None if b in shared else msm(pts, scalars) for b, pts in enumerate(bases_list)]
+
+    # Split every scalar in two halves, and remember the point and the half that each of them goes with
+    glv_terms = []
+    for i in indices:
+        glv_terms += [(i, half, k) for half, k in enumerate(glv_decompose(scalars[i])) if k != 0]
+
+    c = pippenger_window_size(len(glv_terms))
+    n_windows = -(-(GLV_BITS + 1) // c)
+    vec_digits = [signed_digits(k, c, n_windows) for _, _, k in glv_terms]
+
+    # The GLV points of every vector, and their negations for the negative digits
+    vecs_glv = []
+    for b in shared:
+        pts = bases_list[b]
+        glv_pts = [pts[i] if half == 0 else curve.endomorphism(pts[i]) for i, half, _ in glv_terms]
+        vecs_glv.append((glv_pts, [curve.neg(pt) for pt in glv_pts]))
+
+    accs = [curve.Z1] * len(shared)
+    for w in reversed(range(n_windows)):
+        # Bucket schedule of this window, shared by all the vectors
+        schedule = [(t, digits[w]) for t, digits in enumerate(vec_digits) if digits[w]]
+        for j, (glv_pts, neg_pts) in enumerate(vecs_glv):
+            o = accs[j]
+            for _ in range(c):
+                o = curve.double(o)
+            buckets = [None] * ((1 << (c - 1)) + 1)
+            for t, digit in schedule:
+                pt = glv_pts[t] if digit > 0 else neg_pts[t]
+                digit = abs(digit)
+                buckets[digit] = pt if buckets[digit] is None else curve.add(buckets[digit], pt)
+            accs[j] = curve.add(o, sum_buckets(buckets))
+
+    for b, acc in zip(shared, accs):
+        out[b] = acc
+    return out
+
+def fold_all(lefts: list, rights: list, x) -> list:
+    """
+    Fold several vectors of points with the same `x` (see `fold()`), e.g. `vec_T`, `vec_U` and `crs_G` in a round of the
+    multi-exponentiation argument. The vectors are folded as one, so that they share the recoding of `x` and the field
+    inversions of `batch_multiply()`.
+    """
+    assert len(lefts) == len(rights)
+    if any(isinstance(left, ScaledBasis) for left in lefts):
+        return [fold(left, right, x) for left, right in zip(lefts, rights)]
+
+    folded = fold([pt for left in lefts for pt in left], [pt for right in rights for pt in right], x)
+    out, offset = [], 0
+    for left in lefts:
+        out.append(folded[offset:offset + len(left)])
+        offset += len(left)
+    return out
+
+def multiply(pt, value):
+    """Scalar multiplication, using the fixed-base table of `pt` if it has one and `glv_multiply()` otherwise"""
+    return msm([pt], [value])
+
+def check_equations(equations: list) -> bool:
+    """
+    Check a list of equations, each given as a pair of points and scalars whose MSM should be the point at infinity.
+
+    The equations are merged with random weights into a single MSM over the union of their points, so that points
+    shared between equations are only processed once. A prover that can predict the weights could make failing equations
+    cancel out, so they come from `secrets`.
+    """
+    indices = {} # maps the `id()` of each point to its position in `pts`
+    pts, scalars = [], []
+    for i, (eq_pts, eq_scalars) in enumerate(equations):
+        assert len(eq_pts) == len(eq_scalars)
+        weight = 1 if i == 0 else secrets.randbelow(MODULUS - 1) + 1
+        for pt, value in zip(eq_pts, eq_scalars):
+            if id(pt) not in indices:
+                indices[id(pt)] = len(pts)
+                pts.append(pt)
+                scalars.append(0)
+            scalars[indices[id(pt)]] += weight * value
+    return curve.eq(msm(pts, scalars), curve.Z1)
+
 def is_power_of_two(x):
     return x and (x & (x-1) == 0)
 
-def inv(a):
-    """Modular inverse using eGCD algorithm"""
-    if a == 0:
+def inv(a, modulus=MODULUS):
+    """Modular inverse (zero is mapped to zero)"""
+    if a % modulus == 0:
         return 0
-    lm, hm = 1, 0
-    low, high = a % MODULUS, MODULUS
-    while low > 1:
-        r = high // low
-        nm, new = hm - lm * r, high - low * r
-        lm, low, hm, high = nm, new, lm, low
-    return lm % MODULUS
+    return pow(a, -1, modulus)
+
+def batch_inv(values: list, modulus=MODULUS) -> list:
+    """
+    Invert all of `values` using a single modular inversion (Montgomery's trick). Zeroes are mapped to zero.
+    """
+    # Compute the running products of all the non-zero values
+    prefix_products, acc = [], 1
+    for value in values:
+        prefix_products.append(acc)
+        if value % modulus != 0:
+            acc = acc * value % modulus
+
+    # Invert the total product once, and peel off the inverse of each value going backwards
+    acc_inv = inv(acc, modulus)
+    inverses = [0] * len(values)
+    for i in reversed(range(len(values))):
+        if values[i] % modulus == 0:
+            continue
+        inverses[i] = acc_inv * prefix_products[i] % modulus
+        acc_inv = acc_inv * values[i] % modulus
+    return inverses
 
 def get_inner_product(a, b):
     assert len(a) == len(b)
     return sum(x * y % MODULUS for x, y in zip(a, b)) % MODULUS
 
+def get_folding_coefficients(vec_x, n):
+    """
+    Return the vector `vec_s` such that folding a vector `vec_G` of `n` points with `G_L + x * G_R` for every `x` in
+    `vec_x` results in the single point `<vec_s, vec_G>`.
+
+    This is what lets a verifier skip the folding rounds and check the result with a single MSM.
+    """
+    vec_s = [1]
+    for x in reversed(vec_x):
+        vec_s = vec_s + [s * x % MODULUS for s in vec_s]
+    assert len(vec_s) == n
+    return vec_s
+
+def batch_normalize(pts: list) -> list:
+    """
+    Return the affine coordinates `(x, y)` of every point in `pts` as integers (or `None` for the point at infinity),
+    using a single field inversion for the whole batch (Montgomery's trick).
+    """
+    p = curve.field_modulus
+    pts = [curve.coordinates(pt) for pt in pts]
+    z_invs = batch_inv([pt[2] for pt in pts], p)
+    return [None if z_inv == 0 else (pt[0] * z_inv % p, pt[1] * z_inv % p) for pt, z_inv in zip(pts, z_invs)]
+
+def batch_add(pts1: list, pts2: list) -> list:
+    """
+    Add two vectors of affine points (`(x, y)` integer pairs or `None`, like the output of `batch_normalize()`)
+    element-wise, using a single field inversion for all the slopes (Montgomery's trick). Equal points get doubled.
+    """
+    p = curve.field_modulus
+
+    # Compute the denominator of every slope (zero when there is no slope to compute) and their running products
+    dens, prefix_products, acc = [], [], 1
+    for P, Q in zip(pts1, pts2):
+        if P is None or Q is None:
+            den = 0
+        elif P[0] != Q[0]:
+            den = Q[0] - P[0]
+        elif P[1] == Q[1]:
+            den = 2 * P[1]
+        else:
+            den = 0 # P = -Q
+        dens.append(den)
+        prefix_products.append(acc)
+        if den:
+            acc = acc * den % p
+
+    acc_inv = inv(acc, p)
+    out = [None] * len(dens)
+    for i in reversed(range(len(dens))):
+        P, Q, den = pts1[i], pts2[i], dens[i]
+        if not den:
+            if P is None or Q is None:
+                out[i] = Q if P is None else P
+            continue
+        den_inv = acc_inv * prefix_products[i] % p
+        acc_inv = acc_inv * den % p
+
+        if P[0] != Q[0]:
+            slope = (Q[1] - P[1]) * den_inv % p
+        else:
+            slope = 3 * P[0] * P[0] * den_inv % p
+        x = (slope * slope - P[0] - Q[0]) % p
+        out[i] = (x, (slope * (P[0] - x) - P[1]) % p)
+    return out
+
+def batch_double(pts: list) -> list:
+    """Double every affine point of `pts` (as in `batch_add()`) using a single field inversion"""
+    p = curve.field_modulus
+
+    # The slope of the tangent at P is 3x^2 / 2y: compute the running products of the denominators
+    prefix_products, acc = [], 1
+    for P in pts:
+        prefix_products.append(acc)
+        if P is not None:
+            acc = acc * (P[1] + P[1]) % p
+
+    acc_inv = inv(acc, p)
+    out = [None] * len(pts)
+    for i in reversed(range(len(pts))):
+        if pts[i] is None:
+            continue
+        x, y = pts[i]
+        den_inv = acc_inv * prefix_products[i] % p
+        acc_inv = acc_inv * (y + y) % p
+
+        slope = 3 * x * x * den_inv % p
+        x3 = (slope * slope - x - x) % p
+        out[i] = (x3, (slope * (x - x3) - y) % p)
+    return out
+
+def batch_multiply(pts: list, scalars: list) -> list:
+    """
+    Multiply every affine point of `pts` (as in `batch_add()`) by its scalar. Like in `glv_multiply()`, the scalars are
+    split with the endomorphism and recoded in wNAF, but every step of the double-and-add loop is a single `batch_add()`
+    over the whole vector. Repeated scalars (e.g. the challenge of a fold) are only recoded once.
+    """
+    p = curve.field_modulus
+    recodings = {}
+    for value in scalars:
+        if value not in recodings:
+            recodings[value] = [wnaf(k, WNAF_WINDOW) for k in glv_decompose(value)]
+    vec_recodings = [recodings[value] for value in scalars]
+    n_steps = max([len(digits) for recoding in recodings.values() for digits in recoding], default=0)
+
+    # Precompute the odd multiples P, 3P, 5P, ... of every point, and their images under the endomorphism
+    pts_double = batch_double(pts)
+    table = [pts]
+    for _ in range(2 ** (WNAF_WINDOW - 2) - 1):
+        table.append(batch_add(table[-1], pts_double))
+    tables = [table, [[None if P is None else (curve.glv_beta * P[0] % p, P[1]) for P in row] for row in table]]
+    neg_tables = [[[None if P is None else (P[0], -P[1] % p) for P in row] for row in table] for table in tables]
+
+    acc = [None] * len(pts)
+    for i in reversed(range(n_steps)):
+        acc = batch_double(acc)
+        for half, (table, neg_table) in enumerate(zip(tables, neg_tables)):
+            # Pick the table entry to add to each point for this digit (`None` adds nothing)
+            addends, has_addends = [None] * len(pts), False
+            for j, recoding in enumerate(vec_recodings):
+                digits = recoding[half]
+                digit = digits[i] if i < len(digits) else 0
+                if digit > 0:
+                    addends[j], has_addends = table[digit >> 1][j], True
+                elif digit < 0:
+                    addends[j], has_addends = neg_table[-digit >> 1][j], True
+            if has_addends:
+                acc = batch_add(acc, addends)
+    return acc
+
+def multiply_all(pts: list, value) -> list:
+    """
+    Multiply every point of `pts` by the same scalar `value`. Long vectors go through `batch_multiply()`, so that `value`
+    is recoded once and each step of the double-and-add loop costs a single field inversion for the whole vector.
+    """
+    value %= MODULUS
+    if len(pts) < BATCH_FOLD_THRESHOLD:
+        return [multiply(pt, value) for pt in pts]
+    products = batch_multiply(batch_normalize(pts), [value] * len(pts))
+    return [curve.Z1 if pt is None else curve.from_affine(*pt) for pt in products]
+
+def compress_points(pts: list) -> list:
+    """
+    Serialize each point of `pts` to 48 bytes using the compressed encoding of ZCash's BLS12-381 implementation: the
+    big-endian `x` coordinate, with the three most significant bits used as flags for compression, the point at
+    infinity, and the sign of `y`.
+    """
+    p = curve.field_modulus
+    out = []
+    for pt in batch_normalize(pts):
+        if pt is None:
+            out.append(bytes([0xc0]) + bytes(47))
+            continue
+        x, y = pt
+        flags = 0x80 | (0x20 if y > (p - 1) // 2 else 0)
+        encoding = bytearray(x.to_bytes(48, 'big'))
+        encoding[0] |= flags
+        out.append(bytes(encoding))
+    return out
+
+def decompress_point(data: bytes):
+    """Deserialize a point from the 48-byte compressed encoding of `compress_points()`"""
+    p = curve.field_modulus
+    if len(data) != 48:
+        raise ValueError("compressed points are 48 bytes long")
+    flags = data[0] & 0xe0
+    x = int.from_bytes(bytes([data[0] & 0x1f]) + bytes(data[1:]), 'big')
+
+    if not flags & 0x80:
+        raise ValueError("point is not compressed")
+    if flags & 0x40:
+        if flags & 0x20 or x != 0:
+            raise ValueError("invalid encoding of the point at infinity")
+        return curve.Z1
+    if x >= p:
+        raise ValueError("x coordinate is not a field element")
+
+    y = pow(x ** 3 + curve.b, (p + 1) // 4, p)
+    if y * y % p != (x ** 3 + curve.b) % p:
+        raise ValueError("point is not on the curve")
+    if (y > (p - 1) // 2) != bool(flags & 0x20):
+        y = p - y
+    return curve.from_affine(x, y)
+
+def encode_affine(pts: list) -> bytes:
+    """
+    Serialize points as their 96-byte affine coordinates. This is bigger than the compressed encoding but much faster
+    to decode, which makes it a good fit for sending points to other processes.
+    """
+    # (0, 0) is not on the curve, so we use it for the point at infinity
+    return b"".join(x.to_bytes(48, 'big') + y.to_bytes(48, 'big') for x, y in
+                    ((0, 0) if pt is None else pt for pt in batch_normalize(pts)))
+
+def decode_affine(data: bytes) -> list:
+    """Deserialize points encoded with `encode_affine()`"""
+    pts = []
+    for i in range(0, len(data), 96):
+        x, y = int.from_bytes(data[i:i+48], 'big'), int.from_bytes(data[i+48:i+96], 'big')
+        pts.append(curve.Z1 if x == y == 0 else curve.from_affine(x, y))
+    return pts
+
+def set_executor(new_executor, n_workers: int = 1):
+    """
+    Make the provers spread their independent MSMs and folding loops over the `n_workers` workers of `new_executor`,
+    which would usually be a `concurrent.futures.ProcessPoolExecutor`. Pass `None` to run everything in this process
+    again. The proofs are the same either way.
+    """
+    global executor, executor_workers
+    executor, executor_workers = new_executor, n_workers
+
+def msm_job(encoded_pts: bytes, scalars: list) -> bytes:
+    # Helper: Runs an MSM in a worker process.
+    return encode_affine([msm(decode_affine(encoded_pts), scalars)])
+
+def fold_job(encoded_left: bytes, encoded_right: bytes, x) -> bytes:
+    # Helper: Folds a chunk of points in a worker process.
+    return encode_affine(fold_chunk(decode_affine(encoded_left), decode_affine(encoded_right), x))
+
+def fold_chunk(left: list, right: list, x) -> list:
+    # Helper: Folds points in this process.
+    vec_x = x if isinstance(x, list) else [x] * len(right)
+    if len(left) < BATCH_FOLD_THRESHOLD:
+        return [curve.add(L, multiply(R, x_i)) for (L, R, x_i) in zip(left, right, vec_x)]
+    folded = batch_add(batch_normalize(left), batch_multiply(batch_normalize(right), vec_x))
+    return [curve.Z1 if pt is None else curve.from_affine(*pt) for pt in folded]
+
+def msm_batch(jobs: list) -> list:
+    """
+    Compute several independent MSMs, each given as a (points, scalars) pair.
+
+    If an executor is set, the MSMs run in its workers, except for the ones over fixed-base points: their tables stay
+    in this process, and they are computed here while the workers are busy.
+    """
+    if executor is None:
+        return [msm(pts, scalars) for pts, scalars in jobs]
+
+    jobs = [unscale(pts, scalars) for pts, scalars in jobs]
+    futures = [None if any(isinstance(pt, FixedBasePoint) for pt in pts) else
+               executor.submit(msm_job, encode_affine(pts), scalars) for pts, scalars in jobs]
+    results = [msm(pts, scalars) if future is None else None for (pts, scalars), future in zip(jobs, futures)]
+    return [result if future is None else decode_affine(future.result())[0] for result, future in zip(results, futures)]
+
+def fold(left: list, right: list, x) -> list:
+    """
+    Fold two halves of a vector of points into `[L + x * R for L, R in zip(left, right)]`. `x` can also be a list, with
+    a different scalar for every point of `right`. The halves of a `ScaledBasis` fold into another `ScaledBasis`.
+
+    Long vectors are processed at once in affine coordinates (see `batch_multiply()`), with one shared recoding of `x`
+    and a single field inversion per step of the double-and-add loop, while short vectors are folded point by point. If
+    an executor is set, the work is split in chunks over its workers.
+    """
+    assert len(left) == len(right)
+
+    if isinstance(left, ScaledBasis):
+        # f_L * L + x * f_R * R = f_L * (L + (x * f_R / f_L) * R): fold the base points and keep the left factors
+        vec_x = x if isinstance(x, list) else [x] * len(right)
+        ratios = [x_i * f_R * f_L_inv % MODULUS for x_i, f_R, f_L_inv in zip(vec_x, right.factors, batch_inv(left.factors))]
+        return ScaledBasis(fold(left.points, right.points, ratios), left.factors)
+
+    if executor is None or len(left) < 2 * executor_workers:
+        return fold_chunk(left, right, x)
+
+    chunk = -(-len(left) // executor_workers)
+    futures = [executor.submit(fold_job, encode_affine(left[i:i+chunk]), encode_affine(right[i:i+chunk]),
+                               x[i:i+chunk] if isinstance(x, list) else x)
+               for i in range(0, len(left), chunk)]
+    return [pt for future in futures for pt in decode_affine(future.result())]
+
 # Returns the (left|right) half of a container
 def left_half(x):
     return x[:len(x)//2]
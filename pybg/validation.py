@@ -0,0 +1,120 @@
+"""
+Validation of the points that the verifier gets from the outside: the input and output vectors of a shuffle, and the
+points of its proof. The verification equations only mean something if all of them are in G1, the prime-order
+subgroup of the curve.
+
+Points are validated in batches: the on-curve check works on affine coordinates obtained with a single field inversion
+for the whole batch, and the subgroup checks (see `in_subgroup()`) can be spread over the workers of the executor. The
+points that pass are remembered, so a point that shows up again (e.g. the outputs of a shuffle, which get shuffled again
+by the next shuffler) is only checked once.
+
+A cheaper batched subgroup test, checking a random linear combination of the points, would not be sound here: the
+cofactor of G1 is a multiple of 3, so a point with a component of order 3 would get through with probability 1/3.
+"""
+
+import dataclasses
+from collections import OrderedDict
+
+import curve
+
+from bg_types import G1Point, G1PointVector
+import util
+from util import batch_normalize, encode_affine, decode_affine
+
+# Absolute value of the BLS parameter z = -0xd201000000010000
+BLS_Z = 0xd201000000010000
+
+# Number of valid points remembered by `validate_points()`
+VALIDATION_CACHE_SIZE = 1 << 16
+
+# Whether `validate_points()` checks anything. Set with `set_enabled()`.
+enabled = True
+
+validated = OrderedDict() # coordinates of the points that passed validation, least recently used first
+
+def set_enabled(new_enabled: bool):
+    """
+    Turn point validation on or off. It is on by default, and should only be turned off when all the points come from
+    a trusted source.
+    """
+    global enabled
+    enabled = new_enabled
+
+def validate_points(pts: list):
+    """
+    Check that all the points of `pts` are on the curve and in G1. Fails with an `AssertionError` if they are not, and
+    does nothing if validation is turned off.
+    """
+    if not enabled:
+        return
+
+    # Only check the points we haven't seen before
+    new_pts = {}
+    for pt in pts:
+        key = tuple(curve.coordinates(pt))
+        if key in validated:
+            validated.move_to_end(key)
+        else:
+            new_pts[key] = pt
+    if not new_pts:
+        return
+
+    assert all(is_on_curve(list(new_pts.values()))), "point is not on the curve"
+    assert all(in_subgroup(list(new_pts.values()))), "point is not in G1"
+
+    validated.update(dict.fromkeys(new_pts, True))
+    while len(validated) > VALIDATION_CACHE_SIZE:
+        validated.popitem(last=False)
+
+def is_on_curve(pts: list) -> list:
+    """Check which points of `pts` are on the curve, using a single field inversion for the whole batch"""
+    p = curve.field_modulus
+    out = []
+    for (X, Y, Z), pt in zip([curve.coordinates(pt) for pt in pts], batch_normalize(pts)):
+        if pt is None:
+            # The only point with Z = 0 is the point at infinity (0 : Y : 0)
+            out.append(X % p == 0 and Y % p != 0)
+        else:
+            x, y = pt
+            out.append((y * y - x * x * x - curve.b) % p == 0)
+    return out
+
+def in_subgroup(pts: list) -> list:
+    """
+    Check which points of `pts`, all on the curve, are in G1. If an executor is set (see `util.set_executor()`), the
+    points are split over its workers.
+
+    This is the test of Scott ("A note on group membership tests for G1, G2 and GT on BLS pairing-friendly curves"):
+    a point `P` of the curve is in G1 exactly when the GLV endomorphism acts on it like on G1, that is when
+    `endomorphism(P) = (z^2 - 1) * P`. Multiplying by the sparse `z` twice takes 126 doublings and 10 additions, about
+    half the cost of a multiplication by a full scalar.
+    """
+    if util.executor is None or len(pts) < 2 * util.executor_workers:
+        return [is_in_subgroup(pt) for pt in pts]
+
+    chunk = -(-len(pts) // util.executor_workers)
+    futures = [util.executor.submit(subgroup_job, encode_affine(pts[i:i+chunk])) for i in range(0, len(pts), chunk)]
+    return [result for future in futures for result in future.result()]
+
+def is_in_subgroup(pt) -> bool:
+    # Helper: Runs the subgroup check of `in_subgroup()` on a single point.
+    # `curve.multiply()` does not reduce its scalar, so this works for points outside of G1 too.
+    z_z_pt = curve.multiply(curve.multiply(pt, BLS_Z), BLS_Z)
+    return curve.eq(curve.add(curve.endomorphism(pt), pt), z_z_pt)
+
+def subgroup_job(encoded_pts: bytes) -> list:
+    # Helper: Runs the subgroup check of `in_subgroup()` in a worker process.
+    return [is_in_subgroup(pt) for pt in decode_affine(encoded_pts)]
+
+def get_proof_points(proof) -> list:
+    """Return all the points of a proof, including the ones of its subproofs"""
+    pts = []
+    for field in dataclasses.fields(proof):
+        value = getattr(proof, field.name)
+        if field.type is G1Point:
+            pts.append(value)
+        elif field.type is G1PointVector:
+            pts += list(value)
+        elif dataclasses.is_dataclass(value):
+            pts += get_proof_points(value)
+    return pts